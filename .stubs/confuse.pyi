@@ -36,3 +36,5 @@ class Configuration:
     def __getitem__(self, item: str) -> ConfigView: ...
     def __setitem__(self, item: str, value: Union[str, int, bool]) -> None: ...
     def set_args(self, _: Dict[str, Any]) -> None: ...
+    def set(self, value: Any) -> None: ...
+    def flatten(self, redact: bool = False) -> Dict[str, Any]: ...
@@ -1,8 +1,11 @@
-from typing import Any, Iterable, Tuple, List
+from typing import Any, Iterable, Optional, Tuple, List
 
 SUB: int
 SUBSCRIBE: int
 PUB: int
+XPUB: int
+REQ: int
+REP: int
 
 POLLIN: int
 POLLOUT: int
@@ -11,10 +14,12 @@ class Socket:
     def setsockopt_string(self, _1: int, _2: str) -> None: ...
     def subscribe(self, _: bytes) -> None: ...
     def send_string(self, _: str) -> None: ...
+    def send(self, _: bytes) -> None: ...
     def send_json(self, _: Any) -> None: ...
     def connect(self, _: str) -> None: ...
     def disconnect(self, address: str) -> None: ...
     def bind(self, _: str) -> None: ...
+    def recv(self) -> bytes: ...
     def recv_json(self) -> Any: ...
     def poll(self, timeout: float, flags: int = ...) -> int: ...
     def __enter__(self) -> Socket: ...
@@ -23,6 +28,18 @@ class Socket:
     def hwm(self) -> int: ...
     @hwm.setter
     def hwm(self, value: int) -> None: ...
+    @property
+    def linger(self) -> int: ...
+    @linger.setter
+    def linger(self, value: int) -> None: ...
+    @property
+    def req_relaxed(self) -> bool: ...
+    @req_relaxed.setter
+    def req_relaxed(self, value: bool) -> None: ...
+    @property
+    def req_correlate(self) -> bool: ...
+    @req_correlate.setter
+    def req_correlate(self, value: bool) -> None: ...
 
 class Context:
     def socket(self, _: int) -> Socket: ...
@@ -32,6 +49,10 @@ class Context:
     @classmethod
     def instance(cls) -> Context: ...
 
+class Poller:
+    def register(self, socket: Socket, flags: int = ...) -> None: ...
+    def poll(self, timeout: Optional[float] = ...) -> List[Tuple[Socket, int]]: ...
+
 def select(
     rlist: Iterable[Socket],
     wlist: Iterable[Socket],
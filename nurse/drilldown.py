@@ -126,49 +126,55 @@ class DisplayBox(DisplayBoxBase):
             else None
         )
 
-        if gen is None:
+        snapshot = gen.snapshot if gen is not None else None
+
+        if snapshot is None:
             value = None
         elif self.key == "Avg Flow":
-            value = gen.average_flow[self.window]
+            value = snapshot.average_flow[self.window]
         elif self.key == "Avg Pressure":
-            value = gen.average_pressure[self.window]
+            value = snapshot.average_pressure[self.window]
         else:
-            value = gen.cumulative.get(self.key)
+            value = snapshot.cumulative.get(self.key)
 
         if value is not None:
-            assert gen is not None, "Should not be possible if value is not None"
+            assert snapshot is not None, "Should not be possible if value is not None"
 
             self.cumulative.setText(format(value, self.fmt))
-            if f"{self.key} Max" in gen.alarms:
+            if f"{self.key} Max" in snapshot.alarms:
                 self.status = (
                     Status.ALERT_SILENT
                     if isinstance(gen, RemoteGenerator)
-                    and gen.time_left is not None
-                    and gen.time_left > 0
+                    and snapshot.time_left is not None
+                    and snapshot.time_left > 0
                     else Status.ALERT
                 )
-                item = gen.alarms[f"{self.key} Max"]
+                item = snapshot.alarms[f"{self.key} Max"]
                 if "first timestamp" in item:
-                    over = (gen.realtime[-1] - item["first timestamp"]) + gen.tardy
+                    over = (
+                        snapshot.realtime[-1] - item["first timestamp"]
+                    ) + snapshot.tardy
                     self.since.setText(f"Over for {over:.0f} s")
-            elif f"{self.key} Min" in gen.alarms:
+            elif f"{self.key} Min" in snapshot.alarms:
                 self.status = (
                     Status.ALERT_SILENT
                     if isinstance(gen, RemoteGenerator)
-                    and gen.time_left is not None
-                    and gen.time_left > 0
+                    and snapshot.time_left is not None
+                    and snapshot.time_left > 0
                     else Status.ALERT
                 )
-                item = gen.alarms[f"{self.key} Min"]
+                item = snapshot.alarms[f"{self.key} Min"]
                 if "first timestamp" in item:
-                    under = (gen.realtime[-1] - item["first timestamp"]) + gen.tardy
+                    under = (
+                        snapshot.realtime[-1] - item["first timestamp"]
+                    ) + snapshot.tardy
                     self.since.setText(f"Under for {under:.0f} s")
             else:
                 self.status = (
                     Status.SILENT
                     if isinstance(gen, RemoteGenerator)
-                    and gen.time_left is not None
-                    and gen.time_left > 0
+                    and snapshot.time_left is not None
+                    and snapshot.time_left > 0
                     else Status.OK
                 )
                 self.since.setText("")
@@ -258,10 +264,11 @@ class CO2Displays(QtWidgets.QWidget):
         gen: Optional[GeneratorGUI] = self.parent().gen if self.parent() else None
 
         if gen is not None:
-            if len(gen.co2):
-                co2 = np.mean(gen.co2[-5:])
-                co2_temp = np.mean(gen._co2_temp[-5:])
-                humidity = np.mean(gen._humidity[-5:])
+            snapshot = gen.snapshot
+            if len(snapshot.co2):
+                co2 = np.mean(snapshot.co2[-5:])
+                co2_temp = np.mean(snapshot.co2_temp[-5:])
+                humidity = np.mean(snapshot.humidity[-5:])
 
                 self.co2.cumulative.setText(f"{co2:.0f}")
                 self.co2_temp.cumulative.setText(f"{co2_temp:.1f}")
@@ -270,7 +277,9 @@ class CO2Displays(QtWidgets.QWidget):
                 if not self.isVisible():
                     self.setVisible(True)
 
-                alarming = "Avg CO2 Max" in gen.alarms or "Avg CO2 Min" in gen.alarms
+                alarming = (
+                    "Avg CO2 Max" in snapshot.alarms or "Avg CO2 Min" in snapshot.alarms
+                )
                 self.co2.status = Status.ALERT if alarming else Status.OK
 
 
@@ -857,170 +866,155 @@ class PatientDrilldownWidget(QtWidgets.QFrame):
             gis = GraphInfo()
             scroll = self.parent().header.mode_scroll
 
-            with self.gen.lock:
-                if first or not self.parent().header.freeze_btn.checkState():
-                    avg_window = config["global"]["avg-window"].get(int)
+            snapshot = self.gen.snapshot
 
-                    select = (
-                        slice(np.searchsorted(-self.gen.time, -32), None)
-                        if len(self.gen.time)
-                        else slice(None)
-                    )
-                    co2_select = (
-                        slice(
-                            np.searchsorted(-self.gen.co2_time, -35),
-                            None,
-                        )
-                        if len(self.gen.co2_time)
-                        else slice(None)
-                    )
-
-                    # If we have CO2 sensor data
-                    if len(self.gen.co2):
-                        # Add the plot if not added already
-                        if self.co2_plot is None:
-                            self.co2_plot = self.set_plot("co2")
-                            self.graphs["volume"].setLabel("bottom", "", "")
-                            self.co2_plot.setLabel("bottom", "Time", "s")
-                            self.graphs[gis.graph_labels[2]].setXLink(self.co2_plot)
-
-                    labels = gis.all_graph_labels if self.co2_plot else gis.graph_labels
-                    for key in labels:
-                        if key == "co2":
-                            xvalues = self.gen.co2_time[co2_select]
-                            orig_yvalues = self.gen.co2[co2_select]
-                            yvalues = rolling_mean(orig_yvalues, 5)
-                            key_cap = "CO2"
-                        else:
-                            xvalues = self.gen.time[select]
-                            yvalues = getattr(self.gen, key)[select]
-                            key_cap = key.capitalize()
-
-                        if key == "volume":
-                            yvalues = yvalues / 1000
-
-                        if scroll:
-                            self.curves[key].setData(xvalues, yvalues)
-                            x, _y = self.curves2[key].getData()
-                            if x is not None and len(x) > 0:
-                                self.curves2[key].setData(
-                                    x=np.array([], dtype=float),
-                                    y=np.array([], dtype=float),
-                                )
-
-                        else:
-                            realtime = (
-                                self.gen.co2_realtime[co2_select]
-                                if key == "co2"
-                                else self.gen.realtime[select]
-                            )
+            if first or not self.parent().header.freeze_btn.checkState():
+                avg_window = config["global"]["avg-window"].get(int)
 
-                            # This should never be empty, but quit here if it is
-                            if not len(realtime):
-                                continue
+                select = snapshot.within_last(32)
+                co2_select = snapshot.co2_within_last(35)
+
+                # If we have CO2 sensor data
+                if len(snapshot.co2):
+                    # Add the plot if not added already
+                    if self.co2_plot is None:
+                        self.co2_plot = self.set_plot("co2")
+                        self.graphs["volume"].setLabel("bottom", "", "")
+                        self.co2_plot.setLabel("bottom", "Time", "s")
+                        self.graphs[gis.graph_labels[2]].setXLink(self.co2_plot)
+
+                labels = gis.all_graph_labels if self.co2_plot else gis.graph_labels
+                for key in labels:
+                    if key == "co2":
+                        xvalues = snapshot.co2_time_ago[co2_select] + snapshot.tardy
+                        orig_yvalues = snapshot.co2[co2_select]
+                        yvalues = rolling_mean(orig_yvalues, 5)
+                        key_cap = "CO2"
+                    else:
+                        xvalues = snapshot.time_ago[select] + snapshot.tardy
+                        yvalues = getattr(snapshot, key)[select]
+                        key_cap = key.capitalize()
 
-                            last = realtime[-1]
-                            breakpt = np.searchsorted(realtime, last - last % 30)
-                            gap = 25
+                    if key == "volume":
+                        yvalues = yvalues / 1000
 
-                            self.curves[key].setData(
-                                30 - (realtime[breakpt:] % 30),
-                                yvalues[breakpt:],
-                            )
+                    if scroll:
+                        self.curves[key].setData(xvalues, yvalues)
+                        x, _y = self.curves2[key].getData()
+                        if x is not None and len(x) > 0:
                             self.curves2[key].setData(
-                                30 - (realtime[gap:breakpt] % 30),
-                                yvalues[gap:breakpt],
+                                x=np.array([], dtype=float),
+                                y=np.array([], dtype=float),
                             )
 
-                        min_key = f"Avg {key_cap} Min"
-                        max_key = f"Avg {key_cap} Max"
-                        if min_key in self.gen.rotary:
-                            self.lower[key].setData(
-                                [0, 30], [self.gen.rotary[min_key].value] * 2
-                            )
-                        if max_key in self.gen.rotary:
-                            self.upper[key].setData(
-                                [0, 30], [self.gen.rotary[max_key].value] * 2
-                            )
+                    else:
+                        realtime = (
+                            snapshot.co2_realtime[co2_select]
+                            if key == "co2"
+                            else snapshot.realtime[select]
+                        )
 
-                        if key == "flow":
-                            self.current[key].setData(
-                                [0, avg_window], [self.gen.average_flow[avg_window]] * 2
-                            )
-                        elif key == "pressure":
-                            self.current[key].setData(
-                                [0, avg_window],
-                                [self.gen.average_pressure[avg_window]] * 2,
-                            )
-                        elif key == "co2":
-                            avg_co2 = float(np.mean(orig_yvalues[xvalues < avg_window]))
-                            self.current[key].setData(
-                                [0, avg_window],
-                                [avg_co2] * 2,
-                            )
+                        # This should never be empty, but quit here if it is
+                        if not len(realtime):
+                            continue
+
+                        last = realtime[-1]
+                        breakpt = np.searchsorted(realtime, last - last % 30)
+                        gap = 25
 
-                    for i, phase in enumerate(self.phases):
-                        range = slice(-(i + 1) * 50 * 3 - 1, -i * 50 * 3)
-                        phase.setData(
-                            self.gen.pressure[range], self.gen.volume[range] / 1000
+                        self.curves[key].setData(
+                            30 - (realtime[breakpt:] % 30),
+                            yvalues[breakpt:],
+                        )
+                        self.curves2[key].setData(
+                            30 - (realtime[gap:breakpt] % 30),
+                            yvalues[gap:breakpt],
                         )
 
-                    if self.status != self.gen.status:
-                        self.status = self.gen.status
-                    self.displays.update_cumulative()
-                    self.displays.update_limits()
-                    self.co2_widget.update_co2()
+                    min_key = f"Avg {key_cap} Min"
+                    max_key = f"Avg {key_cap} Max"
+                    if min_key in self.gen.rotary:
+                        self.lower[key].setData(
+                            [0, 30], [self.gen.rotary[min_key].value] * 2
+                        )
+                    if max_key in self.gen.rotary:
+                        self.upper[key].setData(
+                            [0, 30], [self.gen.rotary[max_key].value] * 2
+                        )
 
-                    time_str = (
-                        "now" if self.gen.tardy < 1 else f"{self.gen.tardy:.0f}s ago"
-                    )
-                    date_str = (
-                        "---"
-                        if self.gen.last_update is None
-                        else format(self.gen.last_update, "%m-%d-%Y %H:%M:%S")
+                    if key == "flow":
+                        self.current[key].setData(
+                            [0, avg_window], [snapshot.average_flow[avg_window]] * 2
+                        )
+                    elif key == "pressure":
+                        self.current[key].setData(
+                            [0, avg_window],
+                            [snapshot.average_pressure[avg_window]] * 2,
+                        )
+                    elif key == "co2":
+                        self.current[key].setData(
+                            [0, avg_window],
+                            [snapshot.average_co2[avg_window]] * 2,
+                        )
+
+                for i, phase in enumerate(self.phases):
+                    range = slice(-(i + 1) * 50 * 3 - 1, -i * 50 * 3)
+                    phase.setData(
+                        snapshot.pressure[range], snapshot.volume[range] / 1000
                     )
 
-                    for breath in reversed(self.gen.breaths):
-                        if "full timestamp" in breath:
-                            time_since = (
-                                self.gen.realtime[-1] - breath["full timestamp"]
-                            ) + self.gen.tardy
-                            breath_str = f"Most recent breath: {time_since:.0f} s ago"
-                            break
-                    else:
-                        breath_str = "No detected breaths yet"
+                if self.status != snapshot.status:
+                    self.status = snapshot.status
+                self.displays.update_cumulative()
+                self.displays.update_limits()
+                self.co2_widget.update_co2()
+
+                time_str = "now" if snapshot.tardy < 1 else f"{snapshot.tardy:.0f}s ago"
+                date_str = (
+                    "---"
+                    if snapshot.last_update is None
+                    else format(snapshot.last_update, "%m-%d-%Y %H:%M:%S")
+                )
 
-                    self.last_ts.setText(
-                        f"Updated: {time_str} @ {date_str}\n{breath_str}"
+                for breath in reversed(snapshot.breaths):
+                    if "full timestamp" in breath:
+                        time_since = (
+                            snapshot.realtime[-1] - breath["full timestamp"]
+                        ) + snapshot.tardy
+                        breath_str = f"Most recent breath: {time_since:.0f} s ago"
+                        break
+                else:
+                    breath_str = "No detected breaths yet"
+
+                self.last_ts.setText(f"Updated: {time_str} @ {date_str}\n{breath_str}")
+
+                if (
+                    isinstance(self.gen, RemoteGenerator)
+                    and snapshot.last_interact is not None
+                    and snapshot.current_monotonic is not None
+                ):
+                    last_interaction = (
+                        snapshot.tardy
+                        + snapshot.current_monotonic
+                        - snapshot.last_interact
+                    )
+                    self.last_interation.setText(
+                        f"Last interaction at bedside: {last_interaction:.0f} s ago"
                     )
 
-                    if (
-                        isinstance(self.gen, RemoteGenerator)
-                        and self.gen.last_interact is not None
-                        and self.gen.current_monotonic is not None
-                    ):
-                        last_interaction = (
-                            self.gen.tardy
-                            + self.gen.current_monotonic
-                            - self.gen.last_interact
-                        )
-                        self.last_interation.setText(
-                            f"Last interaction at bedside: {last_interaction:.0f} s ago"
-                        )
-
-                    if (
-                        isinstance(self.gen, RemoteGenerator)
-                        and self.gen.time_left is not None
-                        and self.gen.time_left > 0
-                    ):
-                        self.time_left.setText(
-                            f"Silenced, time remaining: {self.gen.time_left:.0f} s"
-                        )
-                        if not self.time_left.isVisible():
-                            self.time_left.setVisible(True)
+                if (
+                    isinstance(self.gen, RemoteGenerator)
+                    and snapshot.time_left is not None
+                    and snapshot.time_left > 0
+                ):
+                    self.time_left.setText(
+                        f"Silenced, time remaining: {snapshot.time_left:.0f} s"
+                    )
+                    if not self.time_left.isVisible():
+                        self.time_left.setVisible(True)
 
-                    elif self.time_left.isVisible():
-                        self.time_left.setVisible(False)
+                elif self.time_left.isVisible():
+                    self.time_left.setVisible(False)
 
             patient = self.parent()
             main_stack = patient.parent().parent().main_stack
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import pyqtgraph as pg
-import numpy as np
 
 from datetime import datetime
 
@@ -225,42 +224,38 @@ class PatientSensor(DraggableSensor):
         gis = GraphInfo()
         avg_window = config["global"]["avg-window"].get(int)
 
-        with self.gen.lock:
-            # Fill in the data
-            for key in gis.graph_labels:
-                if self.isVisible():
-                    select = (
-                        slice(np.searchsorted(-self.gen.time, -15), None)
-                        if len(self.gen.time)
-                        else slice(None)
-                    )
-                    xvalues = self.gen.time[select]
-                    yvalues = getattr(self.gen, key)[select]
-
-                    self.curves[key].setData(xvalues, yvalues)
-                else:
-                    self.curves[key].setData(x=None, y=None)
-
-            # Change of status requires a background color change
-            self.status = self.gen.status
-
-            alarming_quanities = {key.rsplit(maxsplit=1)[0] for key in self.gen.alarms}
-
-            for key in self.values:
-                value: Optional[float]
-
-                if key == "Avg Flow":
-                    value = self.gen.average_flow[avg_window]
-                elif key == "Avg Pressure":
-                    value = self.gen.average_pressure[avg_window]
-                else:
-                    value = self.gen.cumulative.get(key)
-
-                self.values.set_value(
-                    key,
-                    value=value,
-                    ok=key not in alarming_quanities,
-                )
+        snapshot = self.gen.snapshot
+
+        # Fill in the last 15 seconds, decimated to about one point per pixel
+        for key in gis.graph_labels:
+            if self.isVisible():
+                width = int(self.graph[key].getViewBox().width())
+                xvalues, yvalues = snapshot.plot_data(key, 15, max(width, 1))
+
+                self.curves[key].setData(xvalues, yvalues)
+            else:
+                self.curves[key].setData(x=None, y=None)
+
+        # Change of status requires a background color change
+        self.status = snapshot.status
+
+        alarming_quanities = {key.rsplit(maxsplit=1)[0] for key in snapshot.alarms}
+
+        for key in self.values:
+            value: Optional[float]
+
+            if key == "Avg Flow":
+                value = snapshot.average_flow[avg_window]
+            elif key == "Avg Pressure":
+                value = snapshot.average_pressure[avg_window]
+            else:
+                value = snapshot.cumulative.get(key)
+
+            self.values.set_value(
+                key,
+                value=value,
+                ok=key not in alarming_quanities,
+            )
 
     def mouseReleaseEvent(self, ev: QtGui.QMouseEvent):
         if (
@@ -33,6 +33,7 @@ from nurse.gen_record_gui import (
 )
 
 from processor.listener import FindBroadcasts
+from processor.scheduler import AnalysisScheduler
 from processor.logging import make_nested_logger
 
 
@@ -70,6 +71,9 @@ class MainStack(QtWidgets.QWidget):
         self.listener = listener
         self.sim = sim
 
+        # Runs the analysis of all generators on a shared pool of threads
+        self.scheduler = AnalysisScheduler()
+
         layout = VBoxLayout(self)
 
         self.header = MainHeaderWidget(self)
@@ -103,7 +107,7 @@ class MainStack(QtWidgets.QWidget):
                         gen_record=GenRecordGUI(local_logger),
                     )
                 )
-                gen.run()  # Close must be called
+                gen.run(self.scheduler)  # Close must be called
                 self.add_item(gen)
         elif fresh:
             self.grid_layout.addWidget(WaitingWidget())
@@ -124,7 +128,7 @@ class MainStack(QtWidgets.QWidget):
                             local_logger, ip_address=restore.ip_address
                         ),
                     )
-                    gen.run()
+                    gen.run(self.scheduler)
                     self.add_item(gen, restore.position)
 
         self.qTimer = QtCore.QTimer()
@@ -174,7 +178,7 @@ class MainStack(QtWidgets.QWidget):
             logger=local_logger,
             gen_record=GenRecordGUI(local_logger, ip_address=addr),
         )
-        gen.run()
+        gen.run(self.scheduler)
         self.add_item(gen)
 
     def add_new_generator(self, i: int):
@@ -184,7 +188,7 @@ class MainStack(QtWidgets.QWidget):
             logger=local_logger,
             gen_record=GenRecordGUI(local_logger),
         )
-        gen.run()
+        gen.run(self.scheduler)
         self.add_item(gen)
 
     def _get_next_empty(self) -> Tuple[int, int]:
@@ -420,4 +424,5 @@ class MainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, evt):
         for graph in self.main_stack.graphs.values():
             graph.gen.close()
+        self.main_stack.scheduler.close()
         super().closeEvent(evt)
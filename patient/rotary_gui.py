@@ -51,7 +51,7 @@ class SelectionSettingGUI(QtWidgets.QComboBox):
 
     @Slot(int)
     def change_rotary(self, index: int):
-        self.setting._value = index
+        self.setting.value = self.setting._listing[index]
         self.rotary.changed()
         print(self.setting)
 
@@ -97,7 +97,7 @@ class IncrSettingGUI(QtWidgets.QDoubleSpinBox):
 
     @Slot(float)
     def change_rotary(self, value: float):
-        self.setting._value = value
+        self.setting.value = value
         self.rotary.changed()
 
 
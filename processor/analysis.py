@@ -1,12 +1,25 @@
 import numpy as np
 import scipy.integrate
 import scipy.signal
-from typing import Iterable, Dict
+from typing import (
+    Any,
+    Iterable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 import logging
 import enum
 
 from processor.rotary import LocalRotary
 from processor.config import config
+from processor.rolling import Rolling, RollingSum, within_last
+from processor.breaths import BREATH_FIELDS, BreathRecord, as_records
 
 
 class MaxMin(enum.Enum):
@@ -18,53 +31,117 @@ def pressure_deglitch_smooth(
     original_pressure,
     deglitch_cut=0.1,
 ):
+    """
+    Works along the last axis, so a stack of equal-length windows (one row per
+    patient) can be deglitched in one call.
+    """
+
     # 1/4 P[i-2] + 1/4 P[i-1] + 0 P[i] + 1/4 P[i+1] + 1/4 P[i+2] kernel
     pressure_average = 0.25 * (
-        original_pressure[4:]
-        + original_pressure[3:-1]
-        + original_pressure[1:-3]
-        + original_pressure[:-4]
+        original_pressure[..., 4:]
+        + original_pressure[..., 3:-1]
+        + original_pressure[..., 1:-3]
+        + original_pressure[..., :-4]
     )
 
     # deglitching: large exclusions from the average of neighbors is
     #              replaced with an average of neighbors
-    toreplace22 = abs(pressure_average - original_pressure[2:-2]) > deglitch_cut
-    toreplace = np.zeros(len(original_pressure), np.bool_)
-    toreplace[2:-2] = toreplace22
+    toreplace22 = abs(pressure_average - original_pressure[..., 2:-2]) > deglitch_cut
+    toreplace = np.zeros(original_pressure.shape, np.bool_)
+    toreplace[..., 2:-2] = toreplace22
 
     pressure_out = original_pressure.copy()
     pressure_out[toreplace] = pressure_average[toreplace22]
 
     # smoothing: 2/5 P[i-2] + 1/5 P[i] + 2/5 P[i+2] kernel
-    pressure_out[1:-1] = (
-        0.4 * pressure_out[2:] + 0.2 * pressure_out[1:-1] + 0.4 * pressure_out[:-2]
+    pressure_out[..., 1:-1] = (
+        0.4 * pressure_out[..., 2:]
+        + 0.2 * pressure_out[..., 1:-1]
+        + 0.4 * pressure_out[..., :-2]
     )
     return pressure_out
 
 
 def _compute_cumulative_length(
-    length: int, time: np.ndarray, window: np.ndarray
+    length: int,
+    time: np.ndarray,
+    window: Union[np.ndarray, RollingSum],
+    end: Optional[float] = None,
 ) -> float:
     if len(time) == 0:
         return 0.0
     try:
-        ind = np.searchsorted(time, time[-1] - length * 1000)
+        if end is None:
+            select = within_last(time, length * 1000)
+        else:
+            # Less than length seconds before end, including any after it
+            start = np.searchsorted(time, end - length * 1000, side="right")
+            select = slice(int(start), None)
     except ValueError:
         print("Time:", time)
         print("Value:", time[-1] - length * 1000)
         raise
-    return np.mean(window[ind:])
+    if isinstance(window, RollingSum):
+        return window.mean_last(len(time) - select.start)
+    return np.mean(window[select])
 
 
 def compute_cumulative(
-    lengths: Iterable[int], time: np.ndarray, window: np.ndarray
+    lengths: Iterable[int],
+    time: np.ndarray,
+    window: Union[np.ndarray, RollingSum],
+    end: Optional[float] = None,
 ) -> Dict[int, float]:
+    """
+    The mean of the window over the last ``length`` seconds, for each length.
+    If the window is a RollingSum, each mean is O(1) after the time lookup.
+
+    If end is given, the means are of the samples less than ``length`` seconds
+    before it instead (CO2 is timed from the last flow sample).
+    """
 
     return {
-        length: _compute_cumulative_length(length, time, window) for length in lengths
+        length: _compute_cumulative_length(length, time, window, end)
+        for length in lengths
     }
 
 
+def batch_compute_cumulative(
+    lengths: Iterable[int],
+    times: Sequence[np.ndarray],
+    windows: Sequence[Union[np.ndarray, RollingSum]],
+    ends: Optional[Sequence[Optional[float]]] = None,
+) -> List[Dict[int, float]]:
+    """
+    compute_cumulative for many patients, one time array, window, and end (if
+    given) each. All the lengths of a patient are looked up at once, and read
+    from the running sums if the window is a RollingSum. Returns one dict of
+    means per patient.
+    """
+
+    lengths = list(lengths)
+    spans = np.asarray(lengths, dtype=np.double) * 1000
+    if ends is None:
+        ends = [None] * len(times)
+
+    results = []
+    for time, window, end in zip(times, windows, ends):
+        if len(time) == 0:
+            results.append({length: 0.0 for length in lengths})
+            continue
+        if end is None:
+            starts = np.searchsorted(time, time[-1] - spans, side="left")
+        else:
+            starts = np.searchsorted(time, end - spans, side="right")
+        if isinstance(window, RollingSum):
+            means = window.means_last(len(time) - starts).tolist()
+        else:
+            means = [np.mean(window[start:]) for start in starts]
+        results.append(dict(zip(lengths, means)))
+
+    return results
+
+
 def flow_to_volume(realtime, old_realtime, flow, old_volume, critical_frequency):
     if old_realtime is None:
         shift = 0
@@ -78,6 +155,122 @@ def flow_to_volume(realtime, old_realtime, flow, old_volume, critical_frequency)
     )
 
 
+class VolumeIntegrator:
+    """
+    Incremental version of flow_to_volume, for use on a rolling window.
+
+    The running integral and the high-pass filter state are carried between
+    calls, so each update only integrates and filters the samples that are
+    newer than the last one seen. The filtered volume is injected into the
+    ``volume`` Rolling buffer, which should match the window size of the input.
+    """
+
+    def __init__(self, critical_frequency: float, volume: Rolling):
+        self._sos = scipy.signal.butter(1, critical_frequency, "highpass", output="sos")
+        self._volume = volume
+        self.clear()
+
+    def clear(self) -> None:
+        self._volume.clear()
+        self._zi = np.zeros((self._sos.shape[0], 2))
+        self._integral = 0.0
+        self._last_time: Optional[float] = None
+        self._last_flow = 0.0
+
+    def update(self, realtime: np.ndarray, flow: np.ndarray) -> np.ndarray:
+        """
+        Given the current window of realtime and flow, integrate the new samples
+        and return the volume for the window.
+        """
+
+        if len(realtime) == 0:
+            return np.asarray(self._volume)
+
+        # The device clock went backwards (restart); start over
+        if self._last_time is not None and realtime[-1] < self._last_time:
+            self.clear()
+
+        if self._last_time is None:
+            integral = scipy.integrate.cumtrapz(flow * 1000, realtime / 60.0, initial=0)
+        else:
+            start = np.searchsorted(realtime, self._last_time, side="right")
+            if start == len(realtime):
+                return np.asarray(self._volume)
+
+            # Include the last sample seen to integrate across the boundary
+            times = np.concatenate(([self._last_time], realtime[start:]))
+            flows = np.concatenate(([self._last_flow], flow[start:]))
+            integral = self._integral + scipy.integrate.cumtrapz(
+                flows * 1000, times / 60.0
+            )
+
+        volume, self._zi = scipy.signal.sosfilt(self._sos, integral, zi=self._zi)
+        self._volume.inject(volume)
+
+        self._integral = integral[-1]
+        self._last_time = realtime[-1]
+        self._last_flow = flow[-1]
+
+        return np.asarray(self._volume)
+
+
+class BreathTrigger:
+    """
+    A cheap check, run on each batch of new flow samples, for whether a breath
+    may have just completed: the flow crossing from exhaling (below
+    -hysteresis) to inhaling (above +hysteresis). The hysteresis keeps noise
+    around zero flow from triggering.
+
+    The flow is measured from a baseline, like the mean of the window, since a
+    bias flow can keep the raw flow from ever going below zero.
+    """
+
+    def __init__(self, hysteresis: float):
+        self.hysteresis = hysteresis
+        self.clear()
+
+    def clear(self) -> None:
+        self._last_time: Optional[float] = None
+        self._exhaling = False
+
+    def update(
+        self, realtime: np.ndarray, flow: np.ndarray, baseline: float = 0.0
+    ) -> Optional[float]:
+        """
+        Given the current window of realtime and flow, check the new samples.
+        Returns the time of the last exhale to inhale crossing, or None.
+        """
+
+        if len(realtime) == 0:
+            return None
+
+        # The device clock went backwards (restart); start over
+        if self._last_time is not None and realtime[-1] < self._last_time:
+            self.clear()
+
+        start = (
+            0
+            if self._last_time is None
+            else np.searchsorted(realtime, self._last_time, side="right")
+        )
+        self._last_time = realtime[-1]
+
+        # 1 when exhaling, 0 when inhaling, and no change inside the hysteresis
+        flow = flow[start:] - baseline
+        (changes,) = np.nonzero(abs(flow) > self.hysteresis)
+        if len(changes) == 0:
+            return None
+
+        exhaling = flow[changes] < 0
+        previous = np.concatenate(([self._exhaling], exhaling[:-1]))
+        (crossings,) = np.nonzero(previous & ~exhaling)
+        self._exhaling = bool(exhaling[-1])
+
+        if len(crossings) == 0:
+            return None
+        return float(realtime[start + changes[crossings[-1]]])
+
+
 class CantComputeDerivative(Exception):
     pass
 
@@ -130,6 +323,124 @@ def smooth_derivative(times, values, sig=0.2):
     return centers[good], intercept[good], slope[good]
 
 
+def _window_sums(times, values, window_width, sig):
+    windowed_times = np.lib.stride_tricks.as_strided(
+        times,
+        (len(times) - window_width + 1, window_width),
+        (times.strides[0], times.strides[0]),
+    )
+    windowed_values = np.lib.stride_tricks.as_strided(
+        values,
+        (len(values) - window_width + 1, window_width),
+        (values.strides[0], values.strides[0]),
+    )
+
+    centers = np.mean(windowed_times, axis=1)
+    windowed_times_centered = windowed_times - centers[:, np.newaxis]
+    windowed_weights = np.exp(-0.5 * windowed_times_centered ** 2 / sig ** 2)
+    weighted_times = windowed_weights * windowed_times_centered
+
+    return (
+        centers,
+        np.sum(windowed_weights, axis=1),
+        np.sum(weighted_times, axis=1),
+        np.sum(windowed_weights * windowed_values, axis=1),
+        np.sum(weighted_times * windowed_times_centered, axis=1),
+        np.sum(weighted_times * windowed_values, axis=1),
+    )
+
+
+class SmoothDerivative:
+    """
+    Streaming version of smooth_derivative, for use on a rolling window.
+
+    The weighted sums (sumw, sumwx, sumwy, sumwxx, sumwxy) of every complete
+    window are kept between calls, keyed by the time of the first sample in the
+    window; only windows that were not complete on the last call are computed.
+    The first and last ``margin`` samples of each call are treated as
+    provisional (the pressure deglitch filter does not touch the edges of the
+    buffer), so windows that include them are recomputed.
+
+    The output matches smooth_derivative on the same arrays. The values are not
+    mean-subtracted before summing; since the fit is linear, that only shifts
+    the intercept by the mean, which is applied at the end.
+    """
+
+    def __init__(self, sig: float = 0.2, *, margin: int = 0):
+        self.sig = sig
+        self.margin = margin
+        self.clear()
+
+    def clear(self) -> None:
+        self._window_width = 0
+        self._last_size = 0
+        self._starts = np.array([], dtype=np.double)
+        self._sums = tuple(np.array([], dtype=np.double) for _ in range(6))
+
+    def __call__(self, times, values):
+        times = np.asarray(times, dtype=np.double)
+        values = np.asarray(values, dtype=np.double)
+
+        if len(times) < 1:
+            raise CantComputeDerivative
+
+        themin = np.min(times[1:] - times[:-1])
+        if themin <= 0:
+            raise CantComputeDerivative
+
+        window_width = int(np.ceil(4 * self.sig / themin))
+        if len(times) - window_width + 1 < 10 or window_width < 10:
+            raise CantComputeDerivative
+
+        nwindows = len(times) - window_width + 1
+
+        # Number of cached windows that are still valid, aligned to times[0]
+        keep = 0
+        if window_width == self._window_width and len(self._starts) > 0:
+            first = np.searchsorted(self._starts, times[0])
+            final = self._last_size - self.margin - window_width + 1
+            keep = max(min(final - first, nwindows), 0)
+            if keep > 0 and not (
+                self._starts[first] == times[0]
+                and self._starts[first + keep - 1] == times[keep - 1]
+            ):
+                keep = 0
+
+        head = self.margin
+        if keep > head:
+            head_sums = _window_sums(
+                times[: head + window_width - 1],
+                values[: head + window_width - 1],
+                window_width,
+                self.sig,
+            )
+            tail_sums = _window_sums(
+                times[keep:], values[keep:], window_width, self.sig
+            )
+            sums = tuple(
+                np.concatenate((start, old[first + head : first + keep], end))
+                for start, old, end in zip(head_sums, self._sums, tail_sums)
+            )
+        else:
+            sums = _window_sums(times, values, window_width, self.sig)
+
+        self._window_width = window_width
+        self._last_size = len(times)
+        self._starts = times[:nwindows].copy()
+        self._sums = sums
+
+        centers, sumw, sumwx, sumwy, sumwxx, sumwxy = sums
+        delta = (sumw * sumwxx) - (sumwx * sumwx)
+
+        with np.errstate(all="ignore"):
+            intercept = ((sumwxx * sumwy) - (sumwx * sumwxy)) / delta - values.mean()
+            slope = ((sumw * sumwxy) - (sumwx * sumwy)) / delta
+
+        good = (~np.isnan(intercept)) & (~np.isnan(slope))
+
+        return centers[good], intercept[good], slope[good]
+
+
 def find_roots(
     times, values, derivative, threshold: float = 0.02, *, breath_thresh: float
 ):
@@ -165,59 +476,82 @@ def find_roots(
     )
 
 
+def _first_minimum(values: List[float]) -> int:
+    # Like np.argmin on a short list: the earliest index wins ties
+    best = 0
+    for i in range(1, len(values)):
+        if values[i] < values[best]:
+            best = i
+    return best
+
+
 def find_breaths(A, B, C, D):
     # ensure that each type is sorted (though it probably already is)
-    A.sort()
-    B.sort()
-    C.sort()
-    D.sort()
+    ins = [np.sort(x).tolist() for x in (A, B, C, D)]
 
-    if len(A) == 0 or len(B) == 0 or len(C) == 0 or len(D) == 0:
+    if any(len(x) == 0 for x in ins):
         return []
 
+    # Each type is walked with a cursor instead of being re-sliced. A value
+    # filled in for a missing type is held in "filled" in front of the
+    # cursor; it is always consumed on the next step.
+    pos = [0, 0, 0, 0]
+    filled: List[Optional[float]] = [None, None, None, None]
+
+    def size(i: int) -> int:
+        return len(ins[i]) - pos[i] + (filled[i] is not None)
+
+    def peek(i: int, offset: int = 0) -> float:
+        fill = filled[i]
+        if fill is not None:
+            if offset == 0:
+                return fill
+            offset -= 1
+        return ins[i][pos[i] + offset]
+
+    def pop(i: int) -> float:
+        fill = filled[i]
+        if fill is not None:
+            filled[i] = None
+            return fill
+        pos[i] += 1
+        return ins[i][pos[i] - 1]
+
     # where does the cycle start?
-    which = np.argmin([A[0], B[0], C[0], D[0]])
+    which = _first_minimum([peek(i) for i in range(4)])
 
-    ins = [A, B, C, D]
     outs = []
-    while len(A) > 0 or len(B) > 0 or len(C) > 0 or len(D) > 0:
-        if len(ins[which]) > 1 and all(len(ins[i]) > 0 for i in range(4)):
-            nextwhich = np.argmin([ins[i][1 if i == which else 0] for i in range(4)])
+    while size(0) > 0 or size(1) > 0 or size(2) > 0 or size(3) > 0:
+        if size(which) > 1 and all(size(i) > 0 for i in range(4)):
+            nextwhich = _first_minimum(
+                [peek(i, 1 if i == which else 0) for i in range(4)]
+            )
 
             # normal case: A -> B -> C -> D -> ... cycle
             if nextwhich == (which + 1) % 4:
-                outs.append((which, ins[which][0]))
-                ins[which] = ins[which][1:]
+                outs.append((which, pop(which)))
 
             # too many of one type: A -> B -> B -> B -> C -> D -> ...
             elif nextwhich == which:
-                combine = [ins[which][0]]
-                ins[which] = ins[which][1:]
+                combine = [pop(which)]
                 while True:
                     if (
-                        any(len(x) == 0 for x in ins)
-                        or np.argmin([ins[i][0] for i in range(4)]) != which
+                        any(size(i) == 0 for i in range(4))
+                        or _first_minimum([peek(i) for i in range(4)]) != which
                     ):
                         break
-                    combine.append(ins[which][0])
-                    ins[which] = ins[which][1:]
+                    combine.append(pop(which))
 
-                outs.append((which, np.mean(combine)))
+                outs.append((which, float(np.mean(combine))))
 
             # missing one type: A -> C -> D -> ...
             else:
-                fill_value = 0.5 * (ins[which][0] + ins[nextwhich][0])
-                ins[(which + 1) % 4] = np.concatenate(
-                    (np.array([fill_value]), ins[(which + 1) % 4])
-                )
-
-                outs.append((which, ins[which][0]))
-                ins[which] = ins[which][1:]
+                filled[(which + 1) % 4] = 0.5 * (peek(which) + peek(nextwhich))
+                outs.append((which, pop(which)))
 
         # edge condition: less than one cycle left
-        elif len(ins[which]) > 0:
-            popped = ins[which][0]
-            ins[which] = ins[which][1:]
+        elif size(which) > 0:
+            popped = pop(which)
 
             if len(outs) > 0 and (outs[-1][0] + 1) % 4 == which:
                 outs.append((which, popped))
@@ -226,11 +560,24 @@ def find_breaths(A, B, C, D):
             break
 
         which = (which + 1) % 4
-        A, B, C, D = ins
 
     return outs
 
 
+def nearest_index(array: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    The index of the nearest element of a sorted array for each value. Ties go
+    to the earlier element, like np.argmin(abs(array - value)) would give.
+    """
+    values = np.asarray(values)
+    if len(array) < 2:
+        return np.zeros(values.shape, dtype=np.intp)
+
+    right = np.clip(np.searchsorted(array, values), 1, len(array) - 1)
+    left = right - 1
+    return np.where(values - array[left] <= array[right] - values, left, right)
+
+
 def measure_breaths(
     time: np.ndarray,
     flow: np.ndarray,
@@ -238,10 +585,12 @@ def measure_breaths(
     pressure: np.ndarray,
     *,
     breath_thresh: float,
+    flow_derivative=smooth_derivative,
+    pressure_derivative=smooth_derivative,
 ):
     try:
-        smooth_time_f, smooth_flow, smooth_dflow = smooth_derivative(time, flow)
-        smooth_time_p, smooth_pressure, smooth_dpressure = smooth_derivative(
+        smooth_time_f, smooth_flow, smooth_dflow = flow_derivative(time, flow)
+        smooth_time_p, smooth_pressure, smooth_dpressure = pressure_derivative(
             time, pressure
         )
         if len(smooth_time_f) < 4:
@@ -263,10 +612,16 @@ def measure_breaths(
     if len(time) == 0 or len(breath_times) == 0:
         return []
 
+    # Resolve every turning point to its nearest sample in one pass
+    turning_times = np.array([t for _, t in breath_times])
+    indexes = nearest_index(time, turning_times)
+    indexes_f = nearest_index(smooth_time_f, turning_times)
+    indexes_p = nearest_index(smooth_time_p, turning_times)
+
     breaths = []
     breath = {}
     for i, (which, t) in enumerate(breath_times):
-        index = np.argmin(abs(time - t))
+        index = indexes[i]
 
         if which == 0:
             breath["empty timestamp"] = t
@@ -275,13 +630,13 @@ def measure_breaths(
             if 0 <= index < len(volume):
                 breath["empty volume"] = volume[index]
             if i >= 2:
-                full_index = np.argmin(abs(time - breath_times[i - 2][1]))
+                full_index = indexes[i - 2]
                 if 0 <= full_index < len(volume):
                     diff = volume[full_index] - breath["empty volume"]
                     if diff > 0:
                         breath["inspiratory tidal volume"] = diff
             if i >= 4:
-                last_index = np.argmin(abs(time - breath_times[i - 4][1]))
+                last_index = indexes[i - 4]
                 if 0 <= last_index < len(flow) and last_index < index:
                     breath["average flow"] = flow[last_index:index].sum() / (
                         index - last_index
@@ -299,11 +654,11 @@ def measure_breaths(
             if 0 <= index < len(flow):
                 breath["inhale flow"] = flow[index]
             if len(smooth_time_f) > 0:
-                idx = np.argmin(abs(smooth_time_f - t))
+                idx = indexes_f[i]
                 if 0 <= idx < len(smooth_flow):
                     breath["inhale dV/dt"] = smooth_flow[idx] * 1000 / 60.0
             if len(smooth_time_p) > 0:
-                idx = np.argmin(abs(smooth_time_p - t))
+                idx = indexes_p[i]
                 if 0 <= idx < len(smooth_dpressure):
                     breath["inhale dP/dt"] = smooth_dpressure[idx]
             if "inhale dV/dt" in breath and "inhale dP/dt" in breath:
@@ -311,7 +666,7 @@ def measure_breaths(
                     breath["inhale dV/dt"] / breath["inhale dP/dt"]
                 )
             if i >= 2:
-                start_index = np.argmin(abs(time - breath_times[i - 2][1]))
+                start_index = indexes[i - 2]
                 if start_index < index:
                     breath["min pressure"] = np.min(pressure[start_index:index])
 
@@ -322,7 +677,7 @@ def measure_breaths(
             if 0 <= index < len(volume):
                 breath["full volume"] = volume[index]
             if i >= 2:
-                empty_index = np.argmin(abs(time - breath_times[i - 2][1]))
+                empty_index = indexes[i - 2]
                 if 0 <= empty_index < len(volume):
                     diff = breath["full volume"] - volume[empty_index]
                     if diff > 0:
@@ -333,11 +688,11 @@ def measure_breaths(
             if 0 <= index < len(flow):
                 breath["exhale flow"] = flow[index]
             if len(smooth_time_f) > 0:
-                idx = np.argmin(abs(smooth_time_f - t))
+                idx = indexes_f[i]
                 if 0 <= idx < len(smooth_flow):
                     breath["exhale dV/dt"] = smooth_flow[idx] * 1000 / 60.0
             if len(smooth_time_p) > 0:
-                idx = np.argmin(abs(smooth_time_p - t))
+                idx = indexes_p[i]
                 if 0 <= idx < len(smooth_dpressure):
                     breath["exhale dP/dt"] = smooth_dpressure[idx]
             if "exhale dV/dt" in breath and "exhale dP/dt" in breath:
@@ -345,7 +700,7 @@ def measure_breaths(
                     breath["exhale dV/dt"] / breath["exhale dP/dt"]
                 )
             if i >= 2:
-                start_index = np.argmin(abs(time - breath_times[i - 2][1]))
+                start_index = indexes[i - 2]
                 if start_index < index:
                     breath["max pressure"] = np.max(pressure[start_index:index])
 
@@ -360,147 +715,175 @@ def measure_breaths(
     return breaths
 
 
-def combine_breaths(old_breaths, new_breaths):
-    breaths = list(old_breaths)
-    new_breaths = list(new_breaths)
-    updated = []
-
-    first_to_check = max(0, len(breaths) - len(new_breaths) - 1)
-    for i in range(first_to_check, len(breaths)):
-        drop = []
-        for j in range(len(new_breaths)):
-            # the smoothing sigma is 0.2 sec (see smooth_derivative), so cut at 3*0.2
-            same = False
-            if "empty timestamp" in breaths[i] and "empty timestamp" in new_breaths[j]:
-                same = (
-                    same
-                    or abs(
-                        breaths[i]["empty timestamp"]
-                        - new_breaths[j]["empty timestamp"]
-                    )
-                    < 3 * 0.2
-                )
-            if (
-                "inhale timestamp" in breaths[i]
-                and "inhale timestamp" in new_breaths[j]
-            ):
-                same = (
-                    same
-                    or abs(
-                        breaths[i]["inhale timestamp"]
-                        - new_breaths[j]["inhale timestamp"]
-                    )
-                    < 3 * 0.2
-                )
-            if "full timestamp" in breaths[i] and "full timestamp" in new_breaths[j]:
-                same = (
-                    same
-                    or abs(
-                        breaths[i]["full timestamp"] - new_breaths[j]["full timestamp"]
-                    )
-                    < 3 * 0.2
-                )
-            if (
-                "exhale timestamp" in breaths[i]
-                and "exhale timestamp" in new_breaths[j]
-            ):
-                same = (
-                    same
-                    or abs(
-                        breaths[i]["exhale timestamp"]
-                        - new_breaths[j]["exhale timestamp"]
-                    )
-                    < 3 * 0.2
-                )
+_BREATH_TIMESTAMPS = (
+    "empty timestamp",
+    "inhale timestamp",
+    "full timestamp",
+    "exhale timestamp",
+)
 
-            if same:
-                # take all fields that are defined in either old or new, but preferring new if it's in both
-                breaths[i] = {**breaths[i], **new_breaths[j]}
-                updated.append(breaths[i])
-                drop.append(j)
-                break
 
-        for j in drop[::-1]:
-            del new_breaths[j]
+def _match_breaths(old, new):
+    """
+    For each old breath record, the index of the first new breath record (not
+    matched to an earlier old breath) with any timestamp in common, or None.
+    New breaths are indexed by each timestamp, so only those within tolerance
+    are checked.
+    """
 
-    breaths.extend(new_breaths)
-    breaths.sort(key=average_any_times)
+    # the smoothing sigma is 0.2 sec (see smooth_derivative), so cut at 3*0.2
+    tolerance = 3 * 0.2
+
+    index = {}
+    for key in _BREATH_TIMESTAMPS:
+        times = new[key]
+        (js,) = np.nonzero(~np.isnan(times))
+        order = np.argsort(times[js], kind="stable")
+        index[key] = (times[js][order], js[order])
+
+    old_times = {key: old[key].tolist() for key in _BREATH_TIMESTAMPS}
+    new_times = {key: new[key].tolist() for key in _BREATH_TIMESTAMPS}
+
+    taken = [False] * len(new)
+    matches = []
+    for i in range(len(old)):
+        best = None
+        for key in _BREATH_TIMESTAMPS:
+            t = old_times[key][i]
+            if np.isnan(t):
+                continue
+            times, js = index[key]
+            lo = np.searchsorted(times, t - 2 * tolerance, side="left")
+            hi = np.searchsorted(times, t + 2 * tolerance, side="right")
+            for j in js[lo:hi].tolist():
+                if (
+                    not taken[j]
+                    and (best is None or j < best)
+                    and abs(t - new_times[key][j]) < tolerance
+                ):
+                    best = j
+        if best is not None:
+            taken[best] = True
+        matches.append(best)
+
+    return matches
+
+
+def _add_time_differences(records, start=0):
+    """
+    Add time-difference quantities to the breath records from index start on;
+    each depends only on the timestamps of the breath and the one before it.
+    """
 
-    # The dicts in breaths, updated, and new_breaths are the same objects,
-    # so updating the superset (breaths) affects them all.
+    tail = records[start:]
+    if len(tail) == 0:
+        return
 
-    # Adding time-difference quantities.
-    for i, breath in enumerate(breaths):
-        if (
-            "empty timestamp" in breath
-            and "full timestamp" in breath
-            and breath["empty timestamp"] > breath["full timestamp"]
-        ):
-            breath["exhale time"] = breath["empty timestamp"] - breath["full timestamp"]
-        elif (
-            i > 0
-            and "empty timestamp" in breath
-            and "full timestamp" in breaths[i - 1]
-            and breath["empty timestamp"] > breaths[i - 1]["full timestamp"]
-        ):
-            breath["exhale time"] = (
-                breath["empty timestamp"] - breaths[i - 1]["full timestamp"]
-            )
+    def before(name):
+        return np.concatenate(([np.nan], records[name][:-1]))[start:]
 
-        if (
-            "full timestamp" in breath
-            and "empty timestamp" in breath
-            and breath["full timestamp"] > breath["empty timestamp"]
-        ):
-            breath["inhale time"] = breath["full timestamp"] - breath["empty timestamp"]
-        elif (
-            i > 0
-            and "full timestamp" in breath
-            and "empty timestamp" in breaths[i - 1]
-            and breath["full timestamp"] > breaths[i - 1]["empty timestamp"]
-        ):
-            breath["inhale time"] = (
-                breath["full timestamp"] - breaths[i - 1]["empty timestamp"]
-            )
+    # Comparisons with a missing (NaN) timestamp are False
+    empty, inhale, full, exhale = (tail[key] for key in _BREATH_TIMESTAMPS)
+    empty_before, inhale_before, full_before, exhale_before = (
+        before(key) for key in _BREATH_TIMESTAMPS
+    )
 
-        if (
-            i > 0
-            and "empty timestamp" in breath
-            and "empty timestamp" in breaths[i - 1]
-            and breath["empty timestamp"] > breaths[i - 1]["empty timestamp"]
-        ):
-            breath["time since last"] = (
-                breath["empty timestamp"] - breaths[i - 1]["empty timestamp"]
-            )
-        elif (
-            i > 0
-            and "full timestamp" in breath
-            and "full timestamp" in breaths[i - 1]
-            and breath["full timestamp"] > breaths[i - 1]["full timestamp"]
-        ):
-            breath["time since last"] = (
-                breath["full timestamp"] - breaths[i - 1]["full timestamp"]
-            )
-        elif (
-            i > 0
-            and "inhale timestamp" in breath
-            and "inhale timestamp" in breaths[i - 1]
-            and breath["inhale timestamp"] > breaths[i - 1]["inhale timestamp"]
-        ):
-            breath["time since last"] = (
-                breath["inhale timestamp"] - breaths[i - 1]["inhale timestamp"]
-            )
-        elif (
-            i > 0
-            and "exhale timestamp" in breath
-            and "exhale timestamp" in breaths[i - 1]
-            and breath["exhale timestamp"] > breaths[i - 1]["exhale timestamp"]
-        ):
-            breath["time since last"] = (
-                breath["exhale timestamp"] - breaths[i - 1]["exhale timestamp"]
-            )
+    tail["exhale time"] = np.select(
+        [empty > full, empty > full_before],
+        [empty - full, empty - full_before],
+        tail["exhale time"],
+    )
+    tail["inhale time"] = np.select(
+        [full > empty, full > empty_before],
+        [full - empty, full - empty_before],
+        tail["inhale time"],
+    )
+    tail["time since last"] = np.select(
+        [
+            empty > empty_before,
+            full > full_before,
+            inhale > inhale_before,
+            exhale > exhale_before,
+        ],
+        [
+            empty - empty_before,
+            full - full_before,
+            inhale - inhale_before,
+            exhale - exhale_before,
+        ],
+        tail["time since last"],
+    )
 
-    return breaths, updated, new_breaths
+
+def combine_records(old, new):
+    """
+    Merge newly measured breath records into the old ones (structured arrays,
+    see processor.breaths). A new breath with any timestamp close to one of an
+    old breath updates it, taking the fields defined in either but preferring
+    the new ones; the rest are added, in time order. Returns all the breaths,
+    the updated ones, and the added ones, as structured arrays.
+    """
+
+    first_to_check = max(0, len(old) - len(new) - 1)
+    matches = _match_breaths(old[first_to_check:], new)
+    pairs = [(i, j) for i, j in enumerate(matches, first_to_check) if j is not None]
+    olds = np.array([i for i, _ in pairs], dtype=np.intp)
+    news = np.array([j for _, j in pairs], dtype=np.intp)
+
+    records = old.copy()
+    for name in BREATH_FIELDS:
+        values = new[name][news]
+        column = records[name]
+        column[olds] = np.where(np.isnan(values), column[olds], values)
+
+    unmatched = np.ones(len(new), dtype=bool)
+    unmatched[news] = False
+    records = np.concatenate([records, new[unmatched]])
+    changed = np.concatenate([olds, np.arange(len(old), len(records))])
+
+    # Only the tail can change; the breaths before it are already sorted, so
+    # sorting the tail is enough unless it reaches back before them
+    times = average_times(records)
+    if first_to_check > 0 and np.any(times[changed] < times[first_to_check - 1]):
+        first_to_check = 0
+
+    order = np.arange(len(records))
+    order[first_to_check:] = first_to_check + np.argsort(
+        times[first_to_check:], kind="stable"
+    )
+    records = records[order]
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+
+    # Adding time-difference quantities, from the first breath that changed or
+    # moved (so its predecessor may have changed) on.
+    moved = order != np.arange(len(order))
+    moved[positions[changed]] = True
+    _add_time_differences(records, int(np.argmax(moved)) if moved.any() else len(moved))
+
+    updated = records[positions[olds]]
+    added = records[positions[changed[len(olds) :]]]
+    return records, updated, added
+
+
+def combine_breaths(old_breaths, new_breaths):
+    """
+    combine_records for breath dicts (or any mappings); returns lists of dicts.
+    """
+
+    results = combine_records(as_records(old_breaths), as_records(new_breaths))
+    return tuple([dict(BreathRecord(row)) for row in result] for result in results)
+
+
+def average_times(records):
+    """
+    The average of the timestamps of each breath record (every breath has at
+    least one).
+    """
+
+    times = np.stack([records[key] for key in _BREATH_TIMESTAMPS])
+    present = ~np.isnan(times)
+    return np.where(present, times, 0.0).sum(axis=0) / present.sum(axis=0)
 
 
 def average_any_times(breath):
@@ -516,133 +899,95 @@ def average_any_times(breath):
     return sum(times) / len(times)  # every breath has at least one
 
 
+# Breath record fields and the cumulative fields that are their moving averages
+_MOVING_AVERAGES = {
+    "time since last": "breath interval",
+    "max pressure": "PIP",
+    "empty pressure": "PEEP",
+    "expiratory tidal volume": "TVe",
+    "inspiratory tidal volume": "TVi",
+    "inhale compliance": "inhale compliance",
+    "exhale compliance": "exhale compliance",
+    "inhale time": "inhale time",
+    "exhale time": "exhale time",
+    "average flow": "breath average flow",
+    "average pressure": "breath average pressure",
+}
+
+
 # default alpha is 0.3: value changes after about 3 breaths
-def moving_average(cumulative, updated_fields, key, value, alpha=0.3):
-    updated_fields.add(key)
-    if key not in cumulative:
-        return value
+def moving_average(cumulative, key, values, alpha=0.3):
+    """
+    Exponentially weighted moving average of cumulative[key] with each of
+    values in turn, as one filter pass. If key is not in cumulative yet, the
+    first value starts the average.
+    """
+
+    if key in cumulative:
+        start = cumulative[key]
     else:
-        return alpha * value + (1.0 - alpha) * cumulative[key]
+        start, values = values[0], values[1:]
+
+    if len(values) == 0:
+        return float(start)
+
+    averages, _ = scipy.signal.lfilter(
+        [alpha], [1.0, alpha - 1.0], values, zi=[(1.0 - alpha) * start]
+    )
+    return float(averages[-1])
 
 
 def cumulative(cumulative, updated, new_breaths):
     cumulative = dict(cumulative)
-    updated_fields = set()
-
-    for breath in updated + new_breaths:
-        timestamp = None
-        if "empty timestamp" in breath and (
-            timestamp is None or timestamp < breath["empty timestamp"]
-        ):
-            timestamp = breath["empty timestamp"]
-        if "inhale timestamp" in breath and (
-            timestamp is None or timestamp < breath["inhale timestamp"]
-        ):
-            timestamp = breath["inhale timestamp"]
-        if "full timestamp" in breath and (
-            timestamp is None or timestamp < breath["full timestamp"]
-        ):
-            timestamp = breath["full timestamp"]
-        if "exhale timestamp" in breath and (
-            timestamp is None or timestamp < breath["exhale timestamp"]
+    updated_fields: Set[str] = set()
+
+    # Breath dicts or structured arrays of breath records (see processor.breaths)
+    records = np.concatenate([as_records(updated), as_records(new_breaths)])
+    if len(records) == 0:
+        return cumulative, updated_fields
+
+    timestamps = np.fmax.reduce([records[key] for key in _BREATH_TIMESTAMPS])
+
+    # Each breath only counts if it is past the last one counted, so this
+    # selection is sequential, but it is only a comparison per breath
+    last_timestamp = cumulative.get("last breath timestamp")
+    is_new = np.zeros(len(records), dtype=bool)
+    for i, timestamp in enumerate(timestamps.tolist()):
+        # the smoothing sigma is 0.2 sec (see smooth_derivative), so cut at 3*0.2
+        if not np.isnan(timestamp) and (
+            last_timestamp is None or last_timestamp + 3 * 0.2 < timestamp
         ):
-            timestamp = breath["exhale timestamp"]
-
-        this_is_new = False
-        if timestamp is not None:
-            # the smoothing sigma is 0.2 sec (see smooth_derivative), so cut at 3*0.2
-            if (
-                "last breath timestamp" not in cumulative
-                or cumulative["last breath timestamp"] + 3 * 0.2 < timestamp
-            ):
-                cumulative["last breath timestamp"] = timestamp
-                updated_fields.add("last breath timestamp")
-                this_is_new = True
-
-        if this_is_new:
-            if "time since last" in breath:
-                cumulative["breath interval"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "breath interval",
-                    breath["time since last"],
-                )
-                cumulative["RR"] = 60.0 / cumulative["breath interval"]
-                updated_fields.add("RR")
-            if "max pressure" in breath:
-                cumulative["PIP"] = moving_average(
-                    cumulative, updated_fields, "PIP", breath["max pressure"]
-                )
-            if "empty pressure" in breath:
-                cumulative["PEEP"] = moving_average(
-                    cumulative, updated_fields, "PEEP", breath["empty pressure"]
-                )
-            if "expiratory tidal volume" in breath:
-                cumulative["TVe"] = moving_average(
-                    cumulative, updated_fields, "TVe", breath["expiratory tidal volume"]
-                )
-            if "inspiratory tidal volume" in breath:
-                cumulative["TVi"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "TVi",
-                    breath["inspiratory tidal volume"],
-                )
-            if "TVe" in cumulative and "TVi" in cumulative:
-                cumulative["TV"] = 0.5 * (cumulative["TVe"] + cumulative["TVi"])
-                updated_fields.add("TV")
-            if "inhale compliance" in breath:
-                cumulative["inhale compliance"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "inhale compliance",
-                    breath["inhale compliance"],
-                )
-            if "exhale compliance" in breath:
-                cumulative["exhale compliance"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "exhale compliance",
-                    breath["exhale compliance"],
-                )
-            if "RR" in cumulative and "TV" in cumulative:
-                cumulative["breath volume rate"] = (
-                    cumulative["TV"] * cumulative["RR"] / 1000.0
-                )
-                updated_fields.add("breath volume rate")
-            if "inhale time" in breath:
-                cumulative["inhale time"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "inhale time",
-                    breath["inhale time"],
-                )
-            if "exhale time" in breath:
-                cumulative["exhale time"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "exhale time",
-                    breath["exhale time"],
-                )
-            if "inhale time" in cumulative and "exhale time" in cumulative:
-                cumulative["I:E time ratio"] = (
-                    cumulative["inhale time"] / cumulative["exhale time"]
-                )
-                updated_fields.add("I:E time ratio")
-            if "average flow" in breath:
-                cumulative["breath average flow"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "breath average flow",
-                    breath["average flow"],
-                )
-            if "average pressure" in breath:
-                cumulative["breath average pressure"] = moving_average(
-                    cumulative,
-                    updated_fields,
-                    "breath average pressure",
-                    breath["average pressure"],
-                )
+            last_timestamp = timestamp
+            is_new[i] = True
+
+    if not is_new.any():
+        return cumulative, updated_fields
+
+    cumulative["last breath timestamp"] = last_timestamp
+    updated_fields.add("last breath timestamp")
+
+    records = records[is_new]
+    for field, key in _MOVING_AVERAGES.items():
+        values = records[field]
+        values = values[~np.isnan(values)]
+        if len(values) > 0:
+            cumulative[key] = moving_average(cumulative, key, values)
+            updated_fields.add(key)
+
+    if "breath interval" in updated_fields:
+        cumulative["RR"] = 60.0 / cumulative["breath interval"]
+        updated_fields.add("RR")
+    if "TVe" in cumulative and "TVi" in cumulative:
+        cumulative["TV"] = 0.5 * (cumulative["TVe"] + cumulative["TVi"])
+        updated_fields.add("TV")
+    if "RR" in cumulative and "TV" in cumulative:
+        cumulative["breath volume rate"] = cumulative["TV"] * cumulative["RR"] / 1000.0
+        updated_fields.add("breath volume rate")
+    if "inhale time" in cumulative and "exhale time" in cumulative:
+        cumulative["I:E time ratio"] = (
+            cumulative["inhale time"] / cumulative["exhale time"]
+        )
+        updated_fields.add("I:E time ratio")
 
     return cumulative, updated_fields
 
@@ -665,20 +1010,104 @@ def alarm_record(old_record, timestamp, value, ismax):
         return record
 
 
+class AlarmSource(enum.Enum):
+    cumulative = "cumulative"  # cumulative measurements from breaths
+    average = "average"  # window averages of flow and pressure
+    co2 = "co2"  # window average of CO2
+
+
+class AlarmRule(NamedTuple):
+    name: str  # also the rotary key for the limit
+    quantity: str
+    direction: MaxMin
+    source: AlarmSource
+    zero_disables: bool = False
+
+
+ALARM_RULES = (
+    AlarmRule("RR Max", "RR", MaxMin.max, AlarmSource.cumulative, zero_disables=True),
+    AlarmRule("PIP Max", "PIP", MaxMin.max, AlarmSource.cumulative),
+    AlarmRule("PIP Min", "PIP", MaxMin.min, AlarmSource.cumulative),
+    AlarmRule("PEEP Max", "PEEP", MaxMin.max, AlarmSource.cumulative),
+    AlarmRule("PEEP Min", "PEEP", MaxMin.min, AlarmSource.cumulative),
+    AlarmRule("TVe Max", "TVe", MaxMin.max, AlarmSource.cumulative),
+    AlarmRule("TVe Min", "TVe", MaxMin.min, AlarmSource.cumulative),
+    AlarmRule("TVi Max", "TVi", MaxMin.max, AlarmSource.cumulative),
+    AlarmRule("TVi Min", "TVi", MaxMin.min, AlarmSource.cumulative),
+    AlarmRule("Avg Flow Max", "flow", MaxMin.max, AlarmSource.average),
+    AlarmRule("Avg Flow Min", "flow", MaxMin.min, AlarmSource.average),
+    AlarmRule("Avg Pressure Max", "pressure", MaxMin.max, AlarmSource.average),
+    AlarmRule("Avg Pressure Min", "pressure", MaxMin.min, AlarmSource.average),
+    AlarmRule("Avg CO2 Max", "CO2", MaxMin.max, AlarmSource.co2),
+    AlarmRule("Avg CO2 Min", "CO2", MaxMin.min, AlarmSource.co2),
+)
+
+
+def out_of_bounds(
+    values: np.ndarray, limits: np.ndarray, is_max: np.ndarray
+) -> np.ndarray:
+    """
+    Which values are out of bounds, for any shape of arrays that broadcast
+    (such as patients x rules). A NaN value or limit is never out of bounds.
+    """
+
+    return np.where(is_max, values > limits, values < limits)
+
+
+class AlarmTable:
+    """
+    A set of alarm rules compiled against a rotary into an array of limits
+    (NaN if the rule is not in the rotary or disabled). The limits are only
+    worked out again when a setting changes (see Setting.version).
+    """
+
+    def __init__(self, rules: Iterable[AlarmRule]):
+        self.rules = tuple(rules)
+        self.names = [rule.name for rule in self.rules]
+        self.quantities = [rule.quantity for rule in self.rules]
+        self.is_max = np.array([rule.direction == MaxMin.max for rule in self.rules])
+        self.limits = np.full(len(self.rules), np.nan)
+        self._versions: Optional[Tuple[Any, ...]] = None
+
+    @classmethod
+    def from_sources(cls, *sources: AlarmSource) -> "AlarmTable":
+        return cls(rule for rule in ALARM_RULES if rule.source in sources)
+
+    def compile(self, rotary: LocalRotary) -> None:
+        # The setting versions are read without taking the setting locks
+        versions = tuple(
+            (id(rotary[name]), rotary[name].version) if name in rotary else None
+            for name in self.names
+        )
+        if versions == self._versions:
+            return
+        self._versions = versions
+
+        for i, rule in enumerate(self.rules):
+            limit = rotary[rule.name].value if rule.name in rotary else None
+            if limit is None or (rule.zero_disables and not limit > 0):
+                limit = np.nan
+            self.limits[i] = limit
+
+    def values(self, source: Dict[str, float]) -> np.ndarray:
+        return np.array([source.get(quantity, np.nan) for quantity in self.quantities])
+
+    def out_of_bounds(self, values: np.ndarray) -> np.ndarray:
+        return out_of_bounds(values, self.limits, self.is_max)
+
+
 def sync_alarm(
     old_alarms: Dict[str, Dict[str, float]],
     logger: logging.Logger,
     key: str,
     timestamp: float,
     value: float,
-    limit: float,
-    direction: MaxMin,
+    active: bool,
+    ismax: bool,
 ) -> None:
 
-    condition = (value < limit) if direction == MaxMin.min else (value > limit)
-
-    if condition:
-        old_alarms[key] = alarm_record(old_alarms.get(key), timestamp, value, True)
+    if active:
+        old_alarms[key] = alarm_record(old_alarms.get(key), timestamp, value, ismax)
         if old_alarms[key]["first timestamp"] == timestamp:
             logger.info(
                 f"Alarm {key!r} activated with value {old_alarms[key]['extreme']}"
@@ -694,195 +1123,62 @@ def sync_alarm(
 def avg_alarms(
     old_alarms: Dict[str, Dict[str, float]],
     rotary: LocalRotary,
-    key: str,
-    values: Dict[int, float],
+    values: Dict[str, float],
     timestamp: float,
     logger: logging.Logger,
-):
+    table: Optional[AlarmTable] = None,
+) -> Dict[str, Dict[str, float]]:
     """
-    Return a dict with an alarm if alarm present and out of bounds.
+    Update old_alarms in place with the average (flow, pressure, and CO2)
+    alarms. Rules for quantities missing from values are left as they are.
     """
 
-    avg_window = config["global"]["avg-window"].get(int)
-    max_key = f"Avg {key.capitalize()} Max"
-    min_key = f"Avg {key.capitalize()} Min"
-
-    if max_key in rotary:
-        sync_alarm(
-            old_alarms,
-            logger,
-            max_key,
-            timestamp,
-            values[avg_window],
-            rotary[max_key].value,
-            MaxMin.max,
-        )
-
-    if min_key in rotary:
-        sync_alarm(
-            old_alarms,
-            logger,
-            min_key,
-            timestamp,
-            values[avg_window],
-            rotary[min_key].value,
-            MaxMin.min,
-        )
-
+    if table is None:
+        table = AlarmTable.from_sources(AlarmSource.average, AlarmSource.co2)
+    table.compile(rotary)
 
-def co2_alarm(
-    old_alarms: Dict[str, Dict[str, float]],
-    rotary: LocalRotary,
-    values: np.ndarray,
-    timestamp: float,
-    logger: logging.Logger,
-):
-    """
-    Return a dict with an alarm if alarm present and out of bounds.
-    """
+    array = table.values(values)
+    active = table.out_of_bounds(array)
 
-    max_key = "Avg CO2 Max"
-    min_key = "Avg CO2 Min"
-
-    if max_key in rotary:
-        avg = float(np.mean(values))
-
-        if max_key in rotary:
-            sync_alarm(
-                old_alarms,
-                logger,
-                max_key,
-                timestamp,
-                avg,
-                rotary[max_key].value,
-                MaxMin.max,
-            )
-
-        if min_key in rotary:
+    for i, name in enumerate(table.names):
+        if table.quantities[i] in values and not np.isnan(table.limits[i]):
             sync_alarm(
                 old_alarms,
                 logger,
-                min_key,
+                name,
                 timestamp,
-                avg,
-                rotary[min_key].value,
-                MaxMin.min,
+                float(array[i]),
+                bool(active[i]),
+                bool(table.is_max[i]),
             )
 
     return old_alarms
 
 
-def add_alarms(rotary, _updated, _new_breaths, cumulative, old_alarms, logger):
+def add_alarms(
+    rotary,
+    _updated,
+    _new_breaths,
+    cumulative,
+    old_alarms,
+    logger,
+    table: Optional[AlarmTable] = None,
+):
     alarms = {}
 
     if "PIP" in cumulative:
-        if (
-            "RR Max" in rotary
-            and rotary["RR Max"].value > 0
-            and "RR" in cumulative
-            and cumulative["RR"] > rotary["RR Max"].value
-        ):
-            alarms["RR Max"] = alarm_record(
-                old_alarms.get("RR Max"),
-                cumulative["last breath timestamp"],
-                cumulative["RR"],
-                True,
-            )
-
-        if (
-            "PIP Max" in rotary
-            and "PIP" in cumulative
-            and cumulative["PIP"] > rotary["PIP Max"].value
-        ):
-            alarms["PIP Max"] = alarm_record(
-                old_alarms.get("PIP Max"),
-                cumulative["last breath timestamp"],
-                cumulative["PIP"],
-                True,
-            )
-
-        if (
-            "PIP Min" in rotary
-            and "PIP" in cumulative
-            and cumulative["PIP"] < rotary["PIP Min"].value
-        ):
-            alarms["PIP Min"] = alarm_record(
-                old_alarms.get("PIP Min"),
-                cumulative["last breath timestamp"],
-                cumulative["PIP"],
-                False,
-            )
-
-        if (
-            "PEEP Max" in rotary
-            and "PEEP" in cumulative
-            and cumulative["PEEP"] > rotary["PEEP Max"].value
-        ):
-            alarms["PEEP Max"] = alarm_record(
-                old_alarms.get("PEEP Max"),
-                cumulative["last breath timestamp"],
-                cumulative["PEEP"],
-                True,
-            )
-
-        if (
-            "PEEP Min" in rotary
-            and "PEEP" in cumulative
-            and cumulative["PEEP"] < rotary["PEEP Min"].value
-        ):
-            alarms["PEEP Min"] = alarm_record(
-                old_alarms.get("PEEP Min"),
-                cumulative["last breath timestamp"],
-                cumulative["PEEP"],
-                False,
-            )
-
-        if (
-            "TVe Max" in rotary
-            and "TVe" in cumulative
-            and cumulative["TVe"] > rotary["TVe Max"].value
-        ):
-            alarms["TVe Max"] = alarm_record(
-                old_alarms.get("TVe Max"),
-                cumulative["last breath timestamp"],
-                cumulative["TVe"],
-                True,
-            )
-
-        if (
-            "TVe Min" in rotary
-            and "TVe" in cumulative
-            and cumulative["TVe"] < rotary["TVe Min"].value
-        ):
-            alarms["TVe Min"] = alarm_record(
-                old_alarms.get("TVe Min"),
-                cumulative["last breath timestamp"],
-                cumulative["TVe"],
-                False,
-            )
-
-        if (
-            "TVi Max" in rotary
-            and "TVi" in cumulative
-            and cumulative["TVi"] > rotary["TVi Max"].value
-        ):
-            alarms["TVi Max"] = alarm_record(
-                old_alarms.get("TVi Max"),
-                cumulative["last breath timestamp"],
-                cumulative["TVi"],
-                True,
-            )
-
-        if (
-            "TVi Min" in rotary
-            and "TVi" in cumulative
-            and cumulative["TVi"] < rotary["TVi Min"].value
-        ):
-            alarms["TVi Min"] = alarm_record(
-                old_alarms.get("TVi Min"),
+        if table is None:
+            table = AlarmTable.from_sources(AlarmSource.cumulative)
+        table.compile(rotary)
+
+        values = table.values(cumulative)
+        for i in np.flatnonzero(table.out_of_bounds(values)):
+            name = table.names[i]
+            alarms[name] = alarm_record(
+                old_alarms.get(name),
                 cumulative["last breath timestamp"],
-                cumulative["TVi"],
-                False,
+                float(values[i]),
+                bool(table.is_max[i]),
             )
 
         for name in alarms:
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, List, Sequence, TYPE_CHECKING
+
+import numpy as np
+
+import processor.analysis
+from processor.generator import MINBIAS_FREQUENCY
+
+if TYPE_CHECKING:
+    from processor.generator import Generator
+
+
+def _groups(
+    generators: Sequence[Generator], key: Callable[[Generator], Hashable]
+) -> List[List[Generator]]:
+    groups: Dict[Hashable, List[Generator]] = defaultdict(list)
+    for gen in generators:
+        groups[key(gen)].append(gen)
+    return list(groups.values())
+
+
+def _deglitch(generators: Sequence[Generator]) -> None:
+    deglitched = [gen for gen in generators if gen._deglitch_pressure]
+    for group in _groups(deglitched, lambda gen: len(gen._pressure)):
+        # A single generator computes it on demand in the pressure property
+        if len(group) < 2 or len(group[0]._pressure) < 5:
+            continue
+
+        versions = [gen._pressure.version for gen in group]
+        pressures = processor.analysis.pressure_deglitch_smooth(
+            np.stack([np.asarray(gen._pressure) for gen in group])
+        )
+        for gen, version, pressure in zip(group, versions, pressures):
+            gen._memoize("pressure", version, functools.partial(np.asarray, pressure))
+
+
+def _averages(generators: Sequence[Generator]) -> None:
+    if not generators:
+        return
+
+    # The lengths all come from the same config
+    lengths = generators[0]._flow_cumulative.keys()
+    times = [np.asarray(gen._time) for gen in generators]
+
+    flows = processor.analysis.batch_compute_cumulative(
+        lengths, times, [gen._flow for gen in generators]
+    )
+    pressures = processor.analysis.batch_compute_cumulative(
+        lengths, times, [gen._averaged_pressure for gen in generators]
+    )
+    co2s = processor.analysis.batch_compute_cumulative(
+        generators[0]._co2_cumulative.keys(),
+        [np.asarray(gen._co2_time) for gen in generators],
+        [gen._co2 for gen in generators],
+        [time[-1] for time in times],
+    )
+
+    for gen, flow, pressure, co2 in zip(generators, flows, pressures, co2s):
+        gen._flow_cumulative = flow
+        gen._pressure_cumulative = pressure
+        gen._co2_cumulative = co2
+
+
+def _minbias_volumes(generators: Sequence[Generator]) -> None:
+    now = time.monotonic()
+    due = [gen for gen in generators if gen._full_analysis_due(now)]
+    for group in _groups(due, lambda gen: (len(gen._time), len(gen._flow))):
+        # A single generator computes it on demand in its full analysis
+        if len(group) < 2 or len(group[0]._time) != len(group[0]._flow):
+            continue
+
+        versions = [gen._minbias_version for gen in group]
+        realtimes, _, flows, _ = zip(*(gen._minbias_inputs() for gen in group))
+        volumes = processor.analysis.flow_to_volume(
+            np.stack(realtimes),
+            None,
+            np.stack(flows),
+            None,
+            critical_frequency=MINBIAS_FREQUENCY,
+        )
+        for gen, version, volume in zip(group, versions, volumes):
+            gen._memoize(
+                "minbias_volume", version, functools.partial(np.asarray, volume)
+            )
+
+
+def analyze_timeseries(generators: Sequence[Generator]) -> None:
+    """
+    The vectorized part of the analysis for many generators: the windows of
+    generators with the same length are stacked and deglitched at once, the
+    running averages of each generator are found with one lookup for all the
+    window lengths, and the minimum bias volumes of the generators due for a
+    full analysis are integrated and filtered at once.
+
+    The smoothed derivatives are not stacked: each generator keeps the sums of
+    the windows it has already seen (see SmoothDerivative), so it only works
+    out the new windows, which is less work than every window of the stack.
+
+    The generator locks must be held. Afterwards, each generator should run
+    analyze_as_needed(averaged=True).
+    """
+
+    _deglitch(generators)
+    _averages([gen for gen in generators if len(gen._time) > 0])
+    _minbias_volumes([gen for gen in generators if len(gen._time) > 0])
+
+
+def step(generators: Sequence[Generator]) -> List[Generator]:
+    """
+    Generator.step for many generators, with the time-series analysis batched.
+    Errors are logged per generator; returns the generators that failed.
+    """
+
+    failed = []
+    with contextlib.ExitStack() as stack:
+        for gen in generators:
+            stack.enter_context(gen.lock)
+
+        ready = []
+        for gen in generators:
+            try:
+                gen._get_data()
+            except Exception:
+                gen.logger.exception("Unexpected error in analysis!")
+                failed.append(gen)
+            else:
+                ready.append(gen)
+
+        try:
+            analyze_timeseries(ready)
+            averaged = True
+        except Exception:
+            ready[0].logger.exception("Batched analysis failed, running separately")
+            averaged = False
+
+        for gen in ready:
+            try:
+                gen.analyze_as_needed(averaged=averaged)
+                gen._publish_snapshot()
+            except Exception:
+                gen.logger.exception("Unexpected error in analysis!")
+                failed.append(gen)
+
+    return failed
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import numpy as np
+
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+from processor.rolling import Rolling
+
+# The breath record fields, see docs/analysis-products.md
+BREATH_FIELDS = (
+    "inhale timestamp",
+    "inhale flow",
+    "inhale dV/dt",
+    "inhale dP/dt",
+    "inhale compliance",
+    "min pressure",
+    "full timestamp",
+    "full pressure",
+    "full volume",
+    "expiratory tidal volume",
+    "inspiratory tidal volume",
+    "inhale time",
+    "exhale timestamp",
+    "exhale flow",
+    "exhale dV/dt",
+    "exhale dP/dt",
+    "exhale compliance",
+    "max pressure",
+    "empty timestamp",
+    "empty pressure",
+    "empty volume",
+    "exhale time",
+    "average flow",
+    "average pressure",
+    "time since last",
+)
+
+BREATH_DTYPE = np.dtype([(name, np.double) for name in BREATH_FIELDS])
+
+
+def breaths_to_records(breaths: Iterable[Mapping[str, float]]) -> np.ndarray:
+    """
+    Convert breath dicts into a structured array; missing fields are NaN.
+    Fields outside of the schema are a ValueError.
+    """
+
+    breaths = list(breaths)
+    unknown = {name for breath in breaths for name in breath} - set(BREATH_FIELDS)
+    if unknown:
+        raise ValueError(f"Breath fields not in BREATH_FIELDS: {sorted(unknown)}")
+
+    records = np.empty(len(breaths), dtype=BREATH_DTYPE)
+    for name in BREATH_FIELDS:
+        records[name] = [breath.get(name, np.nan) for breath in breaths]
+    return records
+
+
+def as_records(breaths) -> np.ndarray:
+    """
+    Breaths as a structured array, converting only if they are not one already.
+    """
+
+    if isinstance(breaths, np.ndarray) and breaths.dtype == BREATH_DTYPE:
+        return breaths
+    return breaths_to_records(breaths)
+
+
+class BreathRecord(Mapping):
+    """
+    A read-only, dict-compatible view of one breath record. Fields that are NaN
+    are treated as missing, so ``"full timestamp" in breath`` works as it
+    does for a dict.
+    """
+
+    __slots__ = ("_row",)
+
+    def __init__(self, row: np.void):
+        self._row = row
+
+    def __getitem__(self, key: str) -> float:
+        if key not in BREATH_DTYPE.fields:
+            raise KeyError(key)
+        value = self._row[key]
+        if np.isnan(value):
+            raise KeyError(key)
+        return float(value)
+
+    def __contains__(self, key: object) -> bool:
+        return key in BREATH_DTYPE.fields and not np.isnan(self._row[key])
+
+    def __iter__(self) -> Iterator[str]:
+        row = self._row
+        return (name for name in BREATH_FIELDS if not np.isnan(row[name]))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"BreathRecord({dict(self)})"
+
+
+class BreathStore(Sequence):
+    """
+    The most recent breaths, stored as columns of a structured array in a
+    Rolling buffer. Indexing gives dict-compatible BreathRecords, column gives
+    one field for all breaths (NaN where missing) for vectorized work.
+    """
+
+    def __init__(self, *, capacity: int, path: Union[str, Path, None] = None):
+        self._records = Rolling(window_size=capacity, dtype=BREATH_DTYPE, path=path)
+
+    @property
+    def capacity(self) -> int:
+        return self._records.window_size
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def extend(self, breaths: Union[np.ndarray, Iterable[Mapping[str, float]]]) -> None:
+        """
+        Add breaths to the end, dropping the oldest beyond the capacity.
+        """
+        records = as_records(breaths)
+        if len(records) > 0:
+            self._records.inject(records)
+
+    def replace(
+        self, breaths: Union[np.ndarray, Iterable[Mapping[str, float]]]
+    ) -> None:
+        """
+        Replace the contents with breaths, a structured array of records or
+        breath dicts (keeping the last capacity of them).
+        """
+        self.clear()
+        self.extend(breaths)
+
+    @property
+    def records(self) -> np.ndarray:
+        """
+        A read-only structured array of all the breaths.
+        """
+        return np.asarray(self._records)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        One field for all breaths, NaN where it is missing.
+        """
+        return self.records[name]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [BreathRecord(row) for row in self.records[index].copy()]
+        return BreathRecord(self.records[index].copy())
+
+    def __iter__(self) -> Iterator[BreathRecord]:
+        return (BreathRecord(row) for row in self.records.copy())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __repr__(self) -> str:
+        return f"BreathStore({list(self)}, capacity={self.capacity})"
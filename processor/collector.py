@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 import time
 
 from zmq.decorators import context, socket
@@ -15,11 +15,26 @@ from processor.generator import Generator
 from processor.rotary import LocalRotary
 from processor.thread_base import ThreadBase
 from processor.flow_calibrator import FlowCalibrator
+from processor.rolling import time_slice
+from processor.wire import (
+    Frame,
+    Sample,
+    Subscribers,
+    pack_frame,
+    pack_frame_arrays,
+    pack_meta,
+    pack_sample,
+)
 
 from patient.mac_address import get_mac_addr, get_box_name
 
+if TYPE_CHECKING:
+    from processor.scheduler import AnalysisScheduler
+
 
 class CollectorThread(ThreadBase):
+    parent: Collector
+
     def __init__(self, parent: Collector):
         self.parent = parent
 
@@ -34,13 +49,44 @@ class CollectorThread(ThreadBase):
         # flow calibration
         self._caliber = FlowCalibrator()
 
+        # Send packed messages if all the nurse stations can read them
+        self._binary = config["global"]["binary-wire"].get(bool)
+
+        # If > 0, packed samples are sent in frames, at most this late (seconds)
+        self._batch = config["global"]["wire-batch"].as_number()
+
+        # Samples waiting to be sent in a frame, and when the first arrived
+        self._frame: List[Sample] = []
+        self._frame_start = 0.0
+
+        # Sequence number of the next sample sent
+        self._seq = 0
+
+        # Missed samples are served on the port plus this (if > 0)
+        self._backfill_offset = config["global"]["backfill-offset"].get(int)
+
+        # Copies of the windows (flow, heat, CO2 rows), for missed samples, made
+        # by the analysis after taking the rows from the rings; the count is odd
+        # while it does, so this thread can read both without the lock
+        self._windows: Tuple[np.ndarray, ...] = (
+            np.empty((3, 0)),
+            np.empty((3, 0)),
+            np.empty((4, 0)),
+        )
+        self._windows_count = 0
+
         super().__init__(parent)
 
     @context()
     @socket(zmq.SUB)
-    @socket(zmq.PUB)
+    @socket(zmq.XPUB)
+    @socket(zmq.REP)
     def run(
-        self, _ctx: zmq.Context, sub_socket: zmq.Socket, pub_socket: zmq.Socket
+        self,
+        _ctx: zmq.Context,
+        sub_socket: zmq.Socket,
+        pub_socket: zmq.Socket,
+        backfill_socket: zmq.Socket,
     ) -> None:
         sub_socket.connect("tcp://localhost:5556")
         sub_socket.subscribe(b"")
@@ -50,8 +96,33 @@ class CollectorThread(ThreadBase):
 
         pub_socket.bind(f"tcp://*:{self.parent.port}")
 
+        if self._backfill_offset > 0:
+            backfill_socket.bind(f"tcp://*:{self.parent.port + self._backfill_offset}")
+
+        # The XPUB socket tells us what the nurse stations subscribe to
+        subscribers = Subscribers()
+
         last = time.monotonic()
         while not self.parent.stop.is_set():
+            while pub_socket.poll(0):
+                subscribers.update(pub_socket.recv())
+            binary = self._binary and subscribers.binary
+
+            while backfill_socket.poll(0):
+                self._backfill(backfill_socket)
+
+            # Send the frame once its first sample has waited long enough
+            # (or as JSON, before any newer samples, if an older station joined)
+            if self._frame and (
+                not binary or time.monotonic() >= self._frame_start + self._batch
+            ):
+                if binary:
+                    pub_socket.send(pack_frame(self._frame))
+                else:
+                    for sample in self._frame:
+                        self._send_json(pub_socket, sample)
+                self._frame = []
+
             ready_events = sub_socket.poll(0.1)
             for _ in range(ready_events):
                 j = sub_socket.recv_json()
@@ -65,7 +136,19 @@ class CollectorThread(ThreadBase):
                     f = self._caliber.Q(j["F"])
                     p = j["P"] * self._pressure_scale - self._pressure_offset
 
-                pub_socket.send_json({"t": t, "f": f, "p": p})
+                heat = (j["C"], j["D"]) if "C" in j else None
+                co2 = (j["CO2"], j["Tp"], j["H"]) if "CO2" in j else None
+                sample = Sample(t, f, p, heat, co2, self._seq)
+                self._seq += 1
+
+                if binary and self._batch > 0:
+                    if not self._frame:
+                        self._frame_start = time.monotonic()
+                    self._frame.append(sample)
+                elif binary:
+                    pub_socket.send(pack_sample(sample))
+                else:
+                    self._send_json(pub_socket, sample)
 
                 if "sn" in j:
                     self._sn = j["sn"]
@@ -73,32 +156,11 @@ class CollectorThread(ThreadBase):
                 if "file" in j:
                     self._file = j["file"]
 
-                with self.lock:
-                    self._time.inject_value(t)
-                    self._flow.inject_value(f)
-                    self._pressure.inject_value(p)
-
-                    extras = {}
-                    if "C" in j:
-                        extras["t"] = t
-                        extras["C"] = j["C"]
-                        extras["D"] = j["D"]
-                        self._heat_time.inject_value(t)
-                        self._heat_temp.inject_value(j["C"])
-                        self._heat_duty.inject_value(j["D"])
-                    if "CO2" in j:
-                        extras["t"] = t
-                        extras["CO2"] = j["CO2"]
-                        extras["Tp"] = j["Tp"]
-                        extras["H"] = j["H"]
-                        self._co2_time.inject_value(t)
-                        self._co2.inject_value(j["CO2"])
-                        self._co2_temp.inject_value(j["Tp"])
-                        self._humidity.inject_value(j["H"])
-
-                # This runs every ~1 second, since it is only about that frequent from the device
-                if extras:
-                    pub_socket.send_json(extras)
+                self._flow_ring.push((t, f, p))
+                if heat is not None:
+                    self._heat_ring.push((t, *heat))
+                if co2 is not None:
+                    self._co2_ring.push((t, *co2))
 
             # Send rotary every ~1 second, regardless of status of input
             if time.monotonic() > (last + 1) or self.parent.rotary._changed.is_set():
@@ -125,34 +187,88 @@ class CollectorThread(ThreadBase):
                             setting = self.parent.rotary["Advanced"]
                             setting.file = self._file
 
-                    pub_socket.send_json(extra_dict)
+                    if binary:
+                        pub_socket.send(pack_meta(extra_dict))
+                    else:
+                        pub_socket.send_json(extra_dict)
 
                 last = time.monotonic()
                 self.parent.rotary._changed.clear()
 
-    def access_collected_data(self) -> None:
-        with self.parent.lock, self.lock:
-            newel = self.parent._time.new_elements(self._time)
-            self.parent._time.inject_batch(self._time, newel)
-            self.parent._flow.inject_batch(self._flow, newel)
-            self.parent._pressure.inject_batch(self._pressure, newel)
+    @staticmethod
+    def _send_json(pub_socket: zmq.Socket, sample: Sample) -> None:
+        pub_socket.send_json(
+            {"t": sample.t, "f": sample.f, "p": sample.p, "seq": sample.seq}
+        )
+
+        extras: Dict[str, float] = {}
+        if sample.heat is not None:
+            extras["t"] = sample.t
+            extras["C"], extras["D"] = sample.heat
+        if sample.co2 is not None:
+            extras["t"] = sample.t
+            extras["CO2"], extras["Tp"], extras["H"] = sample.co2
+
+        # This runs every ~1 second, since it is only about that frequent from the device
+        if extras:
+            pub_socket.send_json(extras)
+
+    def _backfill(self, backfill_socket: zmq.Socket) -> None:
+        """
+        Answer a request for the samples a nurse station missed: a JSON dict
+        with the times (ms) of the last sample before the gap ("after", may be
+        None for everything) and the first sample after it ("before"). The
+        reply is a frame with the samples strictly between, from the rolling
+        windows.
+        """
+
+        request = backfill_socket.recv_json()
+        after = request.get("after")
+        before = request.get("before")
+
+        # The newest samples are still in the rings, which only this thread
+        # writes to; read again if the analysis moved rows out meanwhile
+        while True:
+            count = self._windows_count
+            pending = [
+                ring.peek()
+                for ring in (self._flow_ring, self._heat_ring, self._co2_ring)
+            ]
+            windows = self._windows
+            if count % 2 == 0 and count == self._windows_count:
+                break
+            time.sleep(0.001)
+
+        arrays = []
+        for window, new in zip(windows, pending):
+            if window.shape[1]:
+                new = new[:, new[0] > window[0, -1]]
+            rows = np.concatenate((window, new), axis=1)
+            rows = rows[:, time_slice(rows[0], after, before)]
+            arrays.append(rows[:, (rows[0] != after) & (rows[0] != before)])
+
+        backfill_socket.send(pack_frame_arrays(Frame(*arrays)))
 
-            newel = self.parent._heat_time.new_elements(self._heat_time)
-            self.parent._heat_time.inject_batch(self._heat_time, newel)
-            self.parent._heat_temp.inject_batch(self._heat_temp, newel)
-            self.parent._heat_duty.inject_batch(self._heat_duty, newel)
-
-            newel = self.parent._co2_time.new_elements(self._co2_time)
-            self.parent._co2_time.inject_batch(self._co2_time, newel)
-            self.parent._co2.inject_batch(self._co2, newel)
-            self.parent._co2_temp.inject_batch(self._co2_temp, newel)
-            self.parent._humidity.inject_batch(self._humidity, newel)
+    def access_collected_data(self) -> None:
+        parent = self.parent
+        with parent.lock:
+            self._windows_count += 1
+            self._inject_all()
+            self._windows = tuple(
+                np.array([np.asarray(column) for column in columns], dtype=np.double)
+                for columns in (
+                    (parent._time, parent._flow, parent._pressure),
+                    (parent._heat_time, parent._heat_temp, parent._heat_duty),
+                    (parent._co2_time, parent._co2, parent._co2_temp, parent._humidity),
+                )
+            )
+            self._windows_count += 1
 
 
 class Collector(Generator):
     def __init__(self, *, rotary: Optional[LocalRotary] = None, port: int = 8100):
         # Collectors never log data
-        super().__init__(rotary=rotary, no_save=True)
+        super().__init__(rotary=rotary, no_save=True, persist=f"collector-{port}")
 
         self._collect_thread: Optional[CollectorThread] = None
         self.port = port
@@ -166,8 +282,8 @@ class Collector(Generator):
 
         self.rotary.alarms = self.alarms
 
-    def _analyze_timeseries(self) -> None:
-        super()._analyze_timeseries()
+    def _analyze_timeseries(self, *, averaged: bool = False) -> None:
+        super()._analyze_timeseries(averaged=averaged)
 
         if "Current Setting" in self.rotary:
             cur_setting: CurrentSetting = self.rotary["Current Setting"]
@@ -196,8 +312,8 @@ class Collector(Generator):
     def pressure(self) -> np.ndarray:
         return np.asarray(self._pressure)
 
-    def run(self) -> None:
-        super().run()
+    def run(self, scheduler: Optional[AnalysisScheduler] = None) -> None:
+        super().run(scheduler)
         self._collect_thread = CollectorThread(self)
         self._collect_thread.start()
 
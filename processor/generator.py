@@ -5,23 +5,43 @@ import enum
 import threading
 import time
 import warnings
+from concurrent.futures import Future
 import logging
 
 import numpy as np
-from typing import Dict, Any, List, Optional, TypeVar, TYPE_CHECKING
+from typing import (
+    Dict,
+    Any,
+    Callable,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    TYPE_CHECKING,
+    Union,
+)
 from pathlib import Path
 from datetime import datetime
 
 import processor.analysis
 from processor.rotary import LocalRotary
 from processor.settings import get_remote_settings
-from processor.config import config
-from processor.rolling import Rolling
+from processor.config import config, get_data_dir
+from processor.rolling import (
+    Envelope,
+    Rolling,
+    RollingSum,
+    decimate,
+    time_slice,
+    within_last,
+)
+from processor.breaths import BreathStore, BreathRecord, breaths_to_records
 from processor.saver import CSVSaverTS, CSVSaverCML, JSONSSaverBreaths, FieldInfo
 from processor.gen_record import GenRecord
 
 if TYPE_CHECKING:
     from typing_extensions import Final
+    from processor.scheduler import AnalysisScheduler
 
 
 class Status(enum.Enum):
@@ -35,12 +55,130 @@ class Status(enum.Enum):
 
 T = TypeVar("T", bound="Generator")
 
+# Critical frequency of the high-pass filter of the minimum bias volume
+MINBIAS_FREQUENCY = 0.0004
+
+# Decimation levels kept for plotting the flow, pressure, and volume (factors of
+# 2 to 2**PLOT_LEVELS)
+PLOT_LEVELS = 4
+
+
+class Snapshot(NamedTuple):
+    """
+    An immutable copy of everything a display needs, published by the analysis
+    thread after each cycle. Readers do not need to take the generator lock.
+    """
+
+    status: Status
+    time_ago: np.ndarray
+    realtime: np.ndarray
+    flow: np.ndarray
+    pressure: np.ndarray
+    volume: np.ndarray
+    co2_time_ago: np.ndarray
+    co2_realtime: np.ndarray
+    co2: np.ndarray
+    co2_temp: np.ndarray
+    humidity: np.ndarray
+    envelopes: Dict[str, Tuple[Envelope, ...]]
+    cumulative: Dict[str, float]
+    average_flow: Dict[int, float]
+    average_pressure: Dict[int, float]
+    average_co2: Dict[int, float]
+    alarms: Dict[str, Dict[str, float]]
+    breaths: Tuple[BreathRecord, ...]
+    last_update: Optional[datetime]
+    last_get: Optional[float]
+
+    # Only set by remote generators
+    last_interact: Optional[float] = None
+    current_monotonic: Optional[float] = None
+    time_left: Optional[float] = None
+
+    @property
+    def tardy(self) -> float:
+        """
+        The amount of time since last update (see Generator.tardy).
+        """
+        return (time.monotonic() - self.last_get) if self.last_get is not None else 0.0
+
+    @property
+    def time(self) -> np.ndarray:
+        """
+        The time array, with the most recent time as 0 (see Generator.time).
+        """
+        return self.time_ago + self.tardy if len(self.time_ago) > 0 else self.time_ago
+
+    @property
+    def co2_time(self) -> np.ndarray:
+        """
+        The CO2 time array, with the most recent time as 0 (see Generator.co2_time).
+        """
+        if len(self.co2_time_ago) > 0 and len(self.time_ago) > 0:
+            return self.co2_time_ago + self.tardy
+        else:
+            return self.co2_time_ago
+
+    def within_last(self, seconds: float) -> slice:
+        """
+        The slice of the time arrays (time, flow, pressure, ...) where time is
+        at most seconds, without computing the whole time array.
+        """
+        if len(self.realtime) == 0:
+            return slice(None)
+        return within_last(self.realtime, seconds - self.tardy)
+
+    def co2_within_last(self, seconds: float) -> slice:
+        """
+        The slice of the CO2 arrays where co2_time is at most seconds.
+        """
+        if len(self.co2_realtime) == 0 or len(self.realtime) == 0:
+            return slice(None)
+        start = self.realtime[-1] - seconds + self.tardy
+        return time_slice(self.co2_realtime, start)
+
+    def plot_data(
+        self, key: str, seconds: float, width: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The time and values of flow, pressure, or volume for the last seconds,
+        with about width points at most: if there are more samples than that,
+        the min/max envelope of the smallest decimation level that fits is used.
+        """
+
+        select = self.within_last(seconds)
+        values = getattr(self, key)
+        time_ago = self.time_ago[len(self.time_ago) - len(values) :]
+        start, stop, _ = select.indices(len(values))
+
+        if stop - start <= width:
+            return time_ago[select] + self.tardy, values[select]
+
+        for envelope in self.envelopes[key]:
+            if 2 * (stop - start) <= width * envelope.factor:
+                break
+
+        xvalues, yvalues = envelope.points(time_ago, values, select)
+        return xvalues + self.tardy, yvalues
+
+
+# In tail mode, breaths are looked for from 4σ of the smoothed derivative (see
+# smooth_derivative) before the last confirmed breath, so the smoothing is settled
+# when it starts
+TAIL_MARGIN = 4 * 0.2
+
+# Breaths (by average time) this close to the boundary are the confirmed breath
+TAIL_TOLERANCE = 3 * 0.2
+
 
 class Generator(abc.ABC):
     # Keeps track of how many generators have been created; each gets a unique ID
     # that lasts for the session.
     _total_generators: int = 0
 
+    # Pressure is deglitched (and memoized as "pressure") by the pressure property
+    _deglitch_pressure: bool = False
+
     def __init__(
         self,
         *,
@@ -48,8 +186,14 @@ class Generator(abc.ABC):
         logger: logging.Logger = None,
         no_save: bool = False,
         gen_record: GenRecord = None,
+        persist: Optional[str] = None,
     ) -> None:
 
+        # Rolling windows are kept in files here, to resume after a restart
+        self._persist_dir: Optional[Path] = None
+        if persist is not None and config["global"]["persist"].get(bool):
+            self._persist_dir = get_data_dir() / "rolling" / persist
+
         # The size of the rolling window
         self.window_size = config["global"]["window-size"].get(int)  # seconds
 
@@ -59,41 +203,74 @@ class Generator(abc.ABC):
         )  # seconds
 
         # The raw timestamps
-        self._time = Rolling(window_size=self.window_size, dtype=np.int64)
+        self._time = Rolling(
+            window_size=self.window_size, dtype=np.int64, path=self._path("time")
+        )
 
         # The flow
-        self._flow = Rolling(window_size=self.window_size)
+        self._flow = RollingSum(
+            window_size=self.window_size, path=self._path("flow"), levels=PLOT_LEVELS
+        )
 
         # The pressure
-        self._pressure = Rolling(window_size=self.window_size)
+        self._pressure = RollingSum(
+            window_size=self.window_size,
+            path=self._path("pressure"),
+            levels=PLOT_LEVELS,
+        )
 
         # Heating timestamps
-        self._heat_time = Rolling(window_size=self.extras_window_size, dtype=np.int64)
+        self._heat_time = Rolling(
+            window_size=self.extras_window_size,
+            dtype=np.int64,
+            path=self._path("heat_time"),
+        )
 
         # The heating element temp
-        self._heat_temp = Rolling(window_size=self.extras_window_size)
+        self._heat_temp = Rolling(
+            window_size=self.extras_window_size, path=self._path("heat_temp")
+        )
 
         # The heating element duty cycle
-        self._heat_duty = Rolling(window_size=self.extras_window_size)
+        self._heat_duty = Rolling(
+            window_size=self.extras_window_size, path=self._path("heat_duty")
+        )
 
         # CO2 timestamps
-        self._co2_time = Rolling(window_size=self.extras_window_size, dtype=np.int64)
+        self._co2_time = Rolling(
+            window_size=self.extras_window_size,
+            dtype=np.int64,
+            path=self._path("co2_time"),
+        )
 
         # The CO2 levels (if hardware present)
-        self._co2 = Rolling(window_size=self.extras_window_size)
+        self._co2 = RollingSum(
+            window_size=self.extras_window_size, path=self._path("co2")
+        )
 
         # The humidity levels (if hardware present)
-        self._humidity = Rolling(window_size=self.extras_window_size)
+        self._humidity = Rolling(
+            window_size=self.extras_window_size, path=self._path("humidity")
+        )
 
         # The temperature levels (if hardware present)
-        self._co2_temp = Rolling(window_size=self.extras_window_size)
+        self._co2_temp = Rolling(
+            window_size=self.extras_window_size, path=self._path("co2_temp")
+        )
 
         # The volume, expected to be generated by ._analyze_timeseries()
         self._volume = np.array([], dtype=np.double)
 
-        # Minimum bias volume, not shown on screen, used to compute volume differences,
-        # generated by ._analyze_timeseries()
-        self._minbias_volume = np.array([], dtype=np.double)
+        # Integrates new flow samples into the volume, keeping the filter state
+        self._unshifted_volume = Rolling(
+            window_size=self.window_size, levels=PLOT_LEVELS
+        )
+        self._volume_integrator = processor.analysis.VolumeIntegrator(
+            0.004, self._unshifted_volume
+        )
+
+        # Arrays derived from the rolling buffers, with the buffer versions used
+        self._derived: Dict[str, Tuple[Any, np.ndarray]] = {}
 
         # The previous collection of realtime values, as floats
         self._old_realtime: Optional[np.ndarray] = None
@@ -104,24 +281,42 @@ class Generator(abc.ABC):
         # The difference between the volume we show and volume with a mean of 0
         self._volume_shift = 0.0
 
+        # Running average window lengths (seconds), including the alarm window
+        avg_windows = list(config["global"]["avg-windows"].get(list)) + [
+            config["global"]["avg-window"].get(int)
+        ]
+
         # The cumulative running windows for flow
-        self._flow_cumulative = {
-            2: 0.0,
-            10: 0.0,
-        }
+        self._flow_cumulative = {int(length): 0.0 for length in sorted(avg_windows)}
 
         # The cumulative running windows for pressure
-        self._pressure_cumulative = {
-            2: 0.0,
-            10: 0.0,
-        }
+        self._pressure_cumulative = dict(self._flow_cumulative)
+
+        # The cumulative running windows for CO2
+        self._co2_cumulative = dict(self._flow_cumulative)
+
+        # Streaming smoothed derivatives, reused between full analyses
+        self._flow_derivative = processor.analysis.SmoothDerivative()
 
-        # The list of breaths
-        self._breaths: List[Dict[str, float]] = []
+        # Pressure may be deglitched, which revises the samples at the edges
+        self._pressure_derivative = processor.analysis.SmoothDerivative(margin=3)
+
+        # The most recent breaths
+        self._breaths = BreathStore(capacity=30, path=self._path("breaths"))
+
+        # Restored windows and breaths (see persist) are only kept if recent
+        if self._persist_dir is not None:
+            self._discard_stale()
 
         # The list of cumulative values from the analysis
         self._cumulative: Dict[str, float] = {}
 
+        # Restored breaths (see persist) give the cumulative values a head start
+        if len(self._breaths) > 0:
+            self._cumulative, _ = processor.analysis.cumulative(
+                {}, [], self._breaths.records
+            )
+
         # Timestamps on all cumulative keys for calculating staleness
         self._cumulative_timestamps: Dict[str, Any] = {}
 
@@ -134,8 +329,13 @@ class Generator(abc.ABC):
         # The rotary with alarm settings
         self.rotary = LocalRotary(get_remote_settings()) if rotary is None else rotary
 
-        # How often to rerun analyze (full analyze)
-        self.analyze_every = config["global"]["analyze-every"].as_number()  # seconds
+        # The alarm rules, with limits compiled from the rotary when it changes
+        self._alarm_table = processor.analysis.AlarmTable.from_sources(
+            processor.analysis.AlarmSource.cumulative
+        )
+        self._avg_alarm_table = processor.analysis.AlarmTable.from_sources(
+            processor.analysis.AlarmSource.average, processor.analysis.AlarmSource.co2
+        )
 
         # How often to process data in automatic mode (partial analyze)
         self.run_every = config["global"]["run-every"].as_number()  # seconds
@@ -146,6 +346,23 @@ class Generator(abc.ABC):
         # Last analyze run in local time - used by analyze_as_needed
         self._last_ana = time.monotonic()
 
+        # Run the full analysis once a breath may have completed, not just on the timer
+        self.analyze_on_breath = config["global"]["analyze-on-breath"].get(bool)
+
+        # How often to rerun analyze (full analyze); with breath triggers, this
+        # still runs when no breaths are seen, so alarms like stale data (apnea)
+        # are not delayed
+        self.analyze_every = config["global"]["analyze-every"].as_number()  # seconds
+
+        # Watches the new flow samples for the end of a breath
+        self._breath_trigger = processor.analysis.BreathTrigger(hysteresis=2.0)
+
+        # Local time when a triggered full analysis is due, if any
+        self._trigger_at: Optional[float] = None
+
+        # Only look for breaths after the last confirmed breath
+        self.analyze_tail = config["global"]["analyze-tail"].get(bool)
+
         # Last partial analyze for plotting
         self._last_get: Optional[float] = None
 
@@ -159,9 +376,18 @@ class Generator(abc.ABC):
         # This may be "reentered" by analyze calling the properties; that is fine.
         self.lock = threading.RLock()
 
+        # The latest published Snapshot, replaced (never modified) after each cycle
+        self._snapshot: Optional[Snapshot] = None
+
+        # The buffer versions (and last full analysis) the Snapshot was made from
+        self._snapshot_key: Optional[Tuple[Any, ...]] = None
+
         # A thread to run the analyze loop in the background
         self._run_thread: Optional[threading.Thread] = None
 
+        # Or a scheduler running it on shared threads
+        self._scheduler: Optional[AnalysisScheduler] = None
+
         # A stop signal to turn off the thread
         self.stop = threading.Event()
 
@@ -244,11 +470,13 @@ class Generator(abc.ABC):
                 "No file-based logging attached, not saving time series or cumulatives"
             )
 
-    def run(self) -> None:
+    def run(self, scheduler: Optional[AnalysisScheduler] = None) -> None:
         """
         Start running an analysis loop. Calling get_data and analyze_as_needed manually are not recommended
         while this is running in the background. Be sure to close/exit context to close and clean up the thread.
 
+        If a scheduler is given, the loop runs on its shared worker threads instead of a new thread.
+
         Started by the context manager
         """
 
@@ -269,8 +497,12 @@ class Generator(abc.ABC):
         for k, v in self.rotary.to_dict().items():
             self.logger.info(f"rotary: {k} set to {v['value']} (initial value)")
 
-        self._run_thread = threading.Thread(target=self._logging_run)
-        self._run_thread.start()
+        if scheduler is not None:
+            self._scheduler = scheduler
+            scheduler.add(self)
+        else:
+            self._run_thread = threading.Thread(target=self._logging_run)
+            self._run_thread.start()
 
     def _logging_run(self) -> None:
         try:
@@ -285,18 +517,28 @@ class Generator(abc.ABC):
         """
 
         while not self.stop.is_set():
-            with self.lock:
-                self._get_data()
-                self.analyze_as_needed()
+            self.step()
             self.stop.wait(self.run_every)
 
-    def analyze_as_needed(self) -> None:
+    def step(self) -> None:
+        """
+        One cycle of the analysis loop: get data, analyze, and publish a snapshot.
+        """
+
+        with self.lock:
+            self._get_data()
+            self.analyze_as_needed()
+            self._publish_snapshot()
+
+    def analyze_as_needed(self, *, averaged: bool = False) -> None:
         """
         Run basic analysis, and more complex analysis only if needed.
         """
-        self._analyze_timeseries()
+        self._analyze_timeseries(averaged=averaged)
+
+        if self._full_analysis_due(time.monotonic()):
+            self._trigger_at = None
 
-        if time.monotonic() - self._last_ana > self.analyze_every:
             self._analyze_full()
 
             self._last_ana = time.monotonic()
@@ -315,6 +557,67 @@ class Generator(abc.ABC):
         if self.saver_co2:
             self.saver_co2.save()
 
+    def _full_analysis_due(self, now: float) -> bool:
+        """
+        If analyze_as_needed will run the full analysis (now is monotonic).
+        """
+
+        triggered = self._trigger_at is not None and now >= self._trigger_at
+        return triggered or now - self._last_ana > self.analyze_every
+
+    def _tail_region(self) -> Optional[Tuple[float, float]]:
+        """
+        The start and end of the last confirmed breath. Every breath but the
+        most recent one is confirmed, since only the most recent can still be
+        completed by new data. The analysis needs one complete cycle before the
+        new breaths to find them, so it starts from the last confirmed breath.
+        None if there are not enough breaths (analyze everything).
+        """
+
+        empty = self._breaths.column("empty timestamp")[:-1]
+        empty = empty[~np.isnan(empty)]
+        if len(empty) < 2:
+            return None
+        return float(empty[-2]), float(empty[-1])
+
+    def _discard_stale(self) -> None:
+        """
+        Clear the restored windows if they were last written longer ago than
+        the time they span (they are kept or cleared together, by the flow
+        timestamps), and the restored breaths from before the window.
+        """
+
+        times = np.asarray(self._time)
+        span = (times[-1] - times[0]) / 1000 if len(times) else 0.0
+        written = self._time.restored_time
+
+        if written is None or time.time() - written > span:
+            for buffer in (
+                self._time,
+                self._flow,
+                self._pressure,
+                self._heat_time,
+                self._heat_temp,
+                self._heat_duty,
+                self._co2_time,
+                self._co2,
+                self._humidity,
+                self._co2_temp,
+            ):
+                buffer.clear()
+            self._breaths.clear()
+            return
+
+        recent = self._breaths.column("full timestamp") >= times[0] / 1000
+        if not np.all(recent):
+            self._breaths.replace(self._breaths.records[recent])
+
+    def _path(self, name: str) -> Optional[Path]:
+        """
+        The file backing a rolling buffer, if persisting.
+        """
+        return None if self._persist_dir is None else self._persist_dir / f"{name}.dat"
+
     def _set_alarms(self):
         "Overridden in remote generator to include silenced alarms. Collector doens't care."
         self.status = Status.ALERT if self.alarms else Status.OK
@@ -325,9 +628,34 @@ class Generator(abc.ABC):
         Copy in the remote/local datastream to internal cache.
         """
 
-    def _analyze_timeseries(self) -> None:
+    def _compute_averages(self) -> None:
+        """
+        The running averages of flow, pressure, and CO2. See processor.batch for
+        the version that does many generators at once.
+        """
+
+        timestamps = self.timestamps
+
+        self._flow_cumulative = processor.analysis.compute_cumulative(
+            self._flow_cumulative.keys(), timestamps, self._flow
+        )
+
+        self._pressure_cumulative = processor.analysis.compute_cumulative(
+            self._pressure_cumulative.keys(), timestamps, self._averaged_pressure
+        )
+
+        self._co2_cumulative = processor.analysis.compute_cumulative(
+            self._co2_cumulative.keys(),
+            np.asarray(self._co2_time),
+            self._co2,
+            timestamps[-1] if len(timestamps) > 0 else None,
+        )
+
+    def _analyze_timeseries(self, *, averaged: bool = False) -> None:
         """
         Quick analysis that's easier to run often, makes volume (run by `analyze` too)
+
+        If averaged, the running averages have already been computed (batched).
         """
         avg_window = config["global"]["avg-window"].get(int)
 
@@ -358,48 +686,27 @@ class Generator(abc.ABC):
                     with open(self._logging / f"time_{id(self)}.dat", "ba") as file:
                         file.write(self.pressure[start_index:].astype("<f4").tostring())
 
-            self._flow_cumulative = processor.analysis.compute_cumulative(
-                self._flow_cumulative.keys(), self.timestamps, self.flow
-            )
-
-            self._pressure_cumulative = processor.analysis.compute_cumulative(
-                self._pressure_cumulative.keys(), self.timestamps, self.pressure
-            )
+            if not averaged:
+                self._compute_averages()
 
             if len(self.realtime) > 0:
+                averages = {
+                    "flow": self._flow_cumulative[avg_window],
+                    "pressure": self._pressure_cumulative[avg_window],
+                }
+                if len(self.co2_realtime) > 0:
+                    averages["CO2"] = self._co2_cumulative[avg_window]
+
                 processor.analysis.avg_alarms(
                     self._avg_alarms,
                     self.rotary,
-                    "flow",
-                    self._flow_cumulative,
-                    self.realtime[-1],
-                    self.logger,
-                )
-                processor.analysis.avg_alarms(
-                    self._avg_alarms,
-                    self.rotary,
-                    "pressure",
-                    self._pressure_cumulative,
+                    averages,
                     self.realtime[-1],
                     self.logger,
+                    self._avg_alarm_table,
                 )
 
-                if len(self.co2_realtime) > 0:
-                    processor.analysis.co2_alarm(
-                        self._avg_alarms,
-                        self.rotary,
-                        self.co2[self.co2_time < avg_window],
-                        self.realtime[-1],
-                        self.logger,
-                    )
-
-            self._volume = processor.analysis.flow_to_volume(
-                realtime,
-                self._old_realtime,
-                self.flow,
-                self._volume - self._volume_shift,
-                critical_frequency=0.004,
-            )
+            self._volume = self._volume_integrator.update(realtime, self.flow)
             self._old_realtime = realtime
 
             # Removed "volume minimum is minimum ever"
@@ -422,13 +729,40 @@ class Generator(abc.ABC):
             )
             self._volume = self._volume + self._volume_shift
 
-            self._minbias_volume = processor.analysis.flow_to_volume(
-                realtime,
-                None,
-                self.flow - np.mean(self.flow),
-                None,
-                critical_frequency=0.0004,
-            )
+            if self.analyze_on_breath:
+                self._set_trigger(realtime)
+
+    def _set_trigger(self, realtime: np.ndarray) -> None:
+        """
+        Schedule a full analysis when the new flow samples, less the mean of
+        the window, show a breath may have completed. It waits until the samples cover 4σ of the smoothed
+        derivative past the crossing, so the turning points can be found.
+        """
+
+        flow = self.flow
+        crossing = self._breath_trigger.update(
+            realtime, flow, self._flow.mean_last(len(flow))
+        )
+        if crossing is not None and self._trigger_at is None:
+            wait = crossing + 4 * 0.2 - realtime[-1]
+            self._trigger_at = time.monotonic() + max(wait, 0.0)
+
+    def _unlocked_result(self, future: Future) -> Any:
+        """
+        Wait for a result with the lock released (if this thread holds it), so
+        the receive thread and snapshot readers are not held up meanwhile.
+        Nothing is changed before the wait, so they see the previous analysis.
+        """
+
+        try:
+            self.lock.release()
+        except RuntimeError:  # Not held by this thread
+            return future.result()
+
+        try:
+            return future.result()
+        finally:
+            self.lock.acquire()
 
     def _analyze_full(self) -> None:
         """
@@ -441,25 +775,53 @@ class Generator(abc.ABC):
         new_breaths = []
         updated_fields = set()
 
-        if len(realtime) > 0:
-            breaths = processor.analysis.measure_breaths(
-                realtime,
-                self.flow,
-                self._minbias_volume,
-                self.pressure,
-                breath_thresh=self.breath_thresh,
+        pool = self._scheduler.pool if self._scheduler is not None else None
+
+        region = self._tail_region() if self.analyze_tail else None
+        boundary = None
+        start = 0
+        if region is not None:
+            region_start, boundary = region
+            start = np.searchsorted(realtime, region_start - TAIL_MARGIN)
+
+        if len(realtime) > start:
+            arrays = (
+                realtime[start:],
+                self.flow[start:],
+                self._minbias_volume[start:],
+                self.pressure[start:],
             )
+            if pool is not None:
+                future = pool.submit(*arrays, breath_thresh=self.breath_thresh)
+                records = self._unlocked_result(future)
+            else:
+                records = breaths_to_records(
+                    processor.analysis.measure_breaths(
+                        *arrays,
+                        breath_thresh=self.breath_thresh,
+                        flow_derivative=self._flow_derivative,
+                        pressure_derivative=self._pressure_derivative,
+                    )
+                )
+
+            # The confirmed breaths found again at the start are dropped
+            if boundary is not None:
+                times = processor.analysis.average_times(records)
+                records = records[times > boundary + TAIL_TOLERANCE]
 
-            if len(breaths) > 0:
+            if len(records) > 0:
                 (
                     all_breaths,
                     updated,
                     new_breaths,
-                ) = processor.analysis.combine_breaths(self._breaths, breaths)
+                ) = processor.analysis.combine_records(self._breaths.records, records)
 
+                capacity = self._breaths.capacity
                 if self.saver_breaths is not None:
-                    self.saver_breaths.save_breaths(all_breaths[:-30])
-                self._breaths = all_breaths[-30:]
+                    self.saver_breaths.save_breaths(
+                        [BreathRecord(row) for row in all_breaths[:-capacity]]
+                    )
+                self._breaths.replace(all_breaths[-capacity:])
 
                 self._cumulative, updated_fields = processor.analysis.cumulative(
                     self._cumulative, updated, new_breaths
@@ -472,6 +834,7 @@ class Generator(abc.ABC):
             self._cumulative,
             self._alarms,
             self.logger,
+            self._alarm_table,
         )
 
         timestamp = time.time()
@@ -519,37 +882,227 @@ class Generator(abc.ABC):
             (time.monotonic() - self._last_get) if self._last_get is not None else 0.0
         )
 
+    def _make_snapshot(self) -> Snapshot:
+        """
+        Copy the current state into a Snapshot. Must be called with the lock held.
+        """
+
+        def frozen(array: np.ndarray) -> np.ndarray:
+            array = np.array(array)
+            array.flags.writeable = False
+            return array
+
+        # Memoized arrays are read-only and never modified, so are not copied
+        return Snapshot(
+            status=self.status,
+            time_ago=self._time_ago,
+            realtime=self.realtime,
+            flow=frozen(self.flow),
+            pressure=frozen(self.pressure),
+            volume=frozen(self.volume),
+            co2_time_ago=self._co2_time_ago,
+            co2_realtime=self.co2_realtime,
+            co2=frozen(self.co2),
+            co2_temp=frozen(self._co2_temp),
+            humidity=frozen(self._humidity),
+            envelopes=self._envelopes(),
+            cumulative=dict(self.cumulative),
+            average_flow=dict(self.average_flow),
+            average_pressure=dict(self.average_pressure),
+            average_co2=dict(self.average_co2),
+            alarms={name: dict(alarm) for name, alarm in self.alarms.items()},
+            breaths=tuple(self.breaths),
+            last_update=self.last_update,
+            last_get=self._last_get,
+        )
+
+    def _envelopes(self) -> Dict[str, Tuple[Envelope, ...]]:
+        """
+        Copies of the min/max envelopes of the plotted arrays, for the Snapshot.
+        """
+
+        def frozen(envelope: Envelope, shift: float = 0.0) -> Envelope:
+            mins = envelope.mins + shift
+            maxs = envelope.maxs + shift
+            mins.flags.writeable = maxs.flags.writeable = False
+            return envelope._replace(mins=mins, maxs=maxs)
+
+        levels = range(1, PLOT_LEVELS + 1)
+        envelopes = {
+            "flow": tuple(frozen(self._flow.envelope(level)) for level in levels),
+            "volume": tuple(
+                frozen(self._unshifted_volume.envelope(level), self._volume_shift)
+                for level in levels
+            ),
+        }
+
+        # A filtered pressure is decimated here, the raw one is kept up to date
+        if self._deglitch_pressure:
+            pressure = self.pressure
+            envelopes["pressure"] = tuple(
+                frozen(decimate(pressure, 2 ** level)) for level in levels
+            )
+        else:
+            envelopes["pressure"] = tuple(
+                frozen(self._pressure.envelope(level)) for level in levels
+            )
+
+        return envelopes
+
+    def _snapshot_version(self) -> Tuple[Any, ...]:
+        return (
+            self._time.version,
+            self._flow.version,
+            self._pressure.version,
+            self._co2_time.version,
+            self._last_ana,
+        )
+
+    def _publish_snapshot(self) -> Snapshot:
+        """
+        Make a Snapshot the latest one. Must be called with the lock held.
+        """
+
+        key = self._snapshot_version()
+        snapshot = self._snapshot = self._make_snapshot()
+
+        # Set after the Snapshot, so a reader never pairs a new key with an old one
+        self._snapshot_key = key
+        return snapshot
+
+    @property
+    def snapshot(self) -> Snapshot:
+        """
+        The latest Snapshot; safe to read without the lock. It is made again if
+        the data changed outside the analysis loop (like a manual get_data),
+        unless a step is in progress, which publishes its own.
+        """
+
+        key = self._snapshot_key
+        snapshot = self._snapshot
+        if snapshot is None or key != self._snapshot_version():
+            if self.lock.acquire(blocking=snapshot is None):
+                try:
+                    snapshot = self._publish_snapshot()
+                finally:
+                    self.lock.release()
+        assert snapshot is not None
+        return snapshot
+
+    def _memoize(
+        self, name: str, version: Any, compute: Callable[[], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Return a derived array, only computing it again when the version (of the
+        rolling buffers it depends on) changes. The array is read-only.
+        """
+
+        cached = self._derived.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # The version is read before computing, so a change during the
+        # computation is never hidden
+        value = compute()
+        value.flags.writeable = False
+        self._derived[name] = (version, value)
+        return value
+
+    @property
+    def _time_ago(self) -> np.ndarray:
+        """
+        The time array, with the most recent time as 0, without the tardy adjustment.
+        """
+
+        def compute() -> np.ndarray:
+            timestamps = self.timestamps
+            if len(timestamps) > 0:
+                return -(timestamps - timestamps[-1]) / 1000
+            else:
+                return np.array(timestamps)
+
+        return self._memoize("time", self._time.version, compute)
+
+    @property
+    def _co2_time_ago(self) -> np.ndarray:
+        """
+        The co2 time array, with the most recent time as 0, without the tardy adjustment.
+        """
+
+        def compute() -> np.ndarray:
+            co2_timestamps = np.asarray(self._co2_time)
+            timestamps = self.timestamps
+            if len(co2_timestamps) > 0 and len(timestamps) > 0:
+                return -(co2_timestamps - timestamps[-1]) / 1000
+            else:
+                return np.array(co2_timestamps)
+
+        version = (self._co2_time.version, self._time.version)
+        return self._memoize("co2_time", version, compute)
+
     @property
     def time(self) -> np.ndarray:
         """
         The time array, with the most recent time as 0, with an adjustment based on `last_update`. Mostly for plotting.
         """
-        timestamps = self.timestamps
-
-        if len(timestamps) > 0:
-            return -(timestamps - timestamps[-1]) / 1000 + self.tardy
-        else:
-            return timestamps
+        time_ago = self._time_ago
+        return time_ago + self.tardy if len(time_ago) > 0 else time_ago
 
     @property
     def co2_time(self) -> np.ndarray:
         """
         The co2 time array, with the most recent time as 0, with an adjustment based on `last_update`. Mostly for plotting.
         """
-        co2_timestamps = np.asarray(self._co2_time)
-        timestamps = self.timestamps
-
-        if len(co2_timestamps) > 0 and len(timestamps) > 0:
-            return -(co2_timestamps - timestamps[-1]) / 1000 + self.tardy
+        co2_time_ago = self._co2_time_ago
+        if len(co2_time_ago) > 0 and len(self._time) > 0:
+            return co2_time_ago + self.tardy
         else:
-            return co2_timestamps
+            return co2_time_ago
+
+    @property
+    def _averaged_pressure(self) -> Union[np.ndarray, RollingSum]:
+        """
+        The pressure the running averages are taken of: the deglitched pressure
+        if the generator filters it (as shown), otherwise the running sums of
+        the raw pressure.
+        """
+        return self.pressure if self._deglitch_pressure else self._pressure
+
+    @property
+    def _minbias_volume(self) -> np.ndarray:
+        """
+        Minimum bias volume, not shown on screen, used to compute volume
+        differences. Only the full analysis needs it, so it is computed then.
+        """
+
+        def compute() -> np.ndarray:
+            return processor.analysis.flow_to_volume(
+                *self._minbias_inputs(), critical_frequency=MINBIAS_FREQUENCY
+            )
+
+        return self._memoize("minbias_volume", self._minbias_version, compute)
+
+    @property
+    def _minbias_version(self) -> Tuple[int, int]:
+        return (self._time.version, self._flow.version)
+
+    def _minbias_inputs(self) -> Tuple[np.ndarray, None, np.ndarray, None]:
+        """
+        The flow_to_volume arguments for the minimum bias volume: the flow has
+        the mean of the window removed.
+        """
+
+        flow = self.flow
+        return self.realtime, None, flow - self._flow.mean_last(len(flow)), None
 
     @property
     def realtime(self) -> np.ndarray:
         """
         The actual time in seconds (arbitrary monotonic device clock)
         """
-        return self.timestamps / 1000
+        return self._memoize(
+            "realtime", self._time.version, lambda: self.timestamps / 1000
+        )
 
     @property
     def co2_realtime(self) -> np.ndarray:
@@ -557,7 +1110,11 @@ class Generator(abc.ABC):
         The actual time for the CO2 time
         """
 
-        return np.asarray(self._co2_time) / 1000
+        return self._memoize(
+            "co2_realtime",
+            self._co2_time.version,
+            lambda: np.asarray(self._co2_time) / 1000,
+        )
 
     @property
     def timestamps(self) -> np.ndarray:
@@ -597,7 +1154,7 @@ class Generator(abc.ABC):
         return self._volume
 
     @property
-    def breaths(self) -> List[Any]:
+    def breaths(self) -> BreathStore:
         """
         The last 30 computed breaths.
         """
@@ -639,6 +1196,13 @@ class Generator(abc.ABC):
         """
         return self._pressure_cumulative
 
+    @property
+    def average_co2(self) -> Dict[int, float]:
+        """
+        The cumulative running averages
+        """
+        return self._co2_cumulative
+
     def close(self) -> None:
         """
         Always close or use a context manager if running threads!
@@ -647,6 +1211,9 @@ class Generator(abc.ABC):
         self.stop.set()
         if self._run_thread is not None:
             self._run_thread.join()
+        if self._scheduler is not None:
+            self._scheduler.remove(self)
+            self._scheduler = None
 
         if self.saver_ts is not None:
             self.saver_ts.close()
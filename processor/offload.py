@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Mapping
+
+import numpy as np
+
+import processor.analysis
+from processor.breaths import breaths_to_records
+from processor.config import config
+
+# Any, not Optional[ModuleType]: mypy checks against Python 3.7, which lacks it
+shared_memory: Any
+try:
+    shared_memory = importlib.import_module("multiprocessing.shared_memory")
+except ImportError:  # Python 3.7
+    shared_memory = None
+
+
+def _init_worker(settings: Mapping[str, Any]) -> None:
+    # Spawned workers start from config_default.yml; use the parent's config
+    # (config files and command line included) instead
+    config.clear()
+    config.set(settings)
+
+
+def _measure_breaths(arrays: np.ndarray, breath_thresh: float) -> np.ndarray:
+    # A structured array is sent back as one buffer, not a pickle per breath
+    return breaths_to_records(
+        processor.analysis.measure_breaths(*arrays, breath_thresh=breath_thresh)
+    )
+
+
+def _measure_breaths_shared(name: str, size: int, breath_thresh: float) -> np.ndarray:
+    block = shared_memory.SharedMemory(name=name)
+    arrays = np.ndarray((4, size), dtype=np.double, buffer=block.buf)
+    arrays.flags.writeable = False
+    try:
+        return _measure_breaths(arrays, breath_thresh)
+    finally:
+        del arrays
+        try:
+            block.close()
+        except BufferError:
+            # A traceback still refers to the views; the mapping is freed
+            # with them instead
+            pass
+
+
+class BreathPool:
+    """
+    Runs measure_breaths in a pool of worker processes, so the breath analysis
+    of many generators can use all cores instead of sharing one GIL. The window
+    arrays are copied once into shared memory where available (Python 3.8+),
+    and the workers read them in place. The workers get the config of this
+    process.
+
+    The worker processes have no memory between calls, so the plain
+    (non-streaming) smoothed derivatives are used; results are the same.
+    """
+
+    def __init__(self, processes: int):
+        self._executor = ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(config.flatten(),),
+        )
+
+    def submit(
+        self,
+        time: np.ndarray,
+        flow: np.ndarray,
+        volume: np.ndarray,
+        pressure: np.ndarray,
+        *,
+        breath_thresh: float,
+    ) -> Future:
+        """
+        Start processor.analysis.measure_breaths in a worker process. The
+        future gives the breaths as records (see processor.breaths). The arrays
+        are copied before this returns, so they can change afterwards.
+        """
+
+        # The arrays are aligned on their newest samples
+        size = min(len(time), len(flow), len(volume), len(pressure))
+        if size == 0:
+            done: Future = Future()
+            done.set_result(breaths_to_records([]))
+            return done
+
+        if shared_memory is None:
+            arrays = np.array(
+                [time[-size:], flow[-size:], volume[-size:], pressure[-size:]]
+            )
+            return self._executor.submit(_measure_breaths, arrays, breath_thresh)
+
+        block = shared_memory.SharedMemory(create=True, size=4 * size * 8)
+        try:
+            arrays = np.ndarray((4, size), dtype=np.double, buffer=block.buf)
+            arrays[0] = time[-size:]
+            arrays[1] = flow[-size:]
+            arrays[2] = volume[-size:]
+            arrays[3] = pressure[-size:]
+            del arrays
+
+            future = self._executor.submit(
+                _measure_breaths_shared, block.name, size, breath_thresh
+            )
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+
+        # The worker opens the block by name, so it stays until it is done
+        block.close()
+        future.add_done_callback(lambda _: block.unlink())
+        return future
+
+    def measure_breaths(
+        self,
+        time: np.ndarray,
+        flow: np.ndarray,
+        volume: np.ndarray,
+        pressure: np.ndarray,
+        *,
+        breath_thresh: float,
+    ) -> np.ndarray:
+        """
+        Same as processor.analysis.measure_breaths, but in a worker process,
+        and returning records. Blocks (without holding the GIL) until done.
+        """
+
+        return self.submit(
+            time, flow, volume, pressure, breath_thresh=breath_thresh
+        ).result()
+
+    def close(self) -> None:
+        self._executor.shutdown()
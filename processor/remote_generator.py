@@ -6,17 +6,33 @@ from processor.analysis import pressure_deglitch_smooth
 import numpy as np
 import zmq
 from zmq.decorators import context, socket
+import collections
+import re
 import time
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Any, Deque, Optional, Dict, Union, TYPE_CHECKING
 import logging
 
-from processor.generator import Status, Generator
+from processor.config import config
+from processor.generator import Status, Generator, Snapshot
 from processor.gen_record import GenRecord
 from processor.thread_base import ThreadBase
+from processor.wire import JSON_TOPIC, TOPIC, Frame, Sample, unpack
+
+if TYPE_CHECKING:
+    from processor.scheduler import AnalysisScheduler
+
+# How long to wait for missed samples from a collector, and how long to stop
+# asking after it does not answer (it may be an older collector)
+BACKFILL_TIMEOUT = 0.5  # seconds
+BACKFILL_RETRY = 60  # seconds
+
+Message = Union[Sample, Frame, Dict[str, Any]]
 
 
 class RemoteThread(ThreadBase):
+    parent: RemoteGenerator
+
     def __init__(self, parent: RemoteGenerator):
         self.parent = parent
         self._address = self.parent.address
@@ -32,6 +48,24 @@ class RemoteThread(ThreadBase):
         self.time_left: Optional[float] = None
         self.monotime: Optional[float] = None
 
+        # The sequence number expected next, and the time of the last sample
+        self._next_seq: Optional[int] = None
+        self._last_t: Optional[float] = None
+
+        # The collector sends missed samples on request (see CollectorThread)
+        offset = config["global"]["backfill-offset"].get(int)
+        host, _, port = self._address.rpartition(":")
+        self._backfill_address: Optional[str] = (
+            f"{host}:{int(port) + offset}" if offset > 0 and port.isdigit() else None
+        )
+        self._backfill_socket: Optional[zmq.Socket] = None
+        self._backfill_retry = 0.0  # monotonic time
+
+        # While missed samples are asked for, the messages received meanwhile
+        # are held back (oldest first), until the reply or this time (monotonic)
+        self._backfill_deadline: Optional[float] = None
+        self._held: Deque[Message] = collections.deque()
+
         super().__init__(parent)
 
     def run(self) -> None:
@@ -43,114 +77,277 @@ class RemoteThread(ThreadBase):
 
     @context()
     @socket(zmq.SUB)
-    def _logging_run(self, _ctx: zmq.Context, sub_socket: zmq.Socket) -> None:
+    @socket(zmq.REQ)
+    def _logging_run(
+        self, _ctx: zmq.Context, sub_socket: zmq.Socket, backfill_socket: zmq.Socket
+    ) -> None:
 
         sub_socket.connect(self._address)
-        sub_socket.subscribe(b"")
+
+        poller = zmq.Poller()
+        poller.register(sub_socket, zmq.POLLIN)
+
+        if self._backfill_address is not None:
+            self._connect_backfill(backfill_socket, self._backfill_address)
+            poller.register(backfill_socket, zmq.POLLIN)
+
+        # Collectors send packed messages once everyone subscribed to them
+        sub_socket.subscribe(JSON_TOPIC)
+        sub_socket.subscribe(TOPIC)
 
         while not self.parent.stop.is_set():
-            number_events = sub_socket.poll(1 * 1000)
-            for _ in range(number_events):
+            deadline = self._backfill_deadline
+            timeout = 1.0 if deadline is None else max(deadline - time.monotonic(), 0)
+            events = dict(poller.poll(timeout * 1000))
+
+            if backfill_socket in events:
+                self._receive_backfill()
+            elif deadline is not None and time.monotonic() >= deadline:
+                self._backfill_timed_out()
+
+            if sub_socket in events:
                 self._last_update = datetime.now()
-                root = sub_socket.recv_json()
-                if "mac" in root:
-                    with self.lock:
-                        self.mac = root["mac"]
-                if "name" in root:
-                    with self.lock:
-                        self.box_name = root["name"]
-                if "sid" in root:
-                    with self.lock:
-                        self.sid = root["sid"]
-                if "rotary" in root:
-                    with self.lock:
-                        self.rotary_dict = root["rotary"]
-                if "last interact" in root:
-                    with self.lock:
-                        self.last_interact = root["last interact"]
-                if "monotime" in root:
-                    with self.lock:
-                        self.monotime = root["monotime"]
-                if "time left" in root:
-                    with self.lock:
-                        self.time_left = root["time left"]
-                if "f" in root:
-                    with self.lock:
-                        self._time.inject_value(root["t"])
-                        self._flow.inject_value(root["f"])
-                        self._pressure.inject_value(root["p"])
-                        self._last_get = time.monotonic()
-
-                        if self.status == Status.DISCON:
-                            self.parent.logger.info(
-                                f"(Re)Connecting to {self._address} successful"
-                            )
-                            self.status = Status.OK
-
-                if "C" in root:
-                    with self.lock:
-                        self._heat_time.inject_value(root["t"])
-                        self._heat_temp.inject_value(root["C"])
-                        self._heat_duty.inject_value(root["D"])
-
-                if "CO2" in root:
-                    with self.lock:
-                        self._co2_time.inject_value(root["t"])
-                        self._co2.inject_value(root["CO2"])
-                        self._co2_temp.inject_value(root["Tp"])
-                        self._humidity.inject_value(root["H"])
-
-            if number_events == 0 and self.status != Status.DISCON:
+                try:
+                    message = unpack(sub_socket.recv())
+                except ValueError as err:
+                    self.parent.logger.warning(f"Dropped message: {err}")
+                    continue
+
+                self._receive(message)
+
+            elif not events and deadline is None and self.status != Status.DISCON:
                 with self.lock:
                     self.status = Status.DISCON
                     self.parent.logger.info(f"Dropped connection to {self._address}")
 
-    def access_collected_data(self) -> None:
-        with self.parent.lock, self.lock:
-            self.parent.last_update = self._last_update
-            self.parent._last_get = self._last_get
-            self.parent.last_interact = self.last_interact
-            self.parent.current_monotonic = self.monotime
-            self.parent.time_left = self.time_left
-
-            newel = self.parent._time.new_elements(self._time)
-            self.parent._time.inject_batch(self._time, newel)
-            self.parent._flow.inject_batch(self._flow, newel)
-            self.parent._pressure.inject_batch(self._pressure, newel)
-
-            newel = self.parent._heat_time.new_elements(self._heat_time)
-            self.parent._heat_time.inject_batch(self._heat_time, newel)
-            self.parent._heat_temp.inject_batch(self._heat_temp, newel)
-            self.parent._heat_duty.inject_batch(self._heat_duty, newel)
-
-            newel = self.parent._co2_time.new_elements(self._co2_time)
-            self.parent._co2_time.inject_batch(self._co2_time, newel)
-            self.parent._co2.inject_batch(self._co2, newel)
-            self.parent._co2_temp.inject_batch(self._co2_temp, newel)
-            self.parent._humidity.inject_batch(self._humidity, newel)
+    def _connect_backfill(self, backfill_socket: zmq.Socket, address: str) -> None:
+        # A request without a reply (timed out) can be followed by another
+        backfill_socket.req_relaxed = True
+        backfill_socket.req_correlate = True
+        backfill_socket.linger = 0
+        backfill_socket.connect(address)
+        self._backfill_socket = backfill_socket
+
+    def _receive(self, message: Message) -> None:
+        """
+        Handle a message, or hold it back while missed samples are asked for.
+        """
+
+        if self._backfill_deadline is not None:
+            self._held.append(message)
+        elif isinstance(message, Sample):
+            self._receive_sample(message)
+        elif isinstance(message, Frame):
+            self._receive_frame(message)
+        else:
+            self._receive_dict(message)
+
+    def _release_held(self) -> None:
+        """
+        Handle the messages held back, until one of them asks for missed
+        samples again.
+        """
+
+        while self._held and self._backfill_deadline is None:
+            self._receive(self._held.popleft())
+
+    def _receive_dict(self, root: Dict[str, Any]) -> None:
+        """
+        A JSON message, or the metadata of the packed format.
+        """
+
+        if "mac" in root:
+            with self.lock:
+                self.mac = root["mac"]
+        if "name" in root:
+            with self.lock:
+                self.box_name = root["name"]
+        if "sid" in root:
+            with self.lock:
+                self.sid = root["sid"]
+        if "rotary" in root:
+            with self.lock:
+                self.rotary_dict = root["rotary"]
+        if "last interact" in root:
+            with self.lock:
+                self.last_interact = root["last interact"]
+        if "monotime" in root:
+            with self.lock:
+                self.monotime = root["monotime"]
+        if "time left" in root:
+            with self.lock:
+                self.time_left = root["time left"]
+        if "f" in root:
+            if "seq" in root and self._check_sequence(
+                root["seq"], 1, root["t"], root["t"]
+            ):
+                self._held.appendleft(root)
+                return
+            self._flow_ring.push((root["t"], root["f"], root["p"]))
+            self._received()
+
+        if "C" in root:
+            self._heat_ring.push((root["t"], root["C"], root["D"]))
+
+        if "CO2" in root:
+            self._co2_ring.push((root["t"], root["CO2"], root["Tp"], root["H"]))
+
+    def _receive_sample(self, sample: Sample) -> None:
+        """
+        A sample in the packed format.
+        """
+
+        if self._check_sequence(sample.seq, 1, sample.t, sample.t):
+            self._held.appendleft(sample)
+            return
+        self._flow_ring.push((sample.t, sample.f, sample.p))
+        self._received()
+
+        if sample.heat is not None:
+            self._heat_ring.push((sample.t, *sample.heat))
+
+        if sample.co2 is not None:
+            self._co2_ring.push((sample.t, *sample.co2))
+
+    def _receive_frame(self, frame: Frame) -> None:
+        """
+        Many samples in the packed format, pushed as a batch.
+        """
+
+        times = frame.flow[0]
+        if len(times) and self._check_sequence(
+            frame.seq, len(times), times[0], times[-1]
+        ):
+            self._held.appendleft(frame)
+            return
+        self._push_frame(frame)
+        self._received()
+
+    def _push_frame(self, frame: Frame) -> None:
+        self._flow_ring.push_rows(frame.flow)
+        self._heat_ring.push_rows(frame.heat)
+        self._co2_ring.push_rows(frame.co2)
+
+    def _check_sequence(self, seq: int, count: int, first: float, last: float) -> bool:
+        """
+        Call before pushing count samples numbered from seq, with times first
+        to last. If samples were missed (or these are the first), the ones
+        before first are requested from the collector; returns True if so, and
+        these should be held back until the reply, so the samples stay in order.
+        """
+
+        missed = self._next_seq is None or seq > self._next_seq
+        requested = (
+            missed
+            and (self._last_t is None or first > self._last_t)
+            and self._request_backfill(self._last_t, first)
+        )
+
+        self._next_seq = seq + count
+        self._last_t = last
+        return requested
+
+    def _request_backfill(self, after: Optional[float], before: float) -> bool:
+        """
+        Ask for the samples strictly between two times (None for all before)
+        from the collector's rolling windows, without waiting for the reply.
+        Returns False if the collector is not asked (see _backfill_timed_out).
+        """
+
+        if self._backfill_socket is None or time.monotonic() < self._backfill_retry:
+            return False
+
+        self._backfill_socket.send_json({"after": after, "before": before})
+        self._backfill_deadline = time.monotonic() + BACKFILL_TIMEOUT
+        return True
+
+    def _receive_backfill(self) -> None:
+        """
+        The reply with the missed samples. They are injected, followed by the
+        messages held back meanwhile.
+        """
+
+        assert self._backfill_socket is not None
+        reply: Optional[Message]
+        try:
+            reply = unpack(self._backfill_socket.recv())
+        except ValueError as err:
+            self.parent.logger.warning(f"Dropped missed samples: {err}")
+            reply = None
+
+        # A late reply, after the timeout, is ignored
+        if self._backfill_deadline is None:
+            return
+        self._backfill_deadline = None
+
+        if isinstance(reply, Frame):
+            self.parent.logger.info(
+                f"Received {reply.flow.shape[1]} missed samples from {self._backfill_address}"
+            )
+            # Straight to the generator, as it may not fit in the rings
+            with self.parent.lock:
+                self._inject_all(reply[:3])
+
+        self._release_held()
+
+    def _backfill_timed_out(self) -> None:
+        """
+        The collector did not answer in time (it may be an older collector), so
+        it is not asked again for BACKFILL_RETRY seconds.
+        """
+
+        self._backfill_deadline = None
+        self._backfill_retry = time.monotonic() + BACKFILL_RETRY
+        self.parent.logger.warning(
+            f"No missed samples from {self._backfill_address}, "
+            f"not asking for {BACKFILL_RETRY} s"
+        )
+        self._release_held()
+
+    def _received(self) -> None:
+        with self.lock:
+            self._last_get = time.monotonic()
 
             if self.status == Status.DISCON:
-                self.parent.status = Status.DISCON
+                self.parent.logger.info(f"(Re)Connecting to {self._address} successful")
+                self.status = Status.OK
 
-            # These log and perform (simple, please!) callbacks
-            if self.mac is not None:
-                self.parent.record.mac = self.mac
-            if self.box_name is not None:
-                self.parent.record.box_name = self.box_name
-            if self.sid != 0:
-                self.parent.record.sid = self.sid
+    def access_collected_data(self) -> None:
+        with self.parent.lock:
+            self._inject_all()
 
-            if len(self._time) > 0:
-                self.parent._last_ts = self._time[-1]
+            if len(self.parent._time) > 0:
+                self.parent._last_ts = int(self.parent._time[-1])
 
-            for k, v in self.rotary_dict.items():
-                if k in self.parent.rotary:
-                    if self.parent.rotary[k].value != v["value"]:
-                        self.parent.rotary[k].value = v["value"]
-                        self.parent.logger.info(f"rotary: {k} set to {v['value']}")
+            # The samples use the lock-free rings; the rest needs the thread lock
+            with self.lock:
+                self.parent.last_update = self._last_update
+                self.parent._last_get = self._last_get
+                self.parent.last_interact = self.last_interact
+                self.parent.current_monotonic = self.monotime
+                self.parent.time_left = self.time_left
+
+                if self.status == Status.DISCON:
+                    self.parent.status = Status.DISCON
+
+                # These log and perform (simple, please!) callbacks
+                if self.mac is not None:
+                    self.parent.record.mac = self.mac
+                if self.box_name is not None:
+                    self.parent.record.box_name = self.box_name
+                if self.sid != 0:
+                    self.parent.record.sid = self.sid
+
+                for k, v in self.rotary_dict.items():
+                    if k in self.parent.rotary:
+                        if self.parent.rotary[k].value != v["value"]:
+                            self.parent.rotary[k].value = v["value"]
+                            self.parent.logger.info(f"rotary: {k} set to {v['value']}")
 
 
 class RemoteGenerator(Generator):
+    _deglitch_pressure = True
+
     def __init__(
         self,
         *,
@@ -158,7 +355,11 @@ class RemoteGenerator(Generator):
         logger: logging.Logger,
         gen_record: GenRecord = None,
     ):
-        super().__init__(logger=logger, gen_record=gen_record)
+        super().__init__(
+            logger=logger,
+            gen_record=gen_record,
+            persist=re.sub(r"[^\w.-]+", "_", address),
+        )
         self._address = address
 
         self.status = Status.DISCON
@@ -175,8 +376,8 @@ class RemoteGenerator(Generator):
 
         self._remote_thread: Optional[RemoteThread] = None
 
-    def run(self) -> None:
-        super().run()
+    def run(self, scheduler: Optional[AnalysisScheduler] = None) -> None:
+        super().run(scheduler)
         self._remote_thread = RemoteThread(self)
         self._remote_thread.start()
 
@@ -195,13 +396,28 @@ class RemoteGenerator(Generator):
         else:
             super()._set_alarms()
 
+    def _make_snapshot(self) -> Snapshot:
+        return (
+            super()
+            ._make_snapshot()
+            ._replace(
+                last_interact=self.last_interact,
+                current_monotonic=self.current_monotonic,
+                time_left=self.time_left,
+            )
+        )
+
     @property
     def address(self) -> str:
         return self._address
 
     @property
     def pressure(self) -> np.ndarray:
-        return pressure_deglitch_smooth(np.asarray(self._pressure))
+        return self._memoize(
+            "pressure",
+            self._pressure.version,
+            lambda: pressure_deglitch_smooth(np.asarray(self._pressure)),
+        )
 
     def close(self) -> None:
         super().close()
@@ -1,34 +1,297 @@
 from __future__ import annotations
 
+import time
+import zlib
+from pathlib import Path
+
 import numpy as np
 
-from typing import Union, List
+from typing import NamedTuple, Optional, Union, List, Sequence, Tuple
+
+# Header of a file-backed Rolling: magic, window size, dtype checksum, start,
+# current size, and the wall clock time of the last write in ms (int64 each),
+# padded to keep the values aligned
+FILE_MAGIC = 0x504F564D524F4C4C  # "POVMROLL"
+FILE_HEADER_BYTES = 64
+
+
+def time_slice(
+    times: np.ndarray, start: Optional[float] = None, end: Optional[float] = None
+) -> slice:
+    """
+    The slice of sorted times with start <= time <= end (either bound may be
+    None). The slice selects the same range from any aligned array without a
+    mask or a negated copy.
+    """
+
+    lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+    hi = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+    return slice(lo, hi)
+
+
+def within_last(times: np.ndarray, span: float) -> slice:
+    """
+    The slice of sorted times within span of the last time.
+    """
+
+    if len(times) == 0:
+        return slice(0, 0)
+    return time_slice(times, times[-1] - span)
+
+
+class Envelope(NamedTuple):
+    """
+    The minimum and maximum of each block of factor samples of a buffer. Block i
+    starts at index first + i * factor of the buffer; first is negative if the
+    oldest block has partly left a rolling window.
+    """
+
+    first: int
+    factor: int
+    mins: np.ndarray
+    maxs: np.ndarray
+
+    def points(
+        self,
+        times: np.ndarray,
+        values: np.ndarray,
+        select: Optional[slice] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Points to plot for the selected range of the buffer (values, with the
+        aligned times; all by default): a min and a max point at the start time
+        of each block, and the samples before the first and after the last
+        block that is entirely selected. The line through them covers the same
+        range as the full resolution line, with about 2 / factor as many points.
+        """
+
+        if select is None:
+            select = slice(None)
+        start, stop, _ = select.indices(len(values))
+        factor = self.factor
+
+        # The blocks that lie entirely within the selection
+        lo = min(len(self.mins), max(0, -(-(start - self.first) // factor)))
+        hi = min(len(self.mins), max(lo, (stop - self.first) // factor))
+        index = self.first + np.arange(lo, hi) * factor
+
+        y = np.empty(2 * len(index), dtype=np.result_type(self.mins, self.maxs))
+        y[0::2] = self.mins[lo:hi]
+        y[1::2] = self.maxs[lo:hi]
+
+        begin = min(max(start, self.first + lo * factor), stop)
+        end = max(begin, self.first + hi * factor)
+        return (
+            np.concatenate(
+                (times[start:begin], np.repeat(times[index], 2), times[end:stop])
+            ),
+            np.concatenate((values[start:begin], y, values[end:stop])),
+        )
+
+
+def decimate(values: np.ndarray, factor: int) -> Envelope:
+    """
+    The min/max Envelope of an array, in blocks of factor samples from the
+    start. Rolling(levels=...) keeps these up to date as values are injected.
+    """
+
+    values = np.asarray(values)
+    blocks = values[: len(values) // factor * factor].reshape(-1, factor)
+    return Envelope(0, factor, blocks.min(axis=1), blocks.max(axis=1))
 
 
 class Rolling:
-    def __init__(self, init=None, *, window_size: int, dtype=None):
+    """
+    A rolling window, stored twice over in an array of double the window size
+    so the contents are always one contiguous view.
+
+    If a path is given, the array lives in a memory-mapped file (with the start
+    and size in a small header), so a restarted process picks up where the last
+    one left off. A file with a different window size or dtype is replaced.
+
+    With levels, min/max envelopes of blocks of 2, 4, ... 2**levels samples are
+    kept up to date as values are injected (for 1D buffers), so a plot can ask
+    for about as many points as it has pixels (see envelope).
+    """
+
+    def __init__(
+        self,
+        init=None,
+        *,
+        window_size: int,
+        dtype=None,
+        path: Union[str, Path, None] = None,
+        levels: int = 0,
+    ):
         if dtype is None:
             if init:
                 dtype = np.asarray(init).dtype
             else:
                 dtype = np.double
 
-        self._values = np.empty((window_size * 2,), dtype=dtype)
         self._start = 0
         self._window_size = window_size
         self._current_size = 0
+        self._version = 0
+
+        # The header of the backing file, if any
+        self._header: Optional[np.ndarray] = None
+
+        # When the contents restored from the file were written (seconds)
+        self._restored_time: Optional[float] = None
+
+        # Number of values injected since the last clear (for the envelopes)
+        self._count = 0
+
+        # Mins and maxs of each decimation level, and the values (one or none)
+        # of the level below that are waiting for the rest of their block
+        self._levels = [
+            (
+                Rolling(window_size=window_size // 2 ** level + 1, dtype=dtype),
+                Rolling(window_size=window_size // 2 ** level + 1, dtype=dtype),
+            )
+            for level in range(1, levels + 1)
+        ]
+        self._pending = [(np.empty(0, dtype), np.empty(0, dtype)) for _ in self._levels]
+
+        if path is None:
+            self._values = np.empty((window_size * 2,), dtype=dtype)
+        else:
+            self._open(Path(path), np.dtype(dtype))
+            self._count = self._current_size
+            if self._levels and self._current_size:
+                self._decimate(np.asarray(self))
 
         if init is not None:
             self.inject(init)
 
+    def _open(self, path: Path, dtype: np.dtype) -> None:
+        expected = (
+            FILE_MAGIC,
+            self._window_size,
+            zlib.crc32(repr(dtype.descr).encode()),
+        )
+        size = FILE_HEADER_BYTES + self._window_size * 2 * dtype.itemsize
+
+        fresh = not path.exists() or path.stat().st_size != size
+        if not fresh:
+            header = np.memmap(path, dtype="<i8", mode="r+", shape=(6,))
+            start, current_size = int(header[3]), int(header[4])
+            fresh = (
+                tuple(header[:3]) != expected
+                or not 0 <= start < self._window_size
+                or not 0 <= current_size <= self._window_size
+            )
+
+        if fresh:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                f.truncate(size)
+            header = np.memmap(path, dtype="<i8", mode="r+", shape=(6,))
+            header[:3] = expected
+            start, current_size = 0, 0
+        elif current_size:
+            self._restored_time = int(header[5]) / 1000
+
+        self._header = header.view(np.ndarray)
+        self._start = start
+        self._current_size = current_size
+        self._values = np.memmap(
+            path,
+            dtype=dtype,
+            mode="r+",
+            offset=FILE_HEADER_BYTES,
+            shape=(self._window_size * 2,),
+        ).view(np.ndarray)
+        self._sync()
+
+    def _sync(self) -> None:
+        """
+        Record the start, size, and time in the backing file, after the values.
+        """
+        if self._header is not None:
+            self._header[3] = self._start
+            self._header[4] = self._current_size
+            self._header[5] = int(time.time() * 1000)
+
+    def _decimate(self, values: np.ndarray) -> None:
+        """
+        Feed new values into the decimation levels, each from the one below.
+        """
+
+        mins = maxs = values
+        for level, (level_mins, level_maxs) in enumerate(self._levels):
+            pending_mins, pending_maxs = self._pending[level]
+            mins = np.concatenate((pending_mins, mins))
+            maxs = np.concatenate((pending_maxs, maxs))
+
+            size = len(mins) // 2 * 2
+            self._pending[level] = (mins[size:], maxs[size:])
+            if size == 0:
+                break
+
+            mins = np.minimum(mins[:size:2], mins[1:size:2])
+            maxs = np.maximum(maxs[:size:2], maxs[1:size:2])
+            level_mins.inject(mins)
+            level_maxs.inject(maxs)
+
     def clear(self) -> None:
         self._start = 0
         self._current_size = 0
+        self._version += 1
+        self._sync()
+
+        self._count = 0
+        for level, (level_mins, level_maxs) in enumerate(self._levels):
+            level_mins.clear()
+            level_maxs.clear()
+            self._pending[level] = (level_mins[:0], level_maxs[:0])
 
     @property
     def window_size(self) -> int:
         return self._window_size
 
+    @property
+    def restored_time(self) -> Optional[float]:
+        """
+        The wall clock time (seconds) when the contents restored from the
+        backing file were last written; None if nothing was restored.
+        """
+        return self._restored_time
+
+    @property
+    def levels(self) -> int:
+        """
+        The number of decimation levels (factors 2, 4, ... 2**levels).
+        """
+        return len(self._levels)
+
+    def envelope(self, level: int) -> Envelope:
+        """
+        The min/max Envelope in blocks of 2**level samples (read-only views).
+        The samples after the last complete block are not included yet.
+        """
+
+        if level == 0:
+            return Envelope(0, 1, np.asarray(self), np.asarray(self))
+
+        mins, maxs = self._levels[level - 1]
+        factor = 2 ** level
+        first = (self._count // factor - len(mins)) * factor
+        return Envelope(
+            first - (self._count - len(self)),
+            factor,
+            np.asarray(mins),
+            np.asarray(maxs),
+        )
+
+    @property
+    def version(self) -> int:
+        """
+        Incremented whenever the contents change, for caching derived values.
+        """
+        return self._version
+
     def inject_value(self, value: float) -> None:
         """
         High performance version of inject.
@@ -49,6 +312,13 @@ class Rolling:
             self._start += 1
             self._start %= self._window_size
 
+        self._version += 1
+        self._sync()
+
+        self._count += 1
+        if self._levels:
+            self._decimate(np.array([value], dtype=self._values.dtype))
+
     def inject(self, values: Union[List[float], np.ndarray]) -> None:
         """
         Add a value or an array of values to the end of the rolling buffer.  It
@@ -65,6 +335,11 @@ class Rolling:
         if values.ndim > 1:
             raise RuntimeError("Only 0D and 1D supported")
 
+        self._inject(values.reshape(-1))
+
+    def _inject(self, values: np.ndarray) -> None:
+        size = values.size
+
         fill_start = (
             self._start
             if self._current_size == self._window_size
@@ -72,10 +347,10 @@ class Rolling:
         )
 
         # Filling the first copy is always valid
-        self._values[fill_start : fill_start + values.size] = values
+        self._values[fill_start : fill_start + size] = values
 
         # If we go off the end, wrap around
-        overlap = fill_start + values.size - self._window_size
+        overlap = fill_start + size - self._window_size
         if overlap > 0:
             self._values[self._window_size + fill_start :] = values[
                 : self._window_size - fill_start
@@ -83,17 +358,20 @@ class Rolling:
             self._values[:overlap] = values[self._window_size - fill_start :]
         else:
             self._values[
-                fill_start
-                + self._window_size : fill_start
-                + self._window_size
-                + values.size
+                fill_start + self._window_size : fill_start + self._window_size + size
             ] = values
 
         # Update current size and starting position
-        self._current_size = min(self._current_size + values.size, self._window_size)
+        self._current_size = min(self._current_size + size, self._window_size)
         self._start = (
-            fill_start + values.size - (self._current_size - self._window_size)
+            fill_start + size - (self._current_size - self._window_size)
         ) % self._window_size
+        self._version += 1
+        self._sync()
+
+        self._count += size
+        if self._levels:
+            self._decimate(values)
 
     def explain(self) -> str:
         """Gives a nice text display of the internal structure"""
@@ -128,7 +406,23 @@ class Rolling:
     def __len__(self) -> int:
         return self._current_size
 
-    def inject_batch(self, other: Rolling, newel: int) -> None:
+    def between(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> slice:
+        """
+        For a sorted buffer (like timestamps), the slice with start <= value <=
+        end. Use it to select a time range from the aligned buffers.
+        """
+        return time_slice(np.asarray(self), start, end)
+
+    def within_last(self, span: float) -> slice:
+        """
+        For a sorted buffer (like timestamps), the slice within span of the
+        last value (like the last 10 seconds, in the units of the buffer).
+        """
+        return within_last(np.asarray(self), span)
+
+    def inject_batch(self, other: Union[Rolling, np.ndarray], newel: int) -> None:
         """
         Inject "newel" items from other to self.
         """
@@ -152,3 +446,219 @@ class Rolling:
             return 0
         else:
             return len(addition) - ind - (final_value == addition[ind])
+
+
+class RollingSum(Rolling):
+    """
+    A Rolling buffer that also keeps a running (prefix) sum of everything
+    injected, so the sum or mean of the last N elements is O(1), regardless of
+    N. The prefix sums are stored in a second Rolling buffer, one longer than
+    the window so the full window can be summed. They are summed again from
+    the buffer once per window of injected values, so the running total does
+    not grow (and lose precision) without bound.
+    """
+
+    def __init__(
+        self,
+        init=None,
+        *,
+        window_size: int,
+        dtype=None,
+        path: Union[str, Path, None] = None,
+        levels: int = 0,
+    ):
+        self._total = 0.0
+        self._prefix = Rolling([0.0], window_size=window_size + 1)
+
+        # Values injected since the prefix sums were last rebuilt
+        self._since_rebuild = 0
+
+        super().__init__(
+            init, window_size=window_size, dtype=dtype, path=path, levels=levels
+        )
+
+        # Contents restored from a file
+        if len(self._prefix) - 1 < len(self):
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        """
+        Sum the prefix again from the values in the buffer.
+        """
+
+        prefix = np.cumsum(np.asarray(self).astype(np.double))
+        self._total = prefix[-1] if len(prefix) else 0.0
+        self._prefix.clear()
+        self._prefix.inject_value(0.0)
+        self._prefix.inject(prefix)
+        self._since_rebuild = 0
+
+    def clear(self) -> None:
+        super().clear()
+        self._total = 0.0
+        self._prefix.clear()
+        self._prefix.inject_value(0.0)
+        self._since_rebuild = 0
+
+    def inject_value(self, value: float) -> None:
+        super().inject_value(value)
+        self._total += value
+        self._prefix.inject_value(self._total)
+
+        self._since_rebuild += 1
+        if self._since_rebuild >= self._window_size:
+            self._rebuild()
+
+    def inject(self, values: Union[List[float], np.ndarray]) -> None:
+        values = np.asarray(values, dtype=np.double)
+        super().inject(values)
+        if values.size:
+            prefix = self._total + np.cumsum(values)
+            self._total = prefix[-1]
+            self._prefix.inject(prefix)
+
+            self._since_rebuild += values.size
+            if self._since_rebuild >= self._window_size:
+                self._rebuild()
+
+    def sum_last(self, n: int) -> float:
+        """
+        The sum of the last n elements (or the whole buffer if shorter).
+        """
+        n = min(n, len(self))
+        if n <= 0:
+            return 0.0
+        return self._prefix[-1] - self._prefix[-n - 1]
+
+    def mean_last(self, n: int) -> float:
+        """
+        The mean of the last n elements (or the whole buffer if shorter); NaN
+        if empty.
+        """
+        n = min(n, len(self))
+        if n <= 0:
+            return np.nan
+        return self.sum_last(n) / n
+
+    def means_last(self, counts: np.ndarray) -> np.ndarray:
+        """
+        mean_last for an array of counts, from one lookup in the prefix sums.
+        """
+        counts = np.minimum(np.asarray(counts, dtype=np.intp), len(self))
+        prefix = np.asarray(self._prefix)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (prefix[-1] - prefix[-counts - 1]) / counts
+
+
+class RingBuffer:
+    """
+    A single-producer, single-consumer queue of rows (aligned columns, like
+    time, flow, and pressure), to hand samples from a receiver thread to the
+    analysis without a lock. The producer writes each row once with push; the
+    consumer takes every new row with pop. Each index is only ever written by
+    one side (head by the producer, after the row is written; tail by the
+    consumer), and reading or assigning an int is atomic in Python.
+
+    If the consumer falls capacity rows behind, the oldest rows are dropped;
+    they are counted in dropped.
+    """
+
+    def __init__(self, columns: Sequence[str], *, capacity: int, dtype=np.double):
+        self._columns = tuple(columns)
+        self._capacity = capacity
+        self._values = np.zeros((len(self._columns), capacity), dtype=dtype)
+
+        # Number of rows pushed; only changed by the producer
+        self._head = 0
+
+        # Number of rows pushed or being written; only changed by the producer
+        self._reserved = 0
+
+        # Number of rows popped (or dropped); only changed by the consumer
+        self._tail = 0
+
+        # Rows dropped by pop (consumer) and by push_rows (producer), each only
+        # changed by its side
+        self._dropped_old = 0
+        self._dropped_new = 0
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return self._columns
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def dropped(self) -> int:
+        """
+        The number of rows dropped so far, because they did not fit.
+        """
+        return self._dropped_old + self._dropped_new
+
+    def push(self, row: Sequence[float]) -> None:
+        """
+        Add one value per column. Only call from the producer thread.
+        """
+
+        self._reserved = self._head + 1
+
+        self._values[:, self._head % self._capacity] = row
+
+        # Publish the row only once it is written
+        self._head += 1
+
+    def push_rows(self, rows: np.ndarray) -> None:
+        """
+        Add many rows at once, given as an array of columns by rows. Only call
+        from the producer thread.
+        """
+
+        if rows.shape[1] > self._capacity:
+            self._dropped_new += rows.shape[1] - self._capacity
+            rows = rows[:, -self._capacity :]
+        size = rows.shape[1]
+        self._reserved = self._head + size
+
+        self._values[:, (self._head + np.arange(size)) % self._capacity] = rows
+
+        # Publish the rows only once they are written
+        self._head += size
+
+    def pop(self) -> np.ndarray:
+        """
+        All the rows pushed since the last pop, as an array of columns by rows.
+        Only call from the consumer side (one thread at a time).
+        """
+
+        head = self._head
+        tail = max(self._tail, head - self._capacity)
+        rows = self._values[:, np.arange(tail, head) % self._capacity]
+        dropped = tail - self._tail
+
+        # The producer may have been overwriting the oldest rows while copying
+        lost = min(self._reserved - self._capacity - tail, rows.shape[1])
+        if lost > 0:
+            rows = rows[:, lost:]
+            dropped += lost
+
+        self._dropped_old += dropped
+        self._tail = head
+        return rows
+
+    def peek(self) -> np.ndarray:
+        """
+        The rows waiting to be popped (and maybe some popped meanwhile), without
+        popping them. Only call from the producer thread, so none are written.
+        """
+
+        head = self._head
+        tail = max(self._tail, head - self._capacity)
+        return self._values[:, np.arange(tail, head) % self._capacity]
+
+    def __len__(self) -> int:
+        """
+        The number of rows waiting to be popped.
+        """
+        return min(self._head - self._tail, self._capacity)
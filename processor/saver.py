@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import time
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, NamedTuple, Sequence, Iterator
+from typing import TYPE_CHECKING, Mapping, NamedTuple, Sequence, Iterator
 from datetime import datetime
 import numpy as np
 import json
@@ -97,9 +97,9 @@ class JSONSSaverBreaths(Saver):
     def __bool__(self) -> bool:
         return False
 
-    def save_breaths(self, breaths: List[Dict[str, float]]) -> None:
+    def save_breaths(self, breaths: Sequence[Mapping[str, float]]) -> None:
         for breath in breaths:
-            self.file.write(json.dumps(breath))
+            self.file.write(json.dumps(dict(breath)))
             self.file.write("\n")
         self.save()
 
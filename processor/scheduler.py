@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from typing import Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+import processor.batch
+from processor.config import config
+from processor.offload import BreathPool
+
+if TYPE_CHECKING:
+    from processor.generator import Generator
+
+# Fraction of a period between consecutive generators; the golden ratio keeps
+# any number of generators spread out without knowing the total in advance
+STAGGER = 0.6180339887498949
+
+
+class AnalysisScheduler:
+    """
+    Runs the analysis loop (Generator.step) of many generators on a shared pool
+    of worker threads, instead of one thread per generator. Each generator is
+    run every run-every seconds; its deadlines (and full analyze-every
+    deadlines) are staggered so they don't all fire in the same tick.
+
+    The lag of a generator is how late (in seconds) its last step started; a
+    warning is logged when it falls a whole run-every period behind, and again
+    when it catches up. A generator whose step raises is logged and dropped,
+    and is listed in failed.
+
+    With processes > 0, the breath measurement of full analyses is offloaded
+    to a pool of worker processes (see BreathPool).
+
+    With batch, all generators that are due when a worker wakes up are stepped
+    together, with their time-series analysis vectorized (see processor.batch).
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        *,
+        processes: Optional[int] = None,
+        batch: Optional[bool] = None,
+    ):
+        if workers is None:
+            workers = config["global"]["analysis-workers"].get(int)
+        if processes is None:
+            processes = config["global"]["analysis-processes"].get(int)
+        if batch is None:
+            batch = config["global"]["analysis-batch"].get(bool)
+
+        self.batch = batch
+
+        # Shared by the generators for full analyses, if enabled
+        self.pool: Optional[BreathPool] = BreathPool(processes) if processes else None
+
+        # Protects everything below, and wakes workers when deadlines change
+        self._condition = threading.Condition()
+
+        # Heap of (deadline, unique count, generator)
+        self._queue: List[Tuple[float, int, Generator]] = []
+        self._count = itertools.count()
+
+        self._generators: Set[Generator] = set()
+        self._running: Set[Generator] = set()
+        self._lag: Dict[Generator, float] = {}
+        self._behind: Set[Generator] = set()
+        self._failed: Set[Generator] = set()
+        self._added = 0
+
+        self._stop = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"analysis-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, gen: Generator) -> None:
+        """
+        Start running a generator.
+        """
+
+        now = time.monotonic()
+        with self._condition:
+            phase = (self._added * STAGGER) % 1.0
+            self._added += 1
+
+            # The first full analysis happens (1 - phase) of a period from now
+            gen._last_ana = now - phase * gen.analyze_every
+
+            self._generators.add(gen)
+            self._lag[gen] = 0.0
+            self._failed.discard(gen)
+            if self.batch:
+                # Steps line up on multiples of run-every, so they can be batched
+                self._push(gen, math.ceil(now / gen.run_every) * gen.run_every)
+            else:
+                self._push(gen, now + phase * gen.run_every)
+
+    def remove(self, gen: Generator) -> None:
+        """
+        Stop running a generator, waiting for a step in progress to finish.
+        """
+
+        with self._condition:
+            self._generators.discard(gen)
+            self._queue = [item for item in self._queue if item[2] is not gen]
+            heapq.heapify(self._queue)
+            while gen in self._running:
+                self._condition.wait()
+            self._lag.pop(gen, None)
+            self._behind.discard(gen)
+            self._failed.discard(gen)
+
+    def lag(self, gen: Generator) -> float:
+        """
+        How late (in seconds) the last step of this generator started.
+        """
+        with self._condition:
+            return self._lag.get(gen, 0.0)
+
+    @property
+    def lags(self) -> Dict[Generator, float]:
+        with self._condition:
+            return dict(self._lag)
+
+    @property
+    def failed(self) -> Set[Generator]:
+        """
+        Generators no longer analyzed because their step raised.
+        """
+        with self._condition:
+            return set(self._failed)
+
+    def close(self) -> None:
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self) -> AnalysisScheduler:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _push(self, gen: Generator, deadline: float) -> None:
+        heapq.heappush(self._queue, (deadline, next(self._count), gen))
+        self._condition.notify()
+
+    def _next(self) -> Optional[List[Tuple[Generator, float]]]:
+        """
+        Wait for the next due generator (all due generators if batching); None
+        when stopping. Called with the condition held.
+        """
+
+        while not self._stop:
+            if not self._queue:
+                self._condition.wait()
+                continue
+
+            deadline, _, gen = self._queue[0]
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                self._condition.wait(wait)
+                continue
+
+            heapq.heappop(self._queue)
+            due = [(gen, deadline)]
+
+            if self.batch:
+                now = time.monotonic()
+                while self._queue and self._queue[0][0] <= now:
+                    deadline, _, gen = heapq.heappop(self._queue)
+                    due.append((gen, deadline))
+
+            self._running.update(gen for gen, _ in due)
+            return due
+
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._condition:
+                due = self._next()
+                if due is None:
+                    return
+                start = time.monotonic()
+                for gen, deadline in due:
+                    self._lag[gen] = lag = start - deadline
+                    if lag > gen.run_every and gen not in self._behind:
+                        self._behind.add(gen)
+                        gen.logger.warning(f"Analysis running {lag:.2f} s behind")
+                    elif lag <= gen.run_every and gen in self._behind:
+                        self._behind.discard(gen)
+                        gen.logger.info("Analysis caught up")
+
+            if len(due) > 1:
+                failed = set(processor.batch.step([gen for gen, _ in due]))
+            else:
+                ((gen, _),) = due
+                failed = set()
+                try:
+                    gen.step()
+                except Exception:
+                    gen.logger.exception("Unexpected error in analysis!")
+                    failed.add(gen)
+
+            with self._condition:
+                for gen, deadline in due:
+                    self._running.discard(gen)
+                    if gen in failed and gen in self._generators:
+                        self._failed.add(gen)
+                        gen.logger.error("Analysis stopped after an error")
+                    elif gen in self._generators:
+                        # Keep the cadence, unless we are already behind
+                        self._push(gen, max(deadline + gen.run_every, time.monotonic()))
+                self._condition.notify_all()
@@ -30,6 +30,9 @@ class Setting(abc.ABC):
         self._original_value: Any = None
         self._zero = zero
 
+        # Incremented when the value changes
+        self._version = 0
+
         # Rate at which settings change
         self._rate = rate
 
@@ -54,10 +57,19 @@ class Setting(abc.ABC):
         # Only used to set values remotely
         with self._lock:
             self._value = val
+            self._version += 1
+
+    @property
+    def version(self) -> int:
+        """
+        Incremented whenever the value changes, for caching derived values.
+        """
+        return self._version
 
     def reset(self) -> None:
         with self._lock:
             self._value = self._original_value
+            self._version += 1
 
     @property
     def default(self) -> Any:
@@ -71,6 +83,7 @@ class Setting(abc.ABC):
     def default(self, value: Any) -> None:
         with self._lock:
             self._value = value
+            self._version += 1
 
     def __str__(self) -> str:
         if self._zero is not None and self._value == 0:
@@ -154,12 +167,14 @@ class IncrSetting(Setting):
         with self._lock:
             if self._value < self._max:
                 self._value += self._incr
+                self._version += 1
 
     def _down_(self) -> None:
         "Return true if not at limit"
         with self._lock:
             if self._value > self._min:
                 self._value -= self._incr
+                self._version += 1
 
 
 class SelectionSetting(Setting):
@@ -191,12 +206,14 @@ class SelectionSetting(Setting):
         with self._lock:
             if self._value < len(self._listing) - 1:
                 self._value += 1
+                self._version += 1
 
     def _down_(self) -> None:
         "Return true if not at limit"
         with self._lock:
             if self._value > 0:
                 self._value -= 1
+                self._version += 1
 
     def __len__(self) -> int:
         return len(self._listing)
@@ -211,3 +228,4 @@ class SelectionSetting(Setting):
         # Only used to set values remotely
         with self._lock:
             self._value = self._listing.index(val)
+            self._version += 1
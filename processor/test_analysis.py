@@ -0,0 +1,228 @@
+from numpy.testing import assert_allclose
+import numpy as np
+
+import logging
+
+from processor.rolling import Rolling, RollingSum
+from processor.rotary import LocalRotary
+from processor.setting import IncrSetting
+from processor.breaths import breaths_to_records
+
+from processor.analysis import (
+    smooth_derivative,
+    SmoothDerivative,
+    pressure_deglitch_smooth,
+    flow_to_volume,
+    VolumeIntegrator,
+    BreathTrigger,
+    compute_cumulative,
+    batch_compute_cumulative,
+    nearest_index,
+    find_breaths,
+    combine_breaths,
+    cumulative,
+    add_alarms,
+    avg_alarms,
+    AlarmTable,
+    AlarmSource,
+)
+
+
+def breathing(seconds: float = 60.0):
+    rng = np.random.RandomState(42)
+    time = np.arange(0, seconds, 0.02)
+    flow = 30 * np.sin(2 * np.pi * time / 4) + rng.normal(0, 1, len(time))
+    pressure = 10 + 5 * np.cos(2 * np.pi * time / 4) + rng.normal(0, 0.1, len(time))
+    return time, flow, pressure
+
+
+def test_smooth_derivative_streaming():
+    time, flow, pressure = breathing()
+    flow_derivative = SmoothDerivative()
+    pressure_derivative = SmoothDerivative(margin=3)
+
+    for end in range(100, len(time), 150):
+        start = max(0, end - 1600)
+        window_pressure = pressure_deglitch_smooth(pressure[start:end])
+
+        expected = smooth_derivative(time[start:end], flow[start:end])
+        result = flow_derivative(time[start:end], flow[start:end])
+        for e, r in zip(expected, result):
+            assert_allclose(e, r, atol=1e-9)
+
+        expected = smooth_derivative(time[start:end], window_pressure)
+        result = pressure_derivative(time[start:end], window_pressure)
+        for e, r in zip(expected, result):
+            assert_allclose(e, r, atol=1e-9)
+
+
+def test_batch_kernels():
+    time, flow, pressure = breathing()
+    times = [time[:1600] * 1000, time[300:1900] * 1000, time[:1600] * 2000, []]
+    pressures = np.stack([pressure[:1600], pressure[300:1900], pressure[:1600]])
+
+    deglitched = pressure_deglitch_smooth(pressures)
+    for i in range(len(pressures)):
+        assert_allclose(deglitched[i], pressure_deglitch_smooth(pressures[i]))
+
+    windows = [RollingSum(window_size=1600) for _ in times]
+    for window, start in zip(windows, [0, 300, 1000]):
+        window.inject(flow[start : start + 2400])
+
+    averages = batch_compute_cumulative([2, 10], times, windows)
+    for t, window, result in zip(times, windows, averages):
+        expected = compute_cumulative([2, 10], np.asarray(t), window)
+        assert list(result) == [2, 10]
+        assert_allclose(list(result.values()), list(expected.values()))
+
+
+def test_volume_integrator():
+    time, flow, _ = breathing()
+    integrator = VolumeIntegrator(0.004, Rolling(window_size=1600))
+
+    for end in range(100, len(time) + 1, 25):
+        start = max(0, end - 1600)
+        volume = integrator.update(time[start:end], flow[start:end])
+        assert len(volume) == end - start
+
+    expected = flow_to_volume(time, None, flow, None, critical_frequency=0.004)
+    assert_allclose(volume, expected[-len(volume) :])
+
+
+def test_breath_trigger():
+    time, flow, _ = breathing(20)
+    trigger = BreathTrigger(hysteresis=2.0)
+
+    crossings = []
+    for end in range(100, len(time) + 1, 25):
+        crossing = trigger.update(time[max(0, end - 1600) : end], flow[:end][-1600:])
+        if crossing is not None:
+            crossings.append(crossing)
+
+    # Flow goes from exhaling to inhaling at 4n seconds
+    assert_allclose(crossings, [4, 8, 12, 16], atol=0.1)
+
+
+def test_breath_trigger_bias_flow():
+    # A bias flow keeps the flow above zero; crossings are found from the mean
+    time, flow, _ = breathing(20)
+    flow += 40
+    trigger = BreathTrigger(hysteresis=2.0)
+    raw_trigger = BreathTrigger(hysteresis=2.0)
+
+    # Starting with two whole breaths, so the mean of the window is the bias
+    crossings = []
+    for end in range(400, len(time) + 1, 25):
+        window_time = time[max(0, end - 1600) : end]
+        window_flow = flow[:end][-1600:]
+        assert raw_trigger.update(window_time, window_flow) is None
+
+        crossing = trigger.update(window_time, window_flow, np.mean(window_flow))
+        if crossing is not None:
+            crossings.append(crossing)
+
+    assert_allclose(crossings, [4, 8, 12, 16], atol=0.1)
+
+
+def test_nearest_index():
+    array = np.array([0.0, 0.5, 1.0, 2.0, 2.5])
+    values = np.array([-1.0, 0.0, 0.25, 0.3, 1.5, 2.2, 2.25, 3.0])
+    expected = [np.argmin(abs(array - v)) for v in values]
+    assert list(nearest_index(array, values)) == expected
+
+
+def test_find_breaths():
+    # B is found twice in the second breath, C is missing in the third
+    A = np.array([0.0, 4.0, 8.0, 12.0])
+    B = np.array([1.0, 5.0, 5.2, 9.0, 13.0])
+    C = np.array([2.0, 6.0, 14.0])
+    D = np.array([3.0, 7.0, 11.0, 15.0])
+
+    breaths = find_breaths(A, B, C, D)
+    assert [which for which, _ in breaths] == [0, 1, 2, 3] * 4
+    assert_allclose([t for _, t in breaths], [0, 1, 2, 3, 4, 5.1] + list(range(6, 16)))
+
+
+def test_combine_breaths():
+    old = [
+        {"inhale timestamp": 0.0, "full timestamp": 1.0, "empty timestamp": 3.0},
+        {"inhale timestamp": 4.0, "full timestamp": 5.0},
+    ]
+    new = [
+        {"full timestamp": 5.1, "empty timestamp": 7.0},
+        {"inhale timestamp": 8.0, "full timestamp": 9.0, "empty timestamp": 11.0},
+    ]
+
+    breaths, updated, added = combine_breaths(old, new)
+    assert len(breaths) == 3
+    assert updated == [breaths[1]] and added == [breaths[2]]
+    assert breaths[1]["full timestamp"] == 5.1
+    assert breaths[1]["empty timestamp"] == 7.0
+    assert_allclose(breaths[1]["time since last"], 4.0)
+    assert_allclose(breaths[2]["time since last"], 4.0)
+    assert_allclose(breaths[2]["inhale time"], 2.0)
+
+
+def test_cumulative():
+    breaths = [
+        {"empty timestamp": 1.0, "max pressure": 20.0, "time since last": 4.0},
+        {"empty timestamp": 1.1, "max pressure": 100.0},
+        {"empty timestamp": 5.0, "max pressure": 30.0, "time since last": 4.0},
+        {"empty timestamp": 9.0, "max pressure": 10.0, "time since last": 2.0},
+    ]
+
+    result, fields = cumulative({}, [], breaths)
+    assert_allclose(result["PIP"], 0.3 * 10 + 0.7 * (0.3 * 30 + 0.7 * 20))
+    assert_allclose(result["breath interval"], 0.3 * 2 + 0.7 * 4)
+    assert_allclose(result["RR"], 60 / result["breath interval"])
+    assert result["last breath timestamp"] == 9.0
+    assert fields == {"last breath timestamp", "PIP", "breath interval", "RR"}
+
+    records = breaths_to_records(breaths)
+    assert cumulative({}, records[:2], records[2:]) == (result, fields)
+    assert cumulative(result, [], breaths) == (result, set())
+
+
+def test_alarms():
+    def setting(name, value):
+        return IncrSetting(value, min=0, max=100, incr=1, name=name)
+
+    rotary = LocalRotary(
+        {
+            "RR Max": setting("RR Max", 0),
+            "PIP Max": setting("PIP Max", 30),
+            "PIP Min": setting("PIP Min", 5),
+            "Avg Flow Max": setting("Avg Flow Max", 40),
+        }
+    )
+    logger = logging.getLogger("test")
+    table = AlarmTable.from_sources(AlarmSource.cumulative)
+
+    values = {"last breath timestamp": 1.0, "PIP": 35.0, "RR": 50.0}
+    alarms = add_alarms(rotary, [], [], values, {}, logger, table)
+    assert list(alarms) == ["PIP Max"]
+    assert alarms["PIP Max"]["extreme"] == 35.0
+
+    # Limits are read again when a setting changes (see Setting.version)
+    rotary["RR Max"].value = 20
+    alarms = add_alarms(rotary, [], [], values, alarms, logger, table)
+    assert list(alarms) == ["RR Max", "PIP Max"]
+
+    values = {"last breath timestamp": 2.0, "PIP": 3.0, "RR": 50.0}
+    alarms = add_alarms(rotary, [], [], values, alarms, logger, table)
+    assert list(alarms) == ["RR Max", "PIP Min"]
+
+    # Turning the knob or resetting it changes the limit as well
+    for _ in range(3):
+        rotary["PIP Min"].down()
+    alarms = add_alarms(rotary, [], [], values, alarms, logger, table)
+    assert list(alarms) == ["RR Max"]
+
+    rotary["PIP Min"].reset()
+    alarms = add_alarms(rotary, [], [], values, alarms, logger, table)
+    assert list(alarms) == ["RR Max", "PIP Min"]
+
+    avg = avg_alarms({}, rotary, {"flow": 50.0, "pressure": 100.0}, 1.0, logger)
+    assert list(avg) == ["Avg Flow Max"]
+    avg = avg_alarms(avg, rotary, {"flow": 10.0}, 2.0, logger)
+    assert avg == {}
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+import zmq
+from numpy.testing import assert_allclose
+
+from processor.collector import Collector, CollectorThread
+from processor.remote_generator import RemoteGenerator, RemoteThread
+from processor.rotary import LocalRotary
+from processor.settings import get_remote_settings
+from processor.wire import Frame, Sample, pack_frame, unpack
+
+
+def remote_thread() -> RemoteThread:
+    gen = RemoteGenerator(
+        address="tcp://127.0.0.1:8100", logger=logging.getLogger("test")
+    )
+    return RemoteThread(gen)
+
+
+def test_backfill_gap():
+    thread = remote_thread()
+
+    with zmq.Context() as ctx:
+        with ctx.socket(zmq.REQ) as req, ctx.socket(zmq.REP) as rep:
+            rep.bind("inproc://backfill-gap")
+            thread._connect_backfill(req, "inproc://backfill-gap")
+
+            def answer():
+                request = rep.recv_json()
+                rep.send(pack_frame([Sample(request["before"] - 20, 1.0, 2.0)]))
+                assert req.poll(1000)
+                thread._receive_backfill()
+                return request
+
+            # The first sample asks for everything before it; the samples are
+            # held back until the reply
+            thread._receive(Sample(1000, 0.0, 0.0, seq=10))
+            thread._receive(Sample(1020, 0.0, 0.0, seq=11))
+            assert len(thread._flow_ring) == 0
+            assert answer() == {"after": None, "before": 1000}
+            assert_allclose(thread._flow_ring.peek()[0], [1000, 1020])
+
+            # Samples 12 to 14 were missed
+            thread._receive(Sample(1100, 0.0, 0.0, seq=15))
+            thread._receive(Sample(1120, 0.0, 0.0, seq=16))
+            assert answer() == {"after": 1020, "before": 1100}
+
+    # The backfilled samples go to the generator after the ones before them
+    assert_allclose(thread.parent._time, [980, 1000, 1020, 1080])
+    assert_allclose(thread._flow_ring.pop()[0], [1100, 1120])
+
+
+def test_backfill_reply():
+    collector = Collector(rotary=LocalRotary(get_remote_settings()))
+    thread = CollectorThread(collector)
+    collector._time.inject([1000, 1020, 1040, 1060, 1080])
+    collector._flow.inject([1.0, 2.0, 3.0, 4.0, 5.0])
+    collector._pressure.inject([6.0, 7.0, 8.0, 9.0, 10.0])
+    thread.access_collected_data()
+
+    # Samples not yet taken by the analysis are sent too
+    thread._flow_ring.push((1100, 11.0, 12.0))
+
+    with zmq.Context() as ctx:
+        with ctx.socket(zmq.REP) as rep, ctx.socket(zmq.REQ) as req:
+            rep.bind("inproc://backfill")
+            req.connect("inproc://backfill")
+
+            # The samples at the times asked about are not sent again
+            req.send_json({"after": 1020, "before": 1080})
+            thread._backfill(rep)
+            frame = unpack(req.recv())
+            assert isinstance(frame, Frame)
+            assert_allclose(frame.flow, [[1040, 1060], [3, 4], [8, 9]])
+            assert frame.heat.shape == (3, 0)
+
+            req.send_json({"after": None, "before": 1040})
+            thread._backfill(rep)
+            frame = unpack(req.recv())
+            assert isinstance(frame, Frame)
+            assert_allclose(frame.flow[0], [1000, 1020])
+
+            req.send_json({"after": 1060, "before": 1200})
+            thread._backfill(rep)
+            frame = unpack(req.recv())
+            assert isinstance(frame, Frame)
+            assert_allclose(frame.flow, [[1080, 1100], [5, 11], [10, 12]])
+
+
+def test_backfill_timeout():
+    thread = remote_thread()
+
+    with zmq.Context() as ctx:
+        with ctx.socket(zmq.REQ) as req, ctx.socket(zmq.REP) as rep:
+            thread._connect_backfill(req, "inproc://backfill-timeout")
+
+            # Nothing answers, so the held samples are let through and the
+            # collector is not asked again for a while
+            thread._receive(Sample(1000, 0.0, 0.0, seq=0))
+            assert thread._backfill_deadline is not None
+            thread._backfill_timed_out()
+            assert thread._backfill_retry > 0
+            assert_allclose(thread._flow_ring.peek()[0], [1000])
+
+            thread._receive(Sample(1100, 0.0, 0.0, seq=5))
+            assert thread._backfill_deadline is None
+            assert_allclose(thread._flow_ring.pop()[0], [1000, 1100])
+
+            def answer():
+                for seq in range(2):
+                    rep.recv()
+                    rep.send(pack_frame([Sample(900 + seq, 0.0, 0.0, seq=seq)]))
+
+            rep.bind("inproc://backfill-timeout")
+            answering = threading.Thread(target=answer)
+            answering.start()
+
+            # The socket can still be used, and the late reply is dropped
+            thread._backfill_retry = 0.0
+            assert thread._request_backfill(None, 1000)
+            answering.join()
+            assert req.poll(1000)
+            thread._receive_backfill()
+
+    assert_allclose(thread.parent._time, [901])
@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+import pytest
+
+from processor.breaths import BreathStore, breaths_to_records
+
+
+def test_breath_store():
+    store = BreathStore(capacity=3)
+    store.extend([{"full timestamp": 1.0}, {"empty timestamp": 2.0}])
+    store.extend([{"full timestamp": 5.0}, {"full timestamp": 6.0}])
+
+    assert len(store) == 3
+    assert "full timestamp" not in store[0]
+    assert dict(store[0]) == {"empty timestamp": 2.0}
+    assert dict(store[-1]) == {"full timestamp": 6.0}
+    assert store[-1]["full timestamp"] == 6.0
+    assert [b.get("full timestamp") for b in reversed(store)] == [6.0, 5.0, None]
+    assert json.loads(json.dumps(dict(store[1]))) == {"full timestamp": 5.0}
+
+    column = store.column("full timestamp")
+    assert np.isnan(column[0])
+    assert list(column[1:]) == [5.0, 6.0]
+
+    store.replace(store.records[1:2])
+    assert [dict(b) for b in store] == [{"full timestamp": 5.0}]
+
+    store.replace([{"time since last": 3.0}])
+    assert [dict(b) for b in store] == [{"time since last": 3.0}]
+
+
+def test_breaths_to_records():
+    records = breaths_to_records([{"max pressure": 20.0}, {}])
+    assert records["max pressure"][0] == 20.0
+    assert np.isnan(records["max pressure"][1])
+    assert np.isnan(records["empty timestamp"]).all()
+
+    # Fields outside of the schema would be lost
+    with pytest.raises(ValueError):
+        breaths_to_records([{"max pressure": 20.0, "unknown": 5.0}])
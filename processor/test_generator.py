@@ -0,0 +1,177 @@
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+import processor.batch
+from processor.analysis import flow_to_volume, pressure_deglitch_smooth
+from processor.generator import Generator
+from processor.rolling import within_last
+from processor.test_analysis import breathing
+
+
+class ReplayGenerator(Generator):
+    """
+    Feeds recorded arrays to the generator, half a second at a time.
+    """
+
+    def __init__(self, time, flow, pressure):
+        super().__init__(no_save=True)
+        self._replay = ((time * 1000).astype(np.int64), flow, pressure)
+        self._position = 0
+
+    def _get_data(self):
+        time, flow, pressure = self._replay
+        end = self._position + 25
+        self._time.inject(time[self._position : end])
+        self._flow.inject(flow[self._position : end])
+        self._pressure.inject(pressure[self._position : end])
+        self._position = end
+
+    @property
+    def pressure(self):
+        return np.asarray(self._pressure)
+
+
+def replay(time, flow, pressure, seconds: float):
+    gen = ReplayGenerator(time, flow, pressure)
+    for _ in range(int(seconds * 2)):
+        gen._get_data()
+        gen._analyze_timeseries()
+    return gen
+
+
+def test_minbias_volume():
+    # A bias flow, as from a ventilator, is removed with the mean of the window
+    time, flow, pressure = breathing()
+    gen = replay(time, flow + 20, pressure, 45)
+
+    expected = flow_to_volume(
+        gen.realtime, None, gen.flow - np.mean(gen.flow), None, 0.0004
+    )
+    assert_allclose(gen._minbias_volume, expected, atol=1e-6)
+
+
+def test_breath_trigger_bias_flow():
+    # Breaths are seen through a bias flow, which keeps the flow above zero
+    time, flow, pressure = breathing()
+    gen = ReplayGenerator(time, flow + 40, pressure)
+    gen.analyze_on_breath = True
+
+    triggers = 0
+    for _ in range(60 * 2):
+        gen._get_data()
+        gen._analyze_timeseries()
+        if gen._trigger_at is not None:
+            triggers += 1
+            gen._trigger_at = None
+
+    # One breath every 4 seconds
+    assert 13 <= triggers <= 16
+
+
+class DeglitchedReplayGenerator(ReplayGenerator):
+    _deglitch_pressure = True
+
+    @property
+    def pressure(self):
+        return self._memoize(
+            "pressure",
+            self._pressure.version,
+            lambda: pressure_deglitch_smooth(np.asarray(self._pressure)),
+        )
+
+
+def test_averages():
+    time, flow, pressure = breathing()
+    pressure[::7] += 1.0
+
+    gens = [
+        cls(time, flow, pressure)
+        for cls in (ReplayGenerator, DeglitchedReplayGenerator)
+    ]
+    for gen in gens:
+        for _ in range(60):
+            gen._get_data()
+
+        # CO2 is read about once a second, at other times than the flow
+        co2_time = np.arange(time[0] + 0.3, time[1500] + 0.3, 1.0)
+        gen._co2_time.inject((co2_time * 1000).astype(np.int64))
+        gen._co2.inject(np.linspace(400, 500, len(co2_time)))
+
+    expected = []
+    for gen in gens:
+        gen._compute_averages()
+
+        # The pressure as shown is averaged, and CO2 is timed from the last
+        # flow sample
+        select = within_last(gen.timestamps, 10000)
+        assert gen.average_pressure[10] == pytest.approx(np.mean(gen.pressure[select]))
+        co2_time = -(np.asarray(gen._co2_time) - gen.timestamps[-1]) / 1000
+        assert gen.average_co2[10] == pytest.approx(np.mean(gen.co2[co2_time < 10]))
+
+        expected.append((gen.average_flow, gen.average_pressure, gen.average_co2))
+
+    assert expected[0][1] != pytest.approx(expected[1][1])
+
+    processor.batch.analyze_timeseries(gens)
+    for gen, averages in zip(gens, expected):
+        assert gen.average_flow == pytest.approx(averages[0])
+        assert gen.average_pressure == pytest.approx(averages[1])
+        assert gen.average_co2 == pytest.approx(averages[2])
+
+
+def test_unlocked_result():
+    # The lock is free while waiting, so others can use the generator
+    time, flow, pressure = breathing(1)
+    gen = ReplayGenerator(time, flow, pressure)
+    future: Future = Future()
+
+    def finish():
+        with gen.lock:
+            future.set_result(1)
+
+    with gen.lock:
+        thread = threading.Thread(target=finish)
+        thread.start()
+        assert gen._unlocked_result(future) == 1
+        assert gen.lock._is_owned()  # type: ignore
+    thread.join()
+
+    # Also works without the lock
+    assert gen._unlocked_result(future) == 1
+
+
+def test_batched_minbias_volume():
+    time, flow, pressure = breathing()
+    gens = [ReplayGenerator(time, flow + offset, pressure) for offset in (0, 5, 20)]
+    for gen in gens:
+        for _ in range(60):
+            gen._get_data()
+        gen._last_ana = -np.inf
+
+    # Not due for a full analysis, so not computed ahead of time
+    idle = ReplayGenerator(time, flow, pressure)
+    for _ in range(60):
+        idle._get_data()
+    idle._last_ana = np.inf
+
+    # A shorter window is left to compute on its own
+    short = ReplayGenerator(time, flow, pressure)
+    for _ in range(30):
+        short._get_data()
+    short._last_ana = -np.inf
+
+    processor.batch.analyze_timeseries([*gens, idle, short])
+
+    for gen in gens:
+        assert "minbias_volume" in gen._derived
+        expected = flow_to_volume(
+            gen.realtime, None, gen.flow - np.mean(gen.flow), None, 0.0004
+        )
+        assert_allclose(gen._minbias_volume, expected, rtol=1e-12, atol=1e-9)
+
+    assert "minbias_volume" not in idle._derived
+    assert "minbias_volume" not in short._derived
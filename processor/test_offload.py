@@ -0,0 +1,40 @@
+import numpy as np
+
+from processor.analysis import measure_breaths, flow_to_volume
+from processor.breaths import breaths_to_records
+from processor.offload import BreathPool
+from processor.test_analysis import breathing
+
+
+def assert_records_equal(actual, expected):
+    assert actual.dtype == expected.dtype
+    for name in expected.dtype.names:
+        np.testing.assert_array_equal(actual[name], expected[name])
+
+
+def test_breath_pool():
+    time, flow, pressure = breathing(30)
+    volume = flow_to_volume(time, None, flow, None, critical_frequency=0.004)
+    expected = breaths_to_records(
+        measure_breaths(time, flow, volume, pressure, breath_thresh=50)
+    )
+    assert len(expected) > 0
+
+    pool = BreathPool(1)
+    try:
+        result = pool.measure_breaths(time, flow, volume, pressure, breath_thresh=50)
+        assert_records_equal(result, expected)
+
+        # A longer array (one older sample) is aligned on the newest samples
+        longer = [time[0] - 0.02, *time]
+        result = pool.measure_breaths(longer, flow, volume, pressure, breath_thresh=50)
+        assert_records_equal(result, expected)
+        assert len(pool.measure_breaths([], [], [], [], breath_thresh=50)) == 0
+
+        # The arrays are copied on submit, so they can change while it runs
+        flow = flow.copy()
+        future = pool.submit(time, flow, volume, pressure, breath_thresh=50)
+        flow[:] = 0
+        assert_records_equal(future.result(), expected)
+    finally:
+        pool.close()
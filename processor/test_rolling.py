@@ -1,7 +1,10 @@
+import threading
+import time
+
 from numpy.testing import assert_allclose
 import numpy as np
 
-from processor.rolling import Rolling
+from processor.rolling import Rolling, RollingSum, RingBuffer, decimate
 
 
 def test_rolling_single():
@@ -166,3 +169,162 @@ def test_batch():
     r.inject_batch(arr, newel)
 
     assert_allclose(r[:], [3, 4, 5, 6, 7, 8])
+
+
+def test_rolling_sum():
+    r = RollingSum(window_size=4)
+    assert r.sum_last(3) == 0.0
+    assert np.isnan(r.mean_last(3))
+
+    r.inject([1, 2, 3])
+    assert r.sum_last(2) == 5.0
+    assert r.sum_last(10) == 6.0
+    assert r.mean_last(3) == 2.0
+
+    r.inject_value(4)
+    r.inject([5, 6, 7])
+    assert_allclose(r[:], [4, 5, 6, 7])
+    assert r.sum_last(1) == 7.0
+    assert r.sum_last(4) == 22.0
+    assert r.mean_last(2) == 6.5
+
+    r.inject(np.arange(20))
+    assert r.sum_last(4) == 16 + 17 + 18 + 19
+
+    # The running total is summed again from the window, so it stays small
+    for value in range(1000):
+        r.inject_value(1e12 + value)
+    assert r._total < 4e12 * 2
+    assert r.sum_last(1) == 1e12 + 999
+
+    r.clear()
+    assert r.sum_last(4) == 0.0
+
+
+def test_rolling_version():
+    r = Rolling(window_size=4)
+    versions = [r.version]
+
+    r.inject_value(1)
+    versions.append(r.version)
+    r.inject([2, 3])
+    versions.append(r.version)
+    r.inject_batch(Rolling([4, 5], window_size=4), 0)
+    versions.append(r.version)
+    r.clear()
+    versions.append(r.version)
+
+    assert versions[0] < versions[1] < versions[2] == versions[3] < versions[4]
+
+
+def test_time_ranges():
+    r = Rolling(window_size=5)
+    assert r.within_last(10) == slice(0, 0)
+
+    r.inject([1000, 2000, 3000, 4000, 5000, 6000])
+    assert_allclose(r[r.within_last(2000)], [4000, 5000, 6000])
+    assert_allclose(r[r.between(2500, 4000)], [3000, 4000])
+    assert_allclose(r[r.between(end=3000)], [2000, 3000])
+
+
+def test_ring_buffer():
+    ring = RingBuffer(("time", "flow"), capacity=4)
+    assert ring.pop().shape == (2, 0)
+
+    ring.push((1, 10))
+    ring.push((2, 20))
+    assert len(ring) == 2
+    assert_allclose(ring.pop(), [[1, 2], [10, 20]])
+    assert len(ring) == 0
+
+    # Falling behind drops the oldest rows
+    for i in range(3, 10):
+        ring.push((i, 10 * i))
+    assert_allclose(ring.pop()[0], [6, 7, 8, 9])
+    assert ring.dropped == 3
+
+    ring.push_rows(np.array([[10, 11], [100, 110]]))
+    assert_allclose(ring.pop(), [[10, 11], [100, 110]])
+    ring.push_rows(np.array([np.arange(12, 18), np.arange(120, 180, 10)]))
+    assert_allclose(ring.pop()[0], [14, 15, 16, 17])
+    assert ring.dropped == 5
+
+
+def test_ring_buffer_threads():
+    ring = RingBuffer(("time",), capacity=1000)
+    received = []
+
+    def produce():
+        for i in range(20000):
+            ring.push((i,))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    while producer.is_alive() or len(ring):
+        received.extend(ring.pop()[0])
+    producer.join()
+
+    # Rows may be dropped if the consumer falls behind, but are never out of order
+    assert received[-1] == 19999
+    assert np.all(np.diff(received) > 0)
+    assert len(received) + ring.dropped == 20000
+
+
+def test_rolling_file(tmp_path):
+    path = tmp_path / "flow.dat"
+    r = RollingSum(window_size=4, path=path)
+    assert r.restored_time is None
+    r.inject([1, 2, 3])
+    r.inject_value(4)
+    r.inject(5)
+
+    restored = RollingSum(window_size=4, path=path)
+    assert restored.restored_time is not None
+    assert abs(restored.restored_time - time.time()) < 10
+    assert_allclose(restored[:], [2, 3, 4, 5])
+    assert restored.sum_last(2) == 9.0
+
+    restored.inject_value(6)
+    assert_allclose(restored[:], [3, 4, 5, 6])
+    assert restored.sum_last(4) == 18.0
+
+    # A different layout starts over
+    assert len(Rolling(window_size=5, path=path)) == 0
+    assert len(Rolling(window_size=5, dtype=np.int64, path=path)) == 0
+
+
+def test_rolling_envelope():
+    values = np.sin(np.arange(100) * 0.3)
+    r = Rolling(window_size=64, levels=3)
+    r.inject(values[:7])
+    for value in values[7:50]:
+        r.inject_value(value)
+    r.inject(values[50:])
+
+    # Blocks line up with the injected values, so the oldest one is partial
+    envelope = r.envelope(2)
+    assert envelope.factor == 4
+    assert envelope.first == -4
+    expected = decimate(values[36:], 4)
+    assert_allclose(envelope.mins[1:], expected.mins)
+    assert_allclose(envelope.maxs[1:], expected.maxs)
+
+    r.inject([1.5, 0.0, 0.0, 0.0])
+    envelope = r.envelope(3)
+    assert envelope.maxs[-1] == 1.5
+
+    times = np.arange(64.0)
+    x, y = envelope.points(times, r[:], slice(10, None))
+    assert len(x) == len(y) < 30
+    assert np.all(np.diff(x) >= 0)
+    assert y.min() == np.min(r[10:])
+    assert y.max() == 1.5
+
+    # Only the selected samples, even if the last block goes past the end
+    x, y = envelope.points(times, r[:], slice(10, 45))
+    assert x.min() == 10 and x.max() == 44
+    assert y.min() == np.min(r[10:45])
+    assert y.max() == np.max(r[10:45])
+
+    r.clear()
+    assert len(r.envelope(1).mins) == 0
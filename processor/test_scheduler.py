@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from typing import Any, List
+
+from processor.scheduler import AnalysisScheduler
+
+
+class CountingGenerator:
+    def __init__(self):
+        self.run_every = 0.01
+        self.analyze_every = 1.0
+        self._last_ana = time.monotonic()
+        self.logger = logging.getLogger("test")
+        self.steps = 0
+        self.threads = set()
+
+    def step(self):
+        self.steps += 1
+        self.threads.add(threading.get_ident())
+
+
+def test_scheduler():
+    # Stand-ins for Generator, which only need step and the timing attributes
+    gens: List[Any] = [CountingGenerator() for _ in range(5)]
+
+    with AnalysisScheduler(workers=2) as scheduler:
+        for gen in gens:
+            scheduler.add(gen)
+
+        time.sleep(0.2)
+        for gen in gens:
+            scheduler.remove(gen)
+
+        steps = [gen.steps for gen in gens]
+        time.sleep(0.05)
+        assert [gen.steps for gen in gens] == steps
+        assert scheduler.lags == {}
+
+    assert all(gen.steps > 3 for gen in gens)
+    assert len(set.union(*(gen.threads for gen in gens))) <= 2
+
+    # The full analysis deadlines are spread out
+    phases = sorted(time.monotonic() - gen._last_ana for gen in gens)
+    assert phases[-1] - phases[0] > 0.5
+
+
+class FailingGenerator(CountingGenerator):
+    def step(self):
+        super().step()
+        raise RuntimeError("analysis bug")
+
+
+class SlowGenerator(CountingGenerator):
+    def step(self):
+        super().step()
+        time.sleep(0.03)
+
+
+def test_scheduler_failed_and_lag(caplog):
+    failing: Any = FailingGenerator()
+    slow: List[Any] = [SlowGenerator() for _ in range(3)]
+
+    with caplog.at_level(logging.INFO, logger="test"):
+        with AnalysisScheduler(workers=1) as scheduler:
+            scheduler.add(failing)
+            for gen in slow:
+                scheduler.add(gen)
+
+            time.sleep(0.2)
+            assert scheduler.failed == {failing}
+            assert failing.steps == 1
+
+            for gen in slow:
+                scheduler.remove(gen)
+            scheduler.remove(failing)
+            assert scheduler.failed == set()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Analysis stopped after an error" in messages
+    assert any(message.startswith("Analysis running") for message in messages)
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+from numpy.testing import assert_allclose
+
+from processor.wire import (
+    TOPIC,
+    Frame,
+    Sample,
+    Subscribers,
+    pack_frame,
+    pack_meta,
+    pack_sample,
+    unpack,
+)
+
+
+def test_wire_roundtrip():
+    sample = unpack(pack_sample(Sample(123456, 1.5, -2.25, seq=2 ** 40)))
+    assert sample == Sample(123456, 1.5, -2.25, seq=2 ** 40)
+
+    sample = unpack(pack_sample(Sample(7, 0.0, 1.0, co2=(400.0, 20.5, 50.0))))
+    assert isinstance(sample, Sample)
+    assert sample.heat is None
+    assert sample.co2 == pytest.approx((400.0, 20.5, 50.0))
+
+    sample = unpack(pack_sample(Sample(7, 0.0, 1.0, (30.0, 5.0), (1.0, 2.0, 3.0))))
+    assert isinstance(sample, Sample)
+    assert sample.heat == (30.0, 5.0)
+    assert sample.co2 == (1.0, 2.0, 3.0)
+
+    meta = {"rotary": {"Alarm": {"value": 1}}, "mac": "00:11"}
+    assert unpack(pack_meta(meta)) == meta
+
+    # Older collectors send JSON
+    assert unpack(json.dumps({"t": 1, "f": 2, "p": 3}).encode()) == {
+        "t": 1,
+        "f": 2,
+        "p": 3,
+    }
+
+
+def test_wire_frame():
+    samples = [
+        Sample(1000, 1.0, 2.0, seq=7),
+        Sample(1020, 1.5, 2.5, heat=(30.0, 5.0), seq=8),
+        Sample(1040, 2.0, 3.0, co2=(400.0, 20.0, 50.0), seq=9),
+    ]
+    message = pack_frame(samples)
+    frame = unpack(message)
+    assert isinstance(frame, Frame)
+
+    assert frame.seq == 7
+
+    assert_allclose(frame.flow, [[1000, 1020, 1040], [1, 1.5, 2], [2, 2.5, 3]])
+    assert_allclose(frame.heat, [[1020], [30], [5]])
+    assert_allclose(frame.co2, [[1040], [400], [20], [50]])
+
+    frame = unpack(pack_frame([]))
+    assert isinstance(frame, Frame)
+    assert frame.flow.shape == (3, 0)
+
+    # The counts in the frame show when it was cut short
+    with pytest.raises(ValueError):
+        unpack(message[:-4])
+
+
+def test_wire_subscribers():
+    subscribers = Subscribers()
+    assert not subscribers.binary
+
+    subscribers.update(b"\x01{")
+    subscribers.update(b"\x01" + TOPIC)
+    assert subscribers.binary
+
+    # An older nurse station subscribes to everything
+    subscribers.update(b"\x01")
+    assert not subscribers.binary
+
+    subscribers.update(b"\x00")
+    assert subscribers.binary
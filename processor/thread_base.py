@@ -2,28 +2,79 @@
 from __future__ import annotations
 
 import threading
+from typing import Optional, Sequence
 
 import numpy as np
 
+from processor.config import config
 from processor.generator import Generator
-from processor.rolling import Rolling
+from processor.rolling import Rolling, RingBuffer
 
 
 class ThreadBase(threading.Thread):
-    def __init__(self, parent: Generator):
-        self._time = Rolling(window_size=parent.window_size, dtype=np.int64)
-        self._flow = Rolling(window_size=parent.window_size)
-        self._pressure = Rolling(window_size=parent.window_size)
+    """
+    A receiver thread for a generator. Samples are pushed into ring buffers
+    (one per group of aligned columns) as they arrive; the generator takes the
+    new rows directly in access_collected_data, without a lock for the data.
+    The lock protects the other values the thread collects.
+    """
 
-        self._heat_time = Rolling(window_size=parent.extras_window_size, dtype=np.int64)
-        self._heat_temp = Rolling(window_size=parent.extras_window_size)
-        self._heat_duty = Rolling(window_size=parent.extras_window_size)
+    parent: Generator
 
-        self._co2_time = Rolling(window_size=parent.extras_window_size, dtype=np.int64)
-        self._co2 = Rolling(window_size=parent.extras_window_size)
-        self._co2_temp = Rolling(window_size=parent.extras_window_size)
-        self._humidity = Rolling(window_size=parent.extras_window_size)
+    def __init__(self, parent: Generator):
+        # Only the samples between analysis steps are held here
+        capacity = config["global"]["ring-size"].get(int)
+        self._flow_ring = RingBuffer(("time", "flow", "pressure"), capacity=capacity)
+        self._heat_ring = RingBuffer(("time", "temp", "duty"), capacity=capacity)
+        self._co2_ring = RingBuffer(
+            ("time", "CO2", "temp", "humidity"), capacity=capacity
+        )
 
         self.lock = threading.Lock()
 
         super().__init__()
+
+    @staticmethod
+    def _inject_new(rows: np.ndarray, *targets: Rolling) -> None:
+        """
+        Inject rows (an array of columns by rows) into the targets, one target
+        per column. Rows that are not newer than the end of the first target
+        (the times) are skipped.
+        """
+
+        if rows.shape[1] and len(targets[0]):
+            rows = rows[:, np.searchsorted(rows[0], targets[0][-1], side="right") :]
+        if rows.shape[1]:
+            for target, column in zip(targets, rows):
+                target.inject(column)
+
+    def _inject_all(self, extra: Optional[Sequence[np.ndarray]] = None) -> None:
+        """
+        Copy the new data into the parent. Call with the parent lock held.
+
+        Extra rows for each ring (flow, heat, CO2), too many to push, can be
+        given; they are injected after the rows in the rings.
+        """
+
+        parent = self.parent
+        tables = (
+            (self._flow_ring, (parent._time, parent._flow, parent._pressure)),
+            (
+                self._heat_ring,
+                (parent._heat_time, parent._heat_temp, parent._heat_duty),
+            ),
+            (
+                self._co2_ring,
+                (parent._co2_time, parent._co2, parent._co2_temp, parent._humidity),
+            ),
+        )
+        for i, (ring, targets) in enumerate(tables):
+            dropped = ring.dropped
+            self._inject_new(ring.pop(), *targets)
+            if ring.dropped > dropped:
+                parent.logger.warning(
+                    f"Analysis fell behind, dropped {ring.dropped - dropped} "
+                    f"rows of {', '.join(ring.columns)}"
+                )
+            if extra is not None:
+                self._inject_new(extra[i], *targets)
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import json
+import struct
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+# The packed messages from a collector to the nurse stations. Every message
+# starts with the magic bytes, the version, and the message type; JSON
+# messages (from older collectors) always start with "{" instead. Version 2
+# added sequence numbers.
+MAGIC = b"PV"
+WIRE_VERSION = 2
+
+# Nurse stations that understand this version subscribe to this prefix
+TOPIC = MAGIC + bytes([WIRE_VERSION])
+
+# Nurse stations subscribe to this prefix for JSON messages
+JSON_TOPIC = b"{"
+
+# Message types
+SAMPLE = 1  # one sample, optionally with the heater and CO2 readings
+META = 2  # the rotary and box information, as JSON after the header
+FRAME = 3  # many samples, as arrays
+
+# Flags for the optional blocks of a sample
+HAS_HEAT = 1
+HAS_CO2 = 2
+
+_HEADER = struct.Struct("<2sBB")
+
+# Header, sequence number, time (ms), flow, pressure, flags; then the blocks in
+# flag order
+_SAMPLE = struct.Struct("<2sBBQqffB")
+_HEAT = struct.Struct("<ff")  # temperature, duty
+_CO2 = struct.Struct("<fff")  # CO2, temperature, humidity
+
+# Header, sequence number of the first sample, number of samples, heater
+# readings, and CO2 readings; then for each, the times (ms, int64), then each
+# value column (float32)
+_FRAME = struct.Struct("<2sBBQIII")
+_FRAME_COLUMNS = (3, 3, 4)  # time, flow, pressure; time + _HEAT; time + _CO2
+
+
+class Sample(NamedTuple):
+    t: int
+    f: float
+    p: float
+    heat: Optional[Tuple[float, float]] = None
+    co2: Optional[Tuple[float, float, float]] = None
+
+    # Counts the samples sent by a collector, so receivers can find gaps
+    seq: int = 0
+
+
+class Frame(NamedTuple):
+    """
+    The samples of a frame as arrays of columns by rows, like RingBuffer.
+    """
+
+    flow: np.ndarray  # time, flow, pressure
+    heat: np.ndarray  # time, temperature, duty
+    co2: np.ndarray  # time, CO2, temperature, humidity
+
+    # The sequence number of the first sample
+    seq: int = 0
+
+
+def pack_sample(sample: Sample) -> bytes:
+    flags = (HAS_HEAT if sample.heat is not None else 0) | (
+        HAS_CO2 if sample.co2 is not None else 0
+    )
+    message = _SAMPLE.pack(
+        MAGIC,
+        WIRE_VERSION,
+        SAMPLE,
+        sample.seq,
+        int(sample.t),
+        sample.f,
+        sample.p,
+        flags,
+    )
+    if sample.heat is not None:
+        message += _HEAT.pack(*sample.heat)
+    if sample.co2 is not None:
+        message += _CO2.pack(*sample.co2)
+    return message
+
+
+def pack_meta(meta: Dict[str, Any]) -> bytes:
+    return _HEADER.pack(MAGIC, WIRE_VERSION, META) + json.dumps(meta).encode()
+
+
+def pack_frame(samples: Sequence[Sample]) -> bytes:
+    rows = (
+        [(s.t, s.f, s.p) for s in samples],
+        [(s.t, *s.heat) for s in samples if s.heat is not None],
+        [(s.t, *s.co2) for s in samples if s.co2 is not None],
+    )
+    flow, heat, co2 = (
+        np.asarray(array, dtype=np.double).reshape(-1, columns).T
+        for array, columns in zip(rows, _FRAME_COLUMNS)
+    )
+    return pack_frame_arrays(Frame(flow, heat, co2, samples[0].seq if samples else 0))
+
+
+def pack_frame_arrays(frame: Frame) -> bytes:
+    counts = tuple(array.shape[1] for array in frame[:3])
+    parts = [_FRAME.pack(MAGIC, WIRE_VERSION, FRAME, frame.seq, *counts)]
+    for array in frame[:3]:
+        parts.append(array[0].astype("<i8").tobytes())
+        parts.append(array[1:].astype("<f4").tobytes())
+    return b"".join(parts)
+
+
+def _unpack_frame(message: bytes) -> Frame:
+    if len(message) < _FRAME.size:
+        raise ValueError(f"Frame header is {len(message)} bytes")
+    seq, *counts = _FRAME.unpack_from(message)[3:]
+
+    # The counts tell how long the frame should be
+    expected = _FRAME.size + sum(
+        count * (8 + 4 * (columns - 1))
+        for count, columns in zip(counts, _FRAME_COLUMNS)
+    )
+    if len(message) != expected:
+        raise ValueError(
+            f"Frame of {counts[0]} samples is {len(message)} bytes, expected {expected}"
+        )
+
+    arrays = []
+    offset = _FRAME.size
+    for count, columns in zip(counts, _FRAME_COLUMNS):
+        array = np.empty((columns, count), dtype=np.double)
+        array[0] = np.frombuffer(message, "<i8", count, offset)
+        offset += 8 * count
+        array[1:] = np.frombuffer(
+            message, "<f4", count * (columns - 1), offset
+        ).reshape(columns - 1, count)
+        offset += 4 * count * (columns - 1)
+        arrays.append(array)
+
+    flow, heat, co2 = arrays
+    return Frame(flow, heat, co2, seq)
+
+
+def unpack(message: bytes) -> Union[Sample, Frame, Dict[str, Any]]:
+    """
+    Decode a message: a Sample, a Frame, or a dict for metadata and for JSON
+    messages. A ValueError is raised for a message that can't be read, like
+    a truncated frame.
+    """
+
+    if message[:2] != MAGIC:
+        return json.loads(message)
+
+    _, version, kind = _HEADER.unpack_from(message)
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire version {version}")
+
+    if kind == META:
+        return json.loads(message[_HEADER.size :])
+
+    if kind == SAMPLE:
+        _, _, _, seq, t, f, p, flags = _SAMPLE.unpack_from(message)
+        offset = _SAMPLE.size
+        heat: Optional[Tuple[float, float]] = None
+        co2: Optional[Tuple[float, float, float]] = None
+        if flags & HAS_HEAT:
+            temp, duty = _HEAT.unpack_from(message, offset)
+            heat = (temp, duty)
+            offset += _HEAT.size
+        if flags & HAS_CO2:
+            value, temp, humidity = _CO2.unpack_from(message, offset)
+            co2 = (value, temp, humidity)
+        return Sample(t, f, p, heat, co2, seq)
+
+    if kind == FRAME:
+        return _unpack_frame(message)
+
+    raise ValueError(f"Unknown message type {kind}")
+
+
+class Subscribers:
+    """
+    Tracks the subscriptions seen by an XPUB socket, to decide if the packed
+    format can be sent. Older nurse stations subscribe to everything and only
+    read JSON, so while any of them are connected, JSON is sent to all.
+    """
+
+    def __init__(self) -> None:
+        self._topics: Set[bytes] = set()
+
+    def update(self, message: bytes) -> None:
+        """
+        Record a subscription message (a 1 or 0 byte, then the topic).
+        """
+        if message[:1] == b"\x01":
+            self._topics.add(message[1:])
+        elif message[:1] == b"\x00":
+            self._topics.discard(message[1:])
+
+    @property
+    def binary(self) -> bool:
+        return TOPIC in self._topics and b"" not in self._topics